@@ -46,6 +46,12 @@ export async function POST(request: NextRequest) {
       
       case "run-training":
         return await runTraining(request);
+
+      case "training-status":
+        return await trainingStatus(request);
+
+      case "cancel-training":
+        return await cancelTraining(request);
       
       case "recognize":
         return await recognizeFaces(request);
@@ -201,22 +207,29 @@ async function runTraining(request: NextRequest) {
   }
 
   try {
-    // Call Python API
+    // Call Python API; training runs in the background, poll training-status for progress
     const response = await fetch(`${PYTHON_API_URL}/api/train`, {
       method: "POST",
       headers: { "Content-Type": "application/json" },
     });
 
+    const result = await response.json();
+
+    if (response.status === 409) {
+      return NextResponse.json(
+        { success: false, error: "Training already in progress", jobId: result.detail?.jobId },
+        { status: 409 }
+      );
+    }
     if (!response.ok) {
-      throw new Error("Training failed");
+      throw new Error(result.detail || "Training failed");
     }
 
-    const result = await response.json();
-
     return NextResponse.json({
       success: true,
-      message: "Training completed successfully",
-      results: result,
+      message: "Training started",
+      jobId: result.jobId,
+      job: result,
     });
   } catch (error: any) {
     return NextResponse.json(
@@ -226,6 +239,32 @@ async function runTraining(request: NextRequest) {
   }
 }
 
+async function trainingStatus(request: NextRequest) {
+  const body = await request.json();
+  const { jobId } = body;
+
+  const response = await fetch(
+    `${PYTHON_API_URL}/api/train/${jobId ? encodeURIComponent(jobId) : "latest"}`
+  );
+  const result = await response.json();
+  return NextResponse.json(result, { status: response.status });
+}
+
+async function cancelTraining(request: NextRequest) {
+  const body = await request.json();
+  const { jobId } = body;
+
+  if (!jobId) {
+    return NextResponse.json({ error: "Job ID required" }, { status: 400 });
+  }
+
+  const response = await fetch(`${PYTHON_API_URL}/api/train/${encodeURIComponent(jobId)}`, {
+    method: "DELETE",
+  });
+  const result = await response.json();
+  return NextResponse.json(result, { status: response.status });
+}
+
 async function recognizeFaces(request: NextRequest) {
   const formData = await request.formData();
   const courseId = formData.get("courseId") as string;
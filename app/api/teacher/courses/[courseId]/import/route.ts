@@ -3,6 +3,7 @@ import { NextRequest, NextResponse } from "next/server";
 import { PrismaClient } from "@prisma/client";
 import jwt from "jsonwebtoken";
 import { hashPassword } from "@/lib/auth";
+import { invalidateCourseGallery } from "@/lib/recognizer";
 
 const prisma = new PrismaClient();
 const JWT_SECRET = process.env.JWT_SECRET || "your-secret-key";
@@ -157,6 +158,10 @@ export async function POST(
       }
     }
 
+    if (results.successful.length > 0) {
+      await invalidateCourseGallery(courseId);
+    }
+
     return NextResponse.json({
       message: "Import completed",
       results,
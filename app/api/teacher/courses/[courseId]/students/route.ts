@@ -3,6 +3,7 @@
 import { NextRequest, NextResponse } from "next/server";
 import { PrismaClient } from "@prisma/client";
 import { verifyToken } from "@/lib/auth";
+import { invalidateCourseGallery } from "@/lib/recognizer";
 import fs from "fs";
 import path from "path";
 
@@ -213,6 +214,7 @@ export async function DELETE(
         },
       },
     });
+    await invalidateCourseGallery(courseId);
 
     return NextResponse.json({ 
       success: true, 
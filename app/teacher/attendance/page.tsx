@@ -65,6 +65,19 @@ interface Student {
   hasPhotos?: boolean;
 }
 
+// Background training job, as reported by the Python API (GET /api/train/{jobId})
+interface TrainingJob {
+  jobId: string;
+  status: "queued" | "running" | "succeeded" | "failed" | "cancelled";
+  studentsTotal: number;
+  studentsProcessed: number;
+  etaSeconds: number | null;
+  errors: string[];
+  result: { studentsTrained: number } | null;
+}
+
+const TRAINING_POLL_MS = 2000;
+
 interface FlattenedCourse extends Course {
   departmentName: string;
   programName: string;
@@ -154,6 +167,7 @@ export default function TeacherAttendance() {
   const [students, setStudents] = useState<Student[]>([]);
   const [loading, setLoading] = useState(false);
   const [training, setTraining] = useState(false);
+  const [trainingJob, setTrainingJob] = useState<TrainingJob | null>(null);
 
   // Flatten all courses into a searchable list
   const allCourses = useMemo(() => {
@@ -316,26 +330,57 @@ export default function TeacherAttendance() {
     }
 
     setTraining(true);
+    setTrainingJob(null);
     try {
       const token = localStorage.getItem("token");
-      const res = await fetch("/api/train", {
+      const headers = {
+        "Content-Type": "application/json",
+        Authorization: `Bearer ${token}`,
+      };
+
+      // Training runs as a background job on the Python API; start it, then poll its status
+      const res = await fetch("/api/teacher/attendance?operation=run-training", {
         method: "POST",
-        headers: {
-          Authorization: `Bearer ${token}`,
-        },
+        headers,
+        body: JSON.stringify({ courseId: selectedCourse.id }),
       });
       const data = await res.json();
-      if (res.ok) {
-        alert("✅ " + data.message);
-        fetchCourseStudents(selectedCourse.id);
+      // 409: a training run is already going on; follow that one instead
+      if (!res.ok && !(res.status === 409 && data.jobId)) {
+        alert("❌ " + (data.details || data.error || "Training failed"));
+        return;
+      }
+
+      let job: TrainingJob = data.job || { jobId: data.jobId, status: "queued" };
+      setTrainingJob(job);
+      while (job.status === "queued" || job.status === "running") {
+        await new Promise((resolve) => setTimeout(resolve, TRAINING_POLL_MS));
+        const statusRes = await fetch("/api/teacher/attendance?operation=training-status", {
+          method: "POST",
+          headers,
+          body: JSON.stringify({ jobId: job.jobId }),
+        });
+        if (!statusRes.ok) {
+          throw new Error(`Training status unavailable (${statusRes.status})`);
+        }
+        job = await statusRes.json();
+        setTrainingJob(job);
+      }
+
+      if (job.status === "succeeded") {
+        const trainedNow = job.result?.studentsTrained ?? job.studentsProcessed;
+        const warnings = job.errors.length ? `\n\n⚠️ ${job.errors.join("\n")}` : "";
+        alert(`✅ Training completed (${trainedNow} student${trainedNow === 1 ? "" : "s"} trained)${warnings}`);
       } else {
-        alert("❌ " + (data.error || "Training failed"));
+        alert(`❌ Training ${job.status}: ${job.errors.join("; ") || "unknown error"}`);
       }
+      fetchCourseStudents(selectedCourse.id);
     } catch (error) {
       console.error("Training error:", error);
-      alert("Error while running training script");
+      alert("Error while running training");
     } finally {
       setTraining(false);
+      setTrainingJob(null);
     }
   }
 
@@ -669,14 +714,26 @@ export default function TeacherAttendance() {
                   <div className="mt-2 rounded-xl border border-emerald-200 bg-emerald-50 px-3 py-3 text-xs sm:text-sm text-emerald-900 space-y-2">
                     <p className="font-semibold flex items-center gap-2">
                       <span className="inline-flex h-3 w-3 rounded-full bg-emerald-500" />
-                      Training embeddings for {untrainedCount} untrained student
-                      {untrainedCount === 1 ? "" : "s"}...
+                      {trainingJob && trainingJob.studentsTotal > 0
+                        ? `Training embeddings: ${trainingJob.studentsProcessed} of ${trainingJob.studentsTotal} students`
+                        : `Training embeddings for ${untrainedCount} untrained student${untrainedCount === 1 ? "" : "s"}...`}
                     </p>
                     <p className="text-emerald-800/80">
-                      Keep this page open while the training runs on the server.
+                      {trainingJob?.etaSeconds != null
+                        ? `About ${Math.ceil(trainingJob.etaSeconds)}s remaining.`
+                        : "Keep this page open while the training runs on the server."}
                     </p>
                     <div className="w-full h-2 rounded-full bg-emerald-100 overflow-hidden">
-                      <div className="h-full w-3/4 bg-emerald-500/90 animate-pulse rounded-full" />
+                      {trainingJob && trainingJob.studentsTotal > 0 ? (
+                        <div
+                          className="h-full bg-emerald-500/90 rounded-full transition-all"
+                          style={{
+                            width: `${Math.round((trainingJob.studentsProcessed / trainingJob.studentsTotal) * 100)}%`,
+                          }}
+                        />
+                      ) : (
+                        <div className="h-full w-3/4 bg-emerald-500/90 animate-pulse rounded-full" />
+                      )}
                     </div>
                   </div>
                 )}
@@ -0,0 +1,217 @@
+# batching.py
+"""
+Cross-request micro-batching for face detection and embedding.
+
+Concurrent requests (executor threads) submit frames and aligned face crops to
+a MicroBatcher, which waits a few milliseconds for more work, runs everything
+collected through the ONNX session as one batch and routes each caller's slice
+of the results back. BatchScheduler wraps a prepared FaceAnalysis app and
+exposes the same get() / models interface, so recognition and training code
+use it unchanged. Detectors exported with a fixed batch size of 1 (buffalo_l's
+det_10g) can't be batched, so their detection stays in the caller's thread.
+"""
+import copy
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+import cv2
+import numpy as np
+
+
+class _FixedOutputs:
+    """Stands in for an ONNX session whose outputs were already computed in a batch."""
+
+    def __init__(self, outputs):
+        self.outputs = outputs
+
+    def run(self, output_names, feed):
+        return self.outputs
+
+
+def letterbox(img, det_size):
+    """Same resize-into-canvas as SCRFD.detect."""
+    input_w, input_h = det_size
+    im_ratio = float(img.shape[0]) / img.shape[1]
+    if im_ratio > float(input_h) / input_w:
+        new_height = input_h
+        new_width = int(new_height / im_ratio)
+    else:
+        new_width = input_w
+        new_height = int(new_width * im_ratio)
+    det_img = np.zeros((input_h, input_w, 3), dtype=np.uint8)
+    det_img[:new_height, :new_width, :] = cv2.resize(img, (new_width, new_height))
+    return det_img
+
+
+def detector_batchable(det):
+    """True if an SCRFD detector takes several images per ONNX call (batched outputs, dynamic batch dimension)."""
+    return getattr(det, "batched", False) and not isinstance(det.input_shape[0], int)
+
+
+def detect_batch(det, imgs, det_size):
+    """
+    Run an SCRFD detector on several images. One ONNX call when the model was
+    exported with a dynamic batch dimension, otherwise one call per image.
+    Returns one (bboxes (n, 5), kpss (n, 5, 2) or None) per image.
+    """
+    if len(imgs) == 1 or not detector_batchable(det):
+        return [det.detect(img, max_num=0, metric="default") for img in imgs]
+
+    blob = cv2.dnn.blobFromImages(
+        [letterbox(img, det_size) for img in imgs],
+        1.0 / det.input_std,
+        tuple(det_size),
+        (det.input_mean, det.input_mean, det.input_mean),
+        swapRB=True,
+    )
+    outputs = det.session.run(det.output_names, {det.input_name: blob})
+    results = []
+    for i, img in enumerate(imgs):
+        # Reuse SCRFD's own decoding/NMS on this image's slice of the batch output
+        single = copy.copy(det)
+        single.session = _FixedOutputs([out[i:i + 1] for out in outputs])
+        results.append(single.detect(img, max_num=0, metric="default"))
+    return results
+
+
+class MicroBatcher:
+    """
+    Collects items submitted from any thread for up to window_ms (or until
+    max_batch items are waiting) and calls batch_fn(items) once for all of
+    them. batch_fn must return one result per item, in order.
+    """
+
+    def __init__(self, batch_fn, window_ms=5.0, max_batch=32, name="batcher"):
+        self.batch_fn = batch_fn
+        self.window = window_ms / 1000.0
+        self.max_batch = max_batch
+        self._queue = queue.Queue()
+        self._thread = threading.Thread(target=self._loop, name=name, daemon=True)
+        self._thread.start()
+
+    def submit(self, items):
+        """Queue items and block until their results are ready. Returns a list, one result per item."""
+        futures = []
+        for item in items:
+            future = Future()
+            self._queue.put((item, future))
+            futures.append(future)
+        return [future.result() for future in futures]
+
+    def _loop(self):
+        while True:
+            batch = [self._queue.get()]
+            deadline = time.monotonic() + self.window
+            while len(batch) < self.max_batch:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self._queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+
+            items = [item for item, _ in batch]
+            try:
+                results = self.batch_fn(items)
+            except Exception as e:
+                for _, future in batch:
+                    future.set_exception(e)
+                continue
+            for (_, future), result in zip(batch, results):
+                future.set_result(result)
+
+
+class _BatchedRecognition:
+    """ArcFace model facade whose get_feat() goes through the embedding batcher."""
+
+    def __init__(self, rec_model, batcher):
+        self._rec_model = rec_model
+        self._batcher = batcher
+        self.input_size = rec_model.input_size
+        self.taskname = rec_model.taskname
+
+    def get_feat(self, imgs):
+        if not isinstance(imgs, list):
+            imgs = [imgs]
+        return np.stack(self._batcher.submit(imgs))
+
+    def __getattr__(self, name):
+        return getattr(self._rec_model, name)
+
+
+class BatchScheduler:
+    """
+    Drop-in replacement for a prepared FaceAnalysis app (detection + recognition)
+    that batches detector and ArcFace inference across concurrent callers.
+
+    Detection is only batched when the detector was exported with a dynamic
+    batch dimension; otherwise each caller runs it directly in its own thread,
+    since a batcher thread would only serialize the calls and add its window
+    as latency.
+    """
+
+    def __init__(self, face_app, window_ms=5.0, max_batch=32):
+        self.face_app = face_app
+        self.det_model = face_app.det_model
+        self.rec_model = face_app.models.get("recognition")
+        self.det_size = tuple(face_app.det_size)
+        self.profile_stats = getattr(face_app, "profile_stats", None)
+        self._detector = None
+        if detector_batchable(self.det_model):
+            self._detector = MicroBatcher(self._detect_batch, window_ms, max_batch, name="detect-batcher")
+        self._embedder = MicroBatcher(self._embed_batch, window_ms, max_batch, name="embed-batcher")
+        self.models = dict(face_app.models)
+        if self.rec_model is not None:
+            self.models["recognition"] = _BatchedRecognition(self.rec_model, self._embedder)
+
+    # -- batch functions (run on the batcher threads) --
+
+    def _embed_batch(self, crops):
+        try:
+            return list(self.rec_model.get_feat(crops))
+        except Exception:
+            if len(crops) == 1:
+                raise
+            # Models exported with a fixed batch size of 1
+            return [self.rec_model.get_feat([crop])[0] for crop in crops]
+
+    def _detect_batch(self, imgs):
+        return detect_batch(self.det_model, imgs, self.det_size)
+
+    # -- FaceAnalysis-compatible interface --
+
+    def detect(self, img):
+        """(bboxes (n, 5), kpss (n, 5, 2) or None) for one image, batched with other callers when possible."""
+        return self.detect_many([img])[0]
+
+    def detect_many(self, imgs):
+        """detect() for several images (e.g. the tiles of one frame) in the same batch."""
+        if self._detector is None:
+            return detect_batch(self.det_model, imgs, self.det_size)
+        return self._detector.submit(imgs)
+
+    def get(self, img, max_num=0):
+        from insightface.app.common import Face
+        from insightface.utils import face_align
+
+        bboxes, kpss = self.detect(img)
+        if bboxes.shape[0] == 0:
+            return []
+        faces = []
+        for i in range(bboxes.shape[0]):
+            faces.append(Face(bbox=bboxes[i, 0:4], kps=None if kpss is None else kpss[i], det_score=bboxes[i, 4]))
+        if self.rec_model is not None and kpss is not None:
+            size = self.rec_model.input_size[0]
+            crops = [face_align.norm_crop(img, landmark=face.kps, image_size=size) for face in faces]
+            for face, feat in zip(faces, self._embedder.submit(crops)):
+                face.embedding = np.asarray(feat).flatten()
+        # Any other heads (full profile) run per face as in FaceAnalysis.get
+        for taskname, model in self.face_app.models.items():
+            if taskname in ("detection", "recognition"):
+                continue
+            for face in faces:
+                model.get(img, face)
+        return faces
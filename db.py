@@ -0,0 +1,195 @@
+# db.py
+"""
+Postgres access shared by the API and the scripts.
+
+Connections come from one lazily created psycopg2 pool instead of a fresh
+connect() per query; with a managed Postgres the TLS/auth handshake costs far
+more than the queries themselves. Trained embeddings are written with one
+set-based UPDATE per training run rather than a statement (and a connection)
+per student. Replicas that read the gallery from the database follow changes
+through a LISTEN/NOTIFY trigger on "Student"."faceEmbedding".
+
+psycopg2 is imported on first use, so processes that never reach the
+database don't load it.
+"""
+import threading
+from contextlib import contextmanager
+
+
+class Database:
+    """
+    Thread-safe connection pool for DATABASE_URL. connection() yields None
+    when no URL is configured, the server can't be reached or the pool is
+    exhausted, matching the old get_db_connection() contract; creating the
+    pool is retried on the next call.
+    """
+
+    def __init__(self, dsn, minconn=1, maxconn=5):
+        self.dsn = dsn
+        self.minconn = minconn
+        self.maxconn = maxconn
+        self._pool = None
+        self._lock = threading.Lock()
+
+    def _get_pool(self):
+        if self._pool is None and self.dsn:
+            with self._lock:
+                if self._pool is None:
+                    try:
+                        from psycopg2 import pool as pg_pool
+
+                        self._pool = pg_pool.ThreadedConnectionPool(self.minconn, self.maxconn, self.dsn)
+                    except Exception as e:
+                        print(f"Database connection failed: {e}")
+        return self._pool
+
+    @contextmanager
+    def connection(self):
+        """Borrow a pooled connection (None without a database); rolled back on error and returned to the pool."""
+        pool = self._get_pool()
+        if pool is None:
+            yield None
+            return
+        try:
+            conn = pool.getconn()
+        except Exception as e:
+            # PoolError when every connection is in use, OperationalError when reconnecting fails
+            print(f"Database connection failed: {e}")
+            yield None
+            return
+        try:
+            yield conn
+        except Exception:
+            if not conn.closed:
+                conn.rollback()
+            raise
+        finally:
+            # Broken connections are discarded instead of handed to the next caller
+            pool.putconn(conn, close=bool(conn.closed))
+
+    def listen_connection(self):
+        """
+        A dedicated autocommit connection outside the pool, for LISTEN: it is
+        held for as long as the listener runs, so it must not take a pool slot.
+        """
+        import psycopg2
+
+        conn = psycopg2.connect(self.dsn)
+        conn.autocommit = True
+        return conn
+
+    def close(self):
+        with self._lock:
+            if self._pool is not None:
+                self._pool.closeall()
+                self._pool = None
+
+
+UPSERT_EMBEDDINGS_SQL = """
+    WITH data (key, embedding) AS (VALUES %s),
+    matched AS (
+        SELECT d.key, s.id AS student_id, d.embedding
+        FROM data d
+        JOIN "Student" s ON s.id = d.key
+        {email_prefix_match}
+    )
+    UPDATE "Student" st
+    SET "faceEmbedding" = m.embedding
+    FROM matched m
+    WHERE st.id = m.student_id
+    RETURNING m.key
+"""
+
+# Folders named after the email prefix instead of the student id (hand-made
+# dataset folders of scripts/train_faces.py); a prefix can match several users
+EMAIL_PREFIX_MATCH_SQL = """
+        UNION ALL
+        SELECT d.key, s.id, d.embedding
+        FROM data d
+        JOIN "User" u ON u.email LIKE d.key || '%%'
+        JOIN "Student" s ON s."userId" = u.id
+        WHERE NOT EXISTS (SELECT 1 FROM "Student" s2 WHERE s2.id = d.key)
+"""
+
+
+def upsert_embeddings(conn, embeddings, match_email_prefix=False):
+    """
+    Store {student folder: embedding} in Student.faceEmbedding with one
+    statement. A folder matches the student with that id; with
+    match_email_prefix, a folder matching no id falls back to the students
+    whose user email starts with it. Returns the set of folders that matched
+    at least one student.
+    """
+    if not embeddings:
+        return set()
+    import psycopg2
+    from psycopg2.extras import execute_values
+
+    rows = [(key, psycopg2.Binary(emb.tobytes())) for key, emb in embeddings.items()]
+    cursor = conn.cursor()
+    try:
+        returned = execute_values(
+            cursor,
+            UPSERT_EMBEDDINGS_SQL.format(email_prefix_match=EMAIL_PREFIX_MATCH_SQL if match_email_prefix else ""),
+            rows,
+            template="(%s, %s::bytea)",
+            page_size=max(len(rows), 1),
+            fetch=True,
+        )
+        conn.commit()
+    finally:
+        cursor.close()
+    return {row[0] for row in returned}
+
+
+# Change feed for replicas that mirror the gallery from the database: every
+# write to a student's faceEmbedding (or a deleted student) sends the student
+# id on EMBEDDING_CHANNEL when its transaction commits
+EMBEDDING_CHANNEL = "student_face_embedding"
+
+EMBEDDING_TRIGGER_SQL = f"""
+    CREATE OR REPLACE FUNCTION notify_face_embedding_change() RETURNS trigger AS $$
+    BEGIN
+        PERFORM pg_notify('{EMBEDDING_CHANNEL}', COALESCE(NEW.id, OLD.id));
+        RETURN NULL;
+    END
+    $$ LANGUAGE plpgsql;
+    DROP TRIGGER IF EXISTS student_face_embedding_notify ON "Student";
+    CREATE TRIGGER student_face_embedding_notify
+        AFTER INSERT OR DELETE OR UPDATE OF "faceEmbedding" ON "Student"
+        FOR EACH ROW EXECUTE FUNCTION notify_face_embedding_change();
+"""
+
+
+def install_embedding_trigger(conn):
+    """Create (or replace) the trigger that notifies EMBEDDING_CHANNEL of embedding changes."""
+    cursor = conn.cursor()
+    try:
+        cursor.execute(EMBEDDING_TRIGGER_SQL)
+        conn.commit()
+    finally:
+        cursor.close()
+
+
+def iter_face_embeddings(conn, student_ids=None, batch_size=2000):
+    """
+    Yield (student id, embedding bytes) for students with a faceEmbedding, all
+    of them or only student_ids. Rows are streamed through a server-side
+    cursor, batch_size at a time, instead of materializing the whole table.
+    """
+    cursor = conn.cursor(name="face_embeddings")
+    cursor.itersize = batch_size
+    try:
+        if student_ids is None:
+            cursor.execute('SELECT id, "faceEmbedding" FROM "Student" WHERE "faceEmbedding" IS NOT NULL')
+        else:
+            cursor.execute(
+                'SELECT id, "faceEmbedding" FROM "Student" WHERE "faceEmbedding" IS NOT NULL AND id = ANY(%s)',
+                (list(student_ids),),
+            )
+        for student_id, data in cursor:
+            yield student_id, bytes(data)
+    finally:
+        cursor.close()
+        # End the read transaction the named cursor lived in
+        conn.rollback()
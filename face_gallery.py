@@ -0,0 +1,474 @@
+# face_gallery.py
+"""
+Gallery of known face embeddings and vectorized matching.
+
+All known embeddings are held as one pre-normalized float32 matrix plus an id
+array, so scoring any number of candidate embeddings is a single matrix multiply
+instead of a Python loop over every student.
+
+Galleries are stored as one contiguous matrix behind a small JSON header and
+memory-mapped at load. float32 is the default and the fastest to match;
+float16 and int8 only save memory and disk (half and a quarter), at some
+matching speed and score precision, for galleries too large to keep in float32. ResidentGallery keeps the loaded matcher in process
+memory and swaps in a new one when the gallery file changes.
+CourseGalleryCache narrows it to the students enrolled in one course.
+Matching goes through a nearest-neighbour index (face_index): exhaustive by
+default, or an IVF index built at training time for very large galleries.
+"""
+import json
+import os
+import pickle
+import threading
+import time
+
+import numpy as np
+
+from face_index import ExactIndex
+
+
+def normalize_rows(vectors):
+    """L2-normalize each row of a 2D array (zero rows are left as zeros)."""
+    vectors = np.asarray(vectors, dtype=np.float32)
+    if vectors.ndim == 1:
+        vectors = vectors.reshape(1, -1)
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return vectors / norms
+
+
+GALLERY_DTYPES = ("float32", "float16", "int8")
+
+# Quantized galleries are scored this many rows at a time, so only one block is
+# ever widened to float32 for the BLAS multiply
+SCORE_BLOCK_ROWS = 8192
+
+
+def quantize_rows(matrix, dtype):
+    """
+    Encode a normalized float32 matrix as (stored matrix, per-row scales or None).
+    int8 uses one scale per row (max |value| / 127); float16 is a plain cast.
+    """
+    matrix = np.asarray(matrix, dtype=np.float32)
+    if dtype == "float32":
+        return np.ascontiguousarray(matrix), None
+    if dtype == "float16":
+        return np.ascontiguousarray(matrix, dtype=np.float16), None
+    if dtype == "int8":
+        scales = np.abs(matrix).max(axis=1) / 127.0 if len(matrix) else np.zeros(0, dtype=np.float32)
+        scales = np.where(scales > 0, scales, 1.0).astype(np.float32)
+        stored = np.clip(np.rint(matrix / scales[:, None]), -127, 127).astype(np.int8)
+        return np.ascontiguousarray(stored), scales
+    raise ValueError(f"Unsupported gallery dtype '{dtype}'")
+
+
+_EXACT = ExactIndex()
+
+
+class GalleryMatcher:
+    """
+    Known embeddings as an (n, d) normalized matrix with matching ids. The
+    matrix is float32, or float16 / int8 (with per-row scales) for quantized
+    galleries, which are scored without ever widening the whole matrix but
+    more slowly than float32: quantization is a memory option, not a speedup.
+    `index` is the nearest-neighbour index searched for matches (None: exact).
+    """
+
+    def __init__(self, ids, embeddings):
+        self.ids = np.asarray(list(ids), dtype=object)
+        if len(self.ids) == 0:
+            self.matrix = np.zeros((0, 0), dtype=np.float32)
+        else:
+            self.matrix = np.ascontiguousarray(normalize_rows(np.stack(embeddings)))
+        if self.matrix.shape[0] != len(self.ids):
+            raise ValueError("ids and embeddings must have the same length")
+        self.scales = None
+        self.index = None
+        self.header = {}
+
+    @classmethod
+    def from_dict(cls, known_faces):
+        """Build from a {student_id: embedding} dict."""
+        ids = list(known_faces.keys())
+        return cls(ids, [np.asarray(known_faces[i], dtype=np.float32).ravel() for i in ids])
+
+    @classmethod
+    def from_matrix(cls, ids, matrix, scales=None):
+        """Wrap an already-normalized (n, d) matrix (and int8 row scales) without copying it."""
+        matcher = cls.__new__(cls)
+        matcher.ids = np.asarray(list(ids), dtype=object)
+        matcher.matrix = matrix
+        matcher.scales = scales
+        matcher.index = None
+        matcher.header = {}
+        return matcher
+
+    def __len__(self):
+        return len(self.ids)
+
+    @property
+    def dtype(self):
+        return self.matrix.dtype.name
+
+    @property
+    def nbytes(self):
+        """Memory held by the embeddings (matrix plus scales)."""
+        return self.matrix.nbytes + (self.scales.nbytes if self.scales is not None else 0)
+
+    def quantized(self, dtype):
+        """Copy of this gallery stored as dtype ("float32", "float16" or "int8")."""
+        stored, scales = quantize_rows(self.dense(), dtype)
+        matcher = GalleryMatcher.from_matrix(self.ids, stored, scales)
+        matcher.index = self.index  # same rows, same order
+        return matcher
+
+    def dense(self, rows=slice(None)):
+        """float32 view/copy of a slice (default all) of the gallery rows."""
+        block = self.matrix[rows]
+        if block.dtype == np.float32:
+            return block
+        block = block.astype(np.float32)
+        if self.scales is not None:
+            block *= self.scales[rows][:, None]
+        return block
+
+    def to_dict(self):
+        """The {student_id: embedding} dict form, e.g. to merge new students into and save."""
+        matrix = self.dense()
+        return {student_id: np.array(matrix[i]) for i, student_id in enumerate(self.ids)}
+
+    def subset(self, ids):
+        """Matcher restricted to the given ids (ids not in the gallery are ignored), searched exactly."""
+        wanted = {str(i).lower() for i in ids}
+        mask = np.array([str(i).lower() in wanted for i in self.ids], dtype=bool)
+        if not mask.any():
+            return GalleryMatcher([], [])
+        scales = None if self.scales is None else self.scales[mask]
+        return GalleryMatcher.from_matrix(self.ids[mask], np.ascontiguousarray(self.matrix[mask]), scales)
+
+    @property
+    def dim(self):
+        return self.matrix.shape[1] if len(self) else 0
+
+    def scores(self, queries):
+        """Cosine similarity of every query row against every gallery entry, shape (m, n)."""
+        queries = normalize_rows(queries)
+        if len(self) == 0 or queries.shape[0] == 0:
+            return np.zeros((queries.shape[0], len(self)), dtype=np.float32)
+        return self.score_rows(queries)
+
+    def score_rows(self, queries, start=0, end=None):
+        """Similarity of already-normalized queries against gallery rows start:end, clipped to [-1, 1]."""
+        end = len(self) if end is None else end
+        if self.matrix.dtype == np.float32:
+            return np.clip(queries @ self.matrix[start:end].T, -1.0, 1.0)
+
+        # numpy has no fast float16/int8 GEMM: widen one block of stored rows at
+        # a time and multiply in float32; int8 row scales are applied to the
+        # scores rather than to the matrix
+        sims = np.empty((queries.shape[0], end - start), dtype=np.float32)
+        for block_start in range(start, end, SCORE_BLOCK_ROWS):
+            block = self.matrix[block_start:min(block_start + SCORE_BLOCK_ROWS, end)].astype(np.float32)
+            sims[:, block_start - start:block_start - start + block.shape[0]] = queries @ block.T
+        if self.scales is not None:
+            sims *= self.scales[start:end]
+        # Rounded rows are no longer exactly unit length, so scores can overshoot 1
+        return np.clip(sims, -1.0, 1.0, out=sims)
+
+    def search(self, queries, k=1):
+        """
+        (row indices, scores) of the k best gallery rows per query, each (m, k),
+        best first, through the index. An approximate index can return fewer
+        than k rows; missing entries have index -1 and score -inf.
+        """
+        queries = normalize_rows(queries)
+        k = min(k, len(self))
+        if k == 0 or queries.shape[0] == 0:
+            return np.empty((queries.shape[0], 0), dtype=np.int64), np.empty((queries.shape[0], 0), dtype=np.float32)
+        return (self.index or _EXACT).search(self, queries, k)
+
+    def top_k(self, queries, k=1):
+        """Return (ids, scores), each of shape (m, k), best match first (id None where there is no match)."""
+        idx, sims = self.search(queries, k)
+        ids = self.ids[np.maximum(idx, 0)] if idx.size else np.empty(idx.shape, dtype=object)
+        ids[idx < 0] = None
+        return ids, sims
+
+    def best_match(self, candidates, threshold):
+        """
+        Best gallery match over all candidate embeddings of one face.
+        Returns (student_id, similarity) or (None, 0.0) if nothing exceeds threshold.
+        """
+        return self.best_matches([candidates], threshold)[0]
+
+    def assign_unique(self, queries, threshold):
+        """
+        Match faces of one image in order, each student at most once: every query
+        takes its best gallery entry not already taken by an earlier query.
+        Returns a list of (student_id, similarity) / (None, 0.0), one per query.
+        """
+        # A query's best untaken entry is among its top len(queries) entries
+        idx, sims = self.search(queries, len(queries))
+        taken, results = set(), []
+        for row in range(len(queries)):
+            match = (None, 0.0)
+            for col, sim in zip(idx[row], sims[row]):
+                if col < 0 or sim <= threshold:
+                    break
+                if col not in taken:
+                    taken.add(col)
+                    match = (self.ids[col], float(sim))
+                    break
+            results.append(match)
+        return results
+
+    def best_matches(self, candidate_groups, threshold):
+        """
+        Match several faces at once. candidate_groups is a list with one array of
+        candidate embeddings (k_i, d) per face; all candidates of all faces are
+        scored with one matrix multiply and reduced per face.
+        Returns a list of (student_id, similarity) / (None, 0.0), one per group.
+        """
+        results = [(None, 0.0)] * len(candidate_groups)
+        if len(self) == 0:
+            return results
+
+        blocks, owners = [], []
+        for group_idx, group in enumerate(candidate_groups):
+            if group is None or len(group) == 0:
+                continue
+            block = np.asarray(group, dtype=np.float32).reshape(-1, self.dim)
+            blocks.append(block)
+            owners.extend([group_idx] * block.shape[0])
+        if not blocks:
+            return results
+
+        queries = np.concatenate(blocks, axis=0)
+        # Zero-norm candidates never match (the old loop skipped them)
+        valid = np.linalg.norm(queries, axis=1) > 0
+        best_idx, best_sim = self.search(queries, 1)
+        best_idx, best_sim = best_idx[:, 0], best_sim[:, 0].copy()
+        best_sim[~valid] = -np.inf
+
+        owners = np.asarray(owners)
+        for group_idx in np.unique(owners):
+            rows = np.nonzero(owners == group_idx)[0]
+            row = rows[np.argmax(best_sim[rows])]
+            sim = float(best_sim[row])
+            if sim > threshold:
+                results[group_idx] = (self.ids[best_idx[row]], sim)
+        return results
+
+
+# On-disk gallery: MAGIC, then a little-endian u32 header length, a JSON header
+# (format version, model, dim, count, dtype, ids), zero padding to a 64-byte
+# boundary, and the (count, dim) row-normalized matrix in C order. int8
+# galleries follow it with their float32 row scales (header "scalesOffset").
+GALLERY_MAGIC = b"FGAL"
+GALLERY_VERSION = 1
+_ALIGN = 64
+
+
+def read_gallery_header(path):
+    """(header dict, byte offset of the matrix) of a gallery file."""
+    with open(path, "rb") as f:
+        if f.read(len(GALLERY_MAGIC)) != GALLERY_MAGIC:
+            raise ValueError(f"{path} is not a face gallery file")
+        header_len = int.from_bytes(f.read(4), "little")
+        header = json.loads(f.read(header_len).decode("utf-8"))
+    if header.get("version") != GALLERY_VERSION:
+        raise ValueError(f"Unsupported gallery format version {header.get('version')}")
+    offset = len(GALLERY_MAGIC) + 4 + header_len
+    return header, offset + (-offset % _ALIGN)
+
+
+def load_gallery(path, expected_model=None):
+    """
+    Memory-map a gallery file into a GalleryMatcher. The matrix is used in
+    place in its stored dtype (zero-copy, one page-cache copy shared by every
+    process), quantized galleries included.
+    """
+    header, offset = read_gallery_header(path)
+    if expected_model and header.get("model") and header["model"] != expected_model:
+        raise ValueError(f"Gallery was built with model '{header['model']}', expected '{expected_model}'")
+    ids, dim = header["ids"], header["dim"]
+    if not ids:
+        return GalleryMatcher([], [])
+    # np.asarray: plain ndarray views of the mapping, no copy
+    matrix = np.asarray(np.memmap(path, dtype=header["dtype"], mode="r", offset=offset, shape=(len(ids), dim)))
+    scales = None
+    if header["dtype"] == "int8":
+        scales = np.asarray(np.memmap(path, dtype=np.float32, mode="r", offset=header["scalesOffset"], shape=(len(ids),)))
+    matcher = GalleryMatcher.from_matrix(ids, matrix, scales)
+    matcher.header = header
+    return matcher
+
+
+def save_gallery(path, face_dict, model_name=None, dtype="float32"):
+    """
+    Write {student_id: embedding} as a gallery file (rows normalized, then
+    encoded as dtype), atomically via temp file + rename so readers never see
+    a partial file and processes that still map the old file keep a valid
+    view of it.
+    """
+    if dtype not in GALLERY_DTYPES:
+        raise ValueError(f"Unsupported gallery dtype '{dtype}'")
+    ids = [str(i) for i in face_dict]
+    if ids:
+        matrix = normalize_rows(np.stack([np.asarray(face_dict[i], dtype=np.float32).ravel() for i in face_dict]))
+    else:
+        matrix = np.zeros((0, 0), dtype=np.float32)
+    stored, scales = quantize_rows(matrix, dtype)
+
+    header = {
+        "version": GALLERY_VERSION,
+        "model": model_name,
+        "dim": int(matrix.shape[1]),
+        "count": len(ids),
+        "dtype": dtype,
+        "createdAt": time.time(),
+        "ids": ids,
+    }
+    # The scales offset depends on the header length, which depends on the offset's digits
+    scales_offset = 0
+    while True:
+        if scales is not None:
+            header["scalesOffset"] = scales_offset
+        header_bytes = json.dumps(header).encode("utf-8")
+        prefix = GALLERY_MAGIC + len(header_bytes).to_bytes(4, "little") + header_bytes
+        data_offset = len(prefix) + (-len(prefix) % _ALIGN)
+        matrix_end = data_offset + stored.nbytes
+        wanted = matrix_end + (-matrix_end % _ALIGN)
+        if scales is None or wanted == scales_offset:
+            break
+        scales_offset = wanted
+
+    tmp_path = f"{path}.tmp.{os.getpid()}"
+    with open(tmp_path, "wb") as f:
+        f.write(prefix.ljust(data_offset, b"\0"))
+        f.write(stored.tobytes())
+        if scales is not None:
+            f.write(b"\0" * (scales_offset - matrix_end))
+            f.write(scales.tobytes())
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+def migrate_legacy_gallery(legacy_path, path, model_name=None):
+    """
+    One-time conversion of a pickled {student_id: embedding} dict (the old
+    face_embeddings.pkl) into the gallery format. Does nothing if the new file
+    already exists or there is no legacy file. Returns True if it converted.
+    """
+    if os.path.exists(path) or not os.path.exists(legacy_path):
+        return False
+    with open(legacy_path, "rb") as f:
+        known_faces = pickle.load(f)
+    save_gallery(path, known_faces, model_name=model_name)
+    return True
+
+
+class ResidentGallery:
+    """
+    Process-resident gallery loaded once and reloaded when the file's mtime/size
+    changes (or on explicit reload). Each load builds a new GalleryMatcher and
+    swaps the reference, so a request that already holds a snapshot keeps
+    matching against a consistent gallery.
+    """
+
+    def __init__(self, path, loader=load_gallery):
+        self.path = path
+        self.loader = loader
+        self.version = 0
+        self._matcher = None
+        self._stamp = None
+        self._lock = threading.Lock()
+
+    def _file_stamp(self):
+        try:
+            st = os.stat(self.path)
+        except FileNotFoundError:
+            return None
+        return (st.st_mtime_ns, st.st_size)
+
+    def get(self):
+        """Current matcher snapshot (reloading first if the file changed), or None if there is no gallery."""
+        if self._file_stamp() != self._stamp:
+            self.reload()
+        return self._matcher
+
+    def reload(self):
+        """Reload from disk and swap atomically. A failed load keeps the previous snapshot."""
+        with self._lock:
+            stamp = self._file_stamp()
+            if stamp is None:
+                self._matcher, self._stamp = None, None
+                return None
+            if stamp == self._stamp and self._matcher is not None:
+                return self._matcher
+            try:
+                matcher = self.loader(self.path)
+            except Exception as e:
+                # Remember the stamp so a broken file isn't re-read on every request
+                self._stamp = stamp
+                print(f"Gallery reload failed, keeping previous version: {e}")
+                return self._matcher
+            self._matcher, self._stamp = matcher, stamp
+            self.version += 1
+            return matcher
+
+
+class CourseGalleryCache:
+    """
+    Per-course matchers restricted to the course's enrolled students.
+
+    fetch_enrolled(course_id) returns the enrolled student ids (or None if they
+    can't be resolved, e.g. no database). Enrollment is re-fetched after
+    enrollment_ttl seconds; the subset matcher is rebuilt only when the enrolled
+    ids or the base gallery snapshot change.
+    """
+
+    def __init__(self, fetch_enrolled, enrollment_ttl=30.0):
+        self.fetch_enrolled = fetch_enrolled
+        self.enrollment_ttl = enrollment_ttl
+        self._enrolled = {}  # course_id -> (fetched_at, frozenset of ids)
+        self._subsets = {}  # course_id -> (base matcher, frozenset of ids, matcher)
+        self._lock = threading.Lock()
+
+    def invalidate(self, course_id=None):
+        """Drop cached enrollment for one course (or all courses)."""
+        with self._lock:
+            if course_id is None:
+                self._enrolled.clear()
+                self._subsets.clear()
+            else:
+                self._enrolled.pop(course_id, None)
+                self._subsets.pop(course_id, None)
+
+    def enrolled(self, course_id):
+        now = time.monotonic()
+        cached = self._enrolled.get(course_id)
+        if cached is not None and now - cached[0] < self.enrollment_ttl:
+            return cached[1]
+        ids = self.fetch_enrolled(course_id)
+        if ids is None:
+            return None
+        ids = frozenset(str(i).lower() for i in ids)
+        with self._lock:
+            self._enrolled[course_id] = (now, ids)
+        return ids
+
+    def get(self, course_id, base_matcher):
+        """Matcher for the course, or base_matcher if enrollment can't be resolved."""
+        if not course_id:
+            return base_matcher
+        ids = self.enrolled(course_id)
+        if ids is None:
+            return base_matcher
+        cached = self._subsets.get(course_id)
+        if cached is not None and cached[0] is base_matcher and cached[1] == ids:
+            return cached[2]
+        matcher = base_matcher.subset(ids)
+        with self._lock:
+            self._subsets[course_id] = (base_matcher, ids, matcher)
+        return matcher
@@ -0,0 +1,198 @@
+# face_index.py
+"""
+Nearest-neighbour indexes over a GalleryMatcher.
+
+The exact index scores a query against every gallery row, which is what the
+per-course galleries need and stays cheap up to a few thousand students. For
+an institution-wide gallery (tens of thousands of students) the IVF index
+clusters the rows with spherical k-means at training time and scores a query
+only against the rows of its `nprobe` closest clusters; nprobe trades recall
+for speed and can be changed without rebuilding.
+
+The IVF index is built when the gallery is trained: the gallery rows are
+written in cluster order, so every inverted list is one contiguous slice of the
+memory-mapped matrix and the index file only holds the centroids and list
+boundaries. The index file records a digest of the gallery ids it was built
+for and is ignored if the gallery no longer matches.
+"""
+import hashlib
+import json
+import os
+
+import numpy as np
+
+INDEX_KINDS = ("exact", "ivf")
+INDEX_VERSION = 1
+
+
+def ids_digest(ids):
+    """Digest of the gallery ids in row order, tying an index file to one gallery."""
+    return hashlib.sha256("\n".join(str(i) for i in ids).encode("utf-8")).hexdigest()
+
+
+def _merge_top_k(idx, sims, k):
+    """Sort (m, c) candidates by score and keep the best k per row (idx -1 marks no candidate)."""
+    if sims.shape[1] > k:
+        part = np.argpartition(-sims, k - 1, axis=1)[:, :k]
+        idx = np.take_along_axis(idx, part, axis=1)
+        sims = np.take_along_axis(sims, part, axis=1)
+    order = np.argsort(-sims, axis=1, kind="stable")
+    return np.take_along_axis(idx, order, axis=1), np.take_along_axis(sims, order, axis=1)
+
+
+class ExactIndex:
+    """Scores every gallery row."""
+
+    kind = "exact"
+
+    def search(self, matcher, queries, k):
+        """(row indices, scores) of the k best rows per normalized query, shape (m, k), best first."""
+        sims = matcher.score_rows(queries)
+        idx = np.broadcast_to(np.arange(sims.shape[1]), sims.shape)
+        return _merge_top_k(idx, sims, k)
+
+    def describe(self):
+        return {"kind": self.kind}
+
+
+class IVFIndex:
+    """
+    Inverted-file index: centroids (nlist, d) and list boundaries, with list i
+    being gallery rows offsets[i]:offsets[i + 1].
+    """
+
+    kind = "ivf"
+
+    def __init__(self, centroids, offsets, nprobe=8, digest=None):
+        self.centroids = np.asarray(centroids, dtype=np.float32)
+        self.offsets = np.asarray(offsets, dtype=np.int64)
+        self.nprobe = nprobe
+        self.digest = digest
+
+    @property
+    def nlist(self):
+        return len(self.centroids)
+
+    def search(self, matcher, queries, k):
+        """Same as ExactIndex.search, over the rows of each query's nprobe closest lists only."""
+        m = queries.shape[0]
+        nprobe = max(1, min(self.nprobe, self.nlist))
+        coarse = queries @ self.centroids.T
+        if nprobe < self.nlist:
+            probes = np.argpartition(-coarse, nprobe - 1, axis=1)[:, :nprobe]
+        else:
+            probes = np.tile(np.arange(self.nlist), (m, 1))
+
+        # Slot j*k:(j+1)*k of a query's candidates holds the top k of its j-th probed list
+        cand_idx = np.full((m, nprobe * k), -1, dtype=np.int64)
+        cand_sims = np.full((m, nprobe * k), -np.inf, dtype=np.float32)
+        for lst in np.unique(probes):
+            start, end = int(self.offsets[lst]), int(self.offsets[lst + 1])
+            if end == start:
+                continue
+            rows, slots = np.nonzero(probes == lst)
+            sims = matcher.score_rows(queries[rows], start, end)
+            idx, sims = _merge_top_k(np.broadcast_to(np.arange(start, end), sims.shape), sims, k)
+            width = idx.shape[1]
+            cols = slots[:, None] * k + np.arange(width)
+            cand_idx[rows[:, None], cols] = idx
+            cand_sims[rows[:, None], cols] = sims
+        return _merge_top_k(cand_idx, cand_sims, k)
+
+    def describe(self):
+        return {"kind": self.kind, "nlist": self.nlist, "nprobe": self.nprobe}
+
+
+def spherical_kmeans(matrix, n_clusters, iterations=20, sample_size=None, seed=0):
+    """Unit-norm centroids (n_clusters, d) for the normalized rows of matrix, by cosine k-means."""
+    rng = np.random.default_rng(seed)
+    sample = matrix
+    if sample_size and len(matrix) > sample_size:
+        sample = matrix[rng.choice(len(matrix), sample_size, replace=False)]
+    centroids = sample[rng.choice(len(sample), n_clusters, replace=False)].copy()
+    for _ in range(iterations):
+        assign = np.argmax(sample @ centroids.T, axis=1)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, assign, sample)
+        norms = np.linalg.norm(sums, axis=1)
+        empty = norms == 0
+        # Re-seed empty clusters from random rows instead of leaving them dead
+        sums[empty] = sample[rng.choice(len(sample), int(empty.sum()))]
+        norms[empty] = np.linalg.norm(sums[empty], axis=1)
+        centroids = sums / np.maximum(norms, 1e-12)[:, None]
+    return centroids.astype(np.float32)
+
+
+def build_ivf(matrix, nlist=None, nprobe=8, iterations=20, seed=0, centroids=None):
+    """
+    Cluster the normalized gallery rows (or only assign them to the given
+    centroids, e.g. after a few rows changed). Returns (IVFIndex, order) where
+    order is the permutation the gallery rows must be stored in for the index
+    to be valid (rows grouped by list).
+    """
+    matrix = np.asarray(matrix, dtype=np.float32)
+    n = len(matrix)
+    if centroids is None:
+        nlist = max(1, min(nlist or int(round(np.sqrt(n))), n))
+        # ~256 rows per centroid is plenty to place it; the rest only need assigning
+        centroids = spherical_kmeans(matrix, nlist, iterations, sample_size=256 * nlist, seed=seed)
+    nlist = len(centroids)
+    assign = np.argmax(matrix @ centroids.T, axis=1)
+    order = np.argsort(assign, kind="stable")
+    offsets = np.concatenate([[0], np.cumsum(np.bincount(assign, minlength=nlist))])
+    return IVFIndex(centroids, offsets, nprobe=nprobe), order
+
+
+def build_gallery_index(face_dict, kind="exact", nlist=None, nprobe=8, centroids=None):
+    """
+    Index for a {student_id: embedding} gallery about to be saved. Returns
+    (face_dict in the row order the index needs, index or None for exact).
+    """
+    if kind not in INDEX_KINDS:
+        raise ValueError(f"Unsupported index kind '{kind}'")
+    if kind == "exact" or not face_dict:
+        return face_dict, None
+    ids = list(face_dict)
+    matrix = np.stack([np.asarray(face_dict[i], dtype=np.float32).ravel() for i in ids])
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    index, order = build_ivf(matrix / np.maximum(norms, 1e-12), nlist=nlist, nprobe=nprobe, centroids=centroids)
+    ordered = {ids[i]: face_dict[ids[i]] for i in order}
+    index.digest = ids_digest(ordered)
+    return ordered, index
+
+
+def save_index(path, index):
+    """Write an IVF index (or remove a stale one when index is None, i.e. exact search)."""
+    if index is None:
+        if os.path.exists(path):
+            os.remove(path)
+        return
+    meta = {"version": INDEX_VERSION, "kind": index.kind, "digest": index.digest, "nprobe": index.nprobe}
+    tmp_path = f"{path}.tmp.{os.getpid()}"
+    with open(tmp_path, "wb") as f:
+        np.savez(f, meta=np.frombuffer(json.dumps(meta).encode("utf-8"), dtype=np.uint8),
+                 centroids=index.centroids, offsets=index.offsets)
+    os.replace(tmp_path, path)
+
+
+def load_index(path, matcher, nprobe=None):
+    """
+    The IVF index at path if it was built for exactly this gallery, else None
+    (the matcher then searches exhaustively).
+    """
+    if not os.path.exists(path):
+        return None
+    try:
+        with np.load(path) as data:
+            meta = json.loads(data["meta"].tobytes().decode("utf-8"))
+            centroids, offsets = data["centroids"], data["offsets"]
+    except (OSError, ValueError, KeyError) as e:
+        print(f"Ignoring unreadable index {path}: {e}")
+        return None
+    if meta.get("version") != INDEX_VERSION or meta.get("digest") != ids_digest(matcher.ids):
+        print(f"Ignoring index {path}: built for a different gallery")
+        return None
+    if centroids.shape[1] != matcher.dim or offsets[-1] != len(matcher):
+        print(f"Ignoring index {path}: shape does not match the gallery")
+        return None
+    return IVFIndex(centroids, offsets, nprobe=nprobe or meta.get("nprobe", 8), digest=meta["digest"])
@@ -0,0 +1,265 @@
+# face_models.py
+"""
+Helpers around the insightface model pack.
+
+Model profiles choose which FaceAnalysis modules are loaded, the detector input
+size and the model pack. We only ever read bboxes, keypoints and embeddings, so
+the recognition paths skip the 3D landmark and gender/age heads.
+
+Small faces are embedded by aligning several jittered crops straight from the
+keypoints the detector already found and running only the ArcFace recognition
+model on all of them as one batch, instead of re-running the full
+FaceAnalysis pipeline (detection, landmarks, gender/age) on every zoom crop.
+
+Every ONNX Runtime session is rebuilt with the ORT_* settings below, in
+particular a thread count taken from a per-host thread budget, so several
+processes running models on one machine don't each start a thread per core.
+"""
+import os
+import time
+
+import cv2
+import numpy as np
+
+# All profiles that feed the same gallery must use the same model pack,
+# otherwise embeddings from training and recognition are not comparable.
+MODEL_PACK = os.getenv("FACE_MODEL_PACK", "buffalo_l")
+
+PROFILES = {
+    # Classroom frames: many small faces, need the full 640 detector input
+    "recognize": {
+        "allowed_modules": ["detection", "recognition"],
+        "det_size": (640, 640),
+        "name": MODEL_PACK,
+    },
+    # Enrollment photos: one large face per image
+    "enroll": {
+        "allowed_modules": ["detection", "recognition"],
+        "det_size": (320, 320),
+        "name": MODEL_PACK,
+    },
+    # Everything in the pack (landmarks, gender/age) for debugging/visualization
+    "full": {
+        "allowed_modules": None,
+        "det_size": (640, 640),
+        "name": MODEL_PACK,
+    },
+}
+
+
+def _env_flag(name, default):
+    return os.getenv(name, default).strip().lower() in ("1", "true", "yes", "on")
+
+
+GRAPH_OPTIMIZATION_LEVELS = {
+    "disable": "ORT_DISABLE_ALL",
+    "basic": "ORT_ENABLE_BASIC",
+    "extended": "ORT_ENABLE_EXTENDED",
+    "all": "ORT_ENABLE_ALL",
+}
+EXECUTION_MODES = {"sequential": "ORT_SEQUENTIAL", "parallel": "ORT_PARALLEL"}
+
+# ONNX Runtime settings applied to every session. ORT_INTRA_OP_THREADS (0:
+# the caller's share of ORT_THREAD_BUDGET) is the main knob; inter-op threads
+# only matter in parallel execution mode. Spinning threads burn CPU while idle
+# waiting for work, which hurts when several processes share the cores.
+ORT_SETTINGS = {
+    "intraOpThreads": int(os.getenv("ORT_INTRA_OP_THREADS", "0")),
+    "interOpThreads": int(os.getenv("ORT_INTER_OP_THREADS", "1")),
+    "graphOptimization": os.getenv("ORT_GRAPH_OPTIMIZATION", "all"),
+    "executionMode": os.getenv("ORT_EXECUTION_MODE", "sequential"),
+    "cpuMemArena": _env_flag("ORT_CPU_MEM_ARENA", "true"),
+    "memPattern": _env_flag("ORT_MEM_PATTERN", "true"),
+    "allowSpinning": _env_flag("ORT_ALLOW_SPINNING", "false"),
+}
+if ORT_SETTINGS["graphOptimization"] not in GRAPH_OPTIMIZATION_LEVELS:
+    raise ValueError(f"ORT_GRAPH_OPTIMIZATION must be one of {', '.join(GRAPH_OPTIMIZATION_LEVELS)}")
+if ORT_SETTINGS["executionMode"] not in EXECUTION_MODES:
+    raise ValueError(f"ORT_EXECUTION_MODE must be one of {', '.join(EXECUTION_MODES)}")
+
+# Cores that all model-running processes on this host may use together
+ORT_THREAD_BUDGET = int(os.getenv("ORT_THREAD_BUDGET", "0")) or (os.cpu_count() or 1)
+
+
+def threads_per_worker(workers, budget=None):
+    """Intra-op threads for each of `workers` processes sharing a thread budget (default ORT_THREAD_BUDGET)."""
+    return max(1, (budget or ORT_THREAD_BUDGET) // max(1, workers))
+
+
+def session_options(intra_op_threads):
+    """onnxruntime.SessionOptions from ORT_SETTINGS with the given intra-op thread count."""
+    import onnxruntime
+
+    options = onnxruntime.SessionOptions()
+    options.intra_op_num_threads = intra_op_threads
+    options.inter_op_num_threads = ORT_SETTINGS["interOpThreads"]
+    options.graph_optimization_level = getattr(
+        onnxruntime.GraphOptimizationLevel, GRAPH_OPTIMIZATION_LEVELS[ORT_SETTINGS["graphOptimization"]]
+    )
+    options.execution_mode = getattr(onnxruntime.ExecutionMode, EXECUTION_MODES[ORT_SETTINGS["executionMode"]])
+    options.enable_cpu_mem_arena = ORT_SETTINGS["cpuMemArena"]
+    options.enable_mem_pattern = ORT_SETTINGS["memPattern"]
+    options.add_session_config_entry("session.intra_op.allow_spinning", "1" if ORT_SETTINGS["allowSpinning"] else "0")
+    return options
+
+
+def current_rss_mb():
+    """Resident set size of this process in MB (0.0 where it can't be read)."""
+    try:
+        with open("/proc/self/statm") as f:
+            pages = int(f.read().split()[1])
+        return pages * os.sysconf("SC_PAGE_SIZE") / (1024 * 1024)
+    except (OSError, ValueError, IndexError):
+        try:
+            import resource
+
+            # Peak rather than current RSS; KB on Linux
+            return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+        except Exception:
+            return 0.0
+
+
+def load_face_app(profile="recognize", intra_op_threads=None, **overrides):
+    """
+    Create and prepare a FaceAnalysis app for a named profile, with every
+    model session configured from ORT_SETTINGS. Load time, the RSS it added and
+    the session settings are stored on the app as `profile_stats`.
+    intra_op_threads is this process's share of the thread budget (default:
+    the whole budget); ORT_INTRA_OP_THREADS overrides it.
+    """
+    from insightface.app import FaceAnalysis
+
+    if profile not in PROFILES:
+        raise ValueError(f"Unknown model profile '{profile}' (expected one of {', '.join(PROFILES)})")
+    config = {**PROFILES[profile], **overrides}
+
+    rss_before = current_rss_mb()
+    started = time.perf_counter()
+    face_app = FaceAnalysis(
+        name=config["name"],
+        allowed_modules=config["allowed_modules"],
+        providers=["CPUExecutionProvider"],
+    )
+    face_app.prepare(ctx_id=0, det_size=tuple(config["det_size"]))
+    threads = ORT_SETTINGS["intraOpThreads"] or intra_op_threads or ORT_THREAD_BUDGET
+    configure_sessions(face_app, threads)
+    face_app.profile_stats = {
+        "profile": profile,
+        "modules": sorted(face_app.models.keys()),
+        "detSize": list(config["det_size"]),
+        "session": {**ORT_SETTINGS, "intraOpThreads": threads},
+        "loadSeconds": round(time.perf_counter() - started, 3),
+        "rssDeltaMb": round(current_rss_mb() - rss_before, 1),
+    }
+    return face_app
+
+
+def configure_sessions(face_app, intra_op_threads):
+    """
+    Recreate each model's ONNX session with session_options(intra_op_threads).
+    insightface builds its sessions without SessionOptions (and has no way to
+    pass them in), so several processes on one machine would otherwise each
+    start a thread per core and oversubscribe the CPU.
+    """
+    import onnxruntime
+
+    options = session_options(intra_op_threads)
+    for model in face_app.models.values():
+        providers = model.session.get_providers()
+        model.session = onnxruntime.InferenceSession(model.model_file, sess_options=options, providers=providers)
+
+def warm_up(face_app, det_sizes=(), rec_batch_sizes=(1, 32)):
+    """
+    Run the models once on synthetic input so ONNX Runtime initializes its
+    graphs and allocates its buffers before real traffic: the detector at the
+    app's own input size and at each extra (width, height) in det_sizes, the
+    whole pipeline once, and ArcFace at each batch size. Returns {step: seconds}.
+    """
+    rng = np.random.default_rng(0)
+    timings = {}
+
+    def timed(step, fn):
+        started = time.perf_counter()
+        fn()
+        timings[step] = round(time.perf_counter() - started, 3)
+
+    own_size = tuple(face_app.det_size)
+    for width, height in dict.fromkeys([own_size] + [tuple(size) for size in det_sizes]):
+        img = rng.integers(0, 256, (height, width, 3), dtype=np.uint8)
+        timed(f"detect{width}x{height}", lambda: face_app.det_model.detect(img, input_size=(width, height)))
+
+    frame = rng.integers(0, 256, (own_size[1], own_size[0], 3), dtype=np.uint8)
+    timed("pipeline", lambda: face_app.get(frame))
+
+    rec_model = get_recognition_model(face_app)
+    if rec_model is not None:
+        crop = rng.integers(0, 256, (112, 112, 3), dtype=np.uint8)
+        for n in rec_batch_sizes:
+            timed(f"embed{n}", lambda: embed_aligned(rec_model, [crop] * n))
+    return timings
+
+
+def get_recognition_model(face_app):
+    """The ArcFace model inside a FaceAnalysis app, or None if it isn't loaded."""
+    models = getattr(face_app, "models", None) or {}
+    return models.get("recognition")
+
+
+def augmented_keypoints(kps, face_width, scales=(1.0, 0.92), shifts=(0.0, 0.10, -0.10), rotations_deg=(0, -8, 8)):
+    """
+    Jittered copies of a face's 5-point landmarks. Aligning to a jittered set
+    is the same as zooming, shifting (fraction of face width) and rotating the
+    source crop. The identity transform is skipped since the detector already
+    produced that embedding.
+    """
+    kps = np.asarray(kps, dtype=np.float32).reshape(-1, 2)
+    center = tuple(float(v) for v in kps.mean(axis=0))
+    variants = []
+    for scale in scales:
+        for shift_frac in shifts:
+            for angle in rotations_deg:
+                if scale == 1.0 and shift_frac == 0.0 and angle == 0:
+                    continue
+                M = cv2.getRotationMatrix2D(center, angle, scale)
+                pts = kps @ M[:, :2].T + M[:, 2]
+                pts[:, 0] += shift_frac * face_width
+                variants.append(pts.astype(np.float32))
+    return variants
+
+
+def align_faces(img, keypoint_sets, image_size=112):
+    """ArcFace-aligned crops (image_size x image_size) for each set of 5 landmarks."""
+    from insightface.utils import face_align
+
+    return [face_align.norm_crop(img, landmark=kps, image_size=image_size) for kps in keypoint_sets]
+
+
+def embed_aligned(rec_model, aligned_crops):
+    """Embed aligned crops with one batched ONNX inference. Returns an (n, d) array."""
+    if not aligned_crops:
+        return np.zeros((0, 0), dtype=np.float32)
+    try:
+        feats = rec_model.get_feat(aligned_crops)
+    except Exception:
+        # Models exported with a fixed batch size of 1
+        feats = np.concatenate([rec_model.get_feat([crop]) for crop in aligned_crops], axis=0)
+    return np.asarray(feats, dtype=np.float32).reshape(len(aligned_crops), -1)
+
+
+def embed_small_faces(rec_model, img, faces, **jitter):
+    """
+    Candidate embeddings for several detected faces of one image, computed in a
+    single batch. faces is a list of (kps, face_width). Returns one (k, d) array
+    per face, in order.
+    """
+    crops, owners = [], []
+    for face_idx, (kps, face_width) in enumerate(faces):
+        variants = augmented_keypoints(kps, face_width, **jitter)
+        crops.extend(align_faces(img, variants, image_size=getattr(rec_model, "input_size", (112, 112))[0]))
+        owners.extend([face_idx] * len(variants))
+    if not crops:
+        return [np.zeros((0, 0), dtype=np.float32) for _ in faces]
+
+    feats = embed_aligned(rec_model, crops)
+    owners = np.asarray(owners)
+    return [feats[owners == face_idx] for face_idx in range(len(faces))]
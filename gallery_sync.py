@@ -0,0 +1,188 @@
+# gallery_sync.py
+"""
+Gallery mirrored from the "Student"."faceEmbedding" column.
+
+Training stores every student's median embedding in the database, so
+recognizer replicas on different hosts can all read the gallery from there
+instead of sharing face_gallery.bin. DatabaseGallery streams every embedding
+once at startup, then a listener thread follows the NOTIFY trigger on the
+column (installed once by scripts/install_embedding_trigger.py) and re-fetches
+only the students that changed. Notifications sent while the listener is disconnected are lost, so it
+does a full resync after reconnecting and every `resync_interval` seconds.
+
+Gallery keys are student ids (lowercased, like the course subsets), which is
+what the API returns as studentId.
+"""
+import select
+import threading
+import time
+
+import numpy as np
+
+from db import EMBEDDING_CHANNEL, install_embedding_trigger, iter_face_embeddings
+from face_gallery import GalleryMatcher
+from face_index import build_gallery_index
+
+
+def decode_embedding(data, dim):
+    """float32 vector from faceEmbedding bytes, or None if it isn't a dim-float32 embedding."""
+    if len(data) != dim * 4:
+        return None
+    vector = np.frombuffer(data, dtype=np.float32)
+    if not np.all(np.isfinite(vector)) or not vector.any():
+        return None
+    return vector
+
+
+class DatabaseGallery:
+    """
+    Same interface as ResidentGallery (get / reload / version), fed from the
+    database. Every change builds a new GalleryMatcher and swaps the
+    reference, so requests keep matching against the snapshot they started with.
+    """
+
+    def __init__(self, db, dim=512, index_kind="exact", index_lists=None, index_nprobe=8,
+                 resync_interval=600.0, install_trigger=False, debounce=0.5, max_incremental=1000):
+        self.db = db
+        self.dim = dim
+        self.index_kind = index_kind
+        self.index_lists = index_lists
+        self.index_nprobe = index_nprobe
+        self.resync_interval = resync_interval
+        self.install_trigger = install_trigger
+        self.debounce = debounce
+        # Larger bursts (e.g. a full retrain) are cheaper as one streamed resync
+        self.max_incremental = max_incremental
+        self.version = 0
+        self._embeddings = {}  # student id -> float32 vector
+        self._matcher = None
+        self._centroids = None
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def get(self):
+        """Current matcher snapshot, or None before anything was loaded."""
+        return self._matcher
+
+    def reload(self):
+        """Re-fetch every embedding and swap. A failed fetch keeps the previous snapshot."""
+        try:
+            with self.db.connection() as conn:
+                if conn is None:
+                    return self._matcher
+                embeddings, skipped = {}, 0
+                for student_id, data in iter_face_embeddings(conn):
+                    vector = decode_embedding(data, self.dim)
+                    if vector is None:
+                        skipped += 1
+                    else:
+                        embeddings[str(student_id).lower()] = vector
+        except Exception as e:
+            print(f"Gallery sync failed, keeping previous version: {e}")
+            return self._matcher
+        if skipped:
+            print(f"Gallery sync skipped {skipped} faceEmbedding values that are not {self.dim}-float32 embeddings")
+        with self._lock:
+            self._embeddings = embeddings
+            # A full load re-clusters; incremental updates reuse these centroids
+            self._centroids = None
+            return self._publish()
+
+    def apply_changes(self, student_ids):
+        """Re-fetch only these students: updated rows replace, cleared or deleted ones are dropped."""
+        student_ids = {str(i) for i in student_ids}
+        with self.db.connection() as conn:
+            if conn is None:
+                return self._matcher
+            fetched = {
+                str(student_id).lower(): decode_embedding(data, self.dim)
+                for student_id, data in iter_face_embeddings(conn, student_ids)
+            }
+        with self._lock:
+            embeddings = dict(self._embeddings)
+            for student_id in student_ids:
+                vector = fetched.get(student_id.lower())
+                if vector is None:
+                    embeddings.pop(student_id.lower(), None)
+                else:
+                    embeddings[student_id.lower()] = vector
+            self._embeddings = embeddings
+            return self._publish()
+
+    def _publish(self):
+        ordered, index = build_gallery_index(
+            self._embeddings, self.index_kind, self.index_lists, self.index_nprobe, centroids=self._centroids
+        )
+        matcher = GalleryMatcher.from_dict(ordered)
+        matcher.index = index
+        if index is not None:
+            self._centroids = index.centroids
+        self._matcher = matcher if len(matcher) else None
+        self.version += 1
+        return self._matcher
+
+    # --------------------
+    # Change listener
+    # --------------------
+    def start(self):
+        """Initial full load, then follow changes on a daemon thread (none without a database)."""
+        if not self.db.dsn:
+            print("DATABASE_URL is not set, the database gallery stays empty")
+            return
+        if self.install_trigger:
+            try:
+                with self.db.connection() as conn:
+                    if conn is not None:
+                        install_embedding_trigger(conn)
+            except Exception as e:
+                print(f"Could not install the faceEmbedding trigger, relying on periodic resync: {e}")
+        self.reload()
+        self._thread = threading.Thread(target=self._listen_forever, name="gallery-sync", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+
+    def _listen_forever(self):
+        backoff = 1.0
+        while not self._stop.is_set():
+            try:
+                self._listen()
+                backoff = 1.0
+            except Exception as e:
+                print(f"Gallery listener error, reconnecting in {backoff:.0f}s: {e}")
+                self._stop.wait(backoff)
+                backoff = min(backoff * 2, 60.0)
+                # Changes made while disconnected were never delivered
+                self.reload()
+
+    def _listen(self):
+        conn = self.db.listen_connection()
+        try:
+            conn.cursor().execute(f"LISTEN {EMBEDDING_CHANNEL}")
+            last_sync = time.monotonic()
+            while not self._stop.is_set():
+                pending = set()
+                if select.select([conn], [], [], 1.0)[0]:
+                    # Collect the burst (a training run sends one notification per student)
+                    deadline = time.monotonic() + self.debounce
+                    while True:
+                        conn.poll()
+                        pending.update(notify.payload for notify in conn.notifies)
+                        conn.notifies.clear()
+                        remaining = deadline - time.monotonic()
+                        if remaining <= 0 or not select.select([conn], [], [], remaining)[0]:
+                            break
+                if len(pending) > self.max_incremental:
+                    self.reload()
+                    last_sync = time.monotonic()
+                elif pending:
+                    self.apply_changes(pending)
+                if self.resync_interval and time.monotonic() - last_sync > self.resync_interval:
+                    self.reload()
+                    last_sync = time.monotonic()
+        finally:
+            conn.close()
@@ -0,0 +1,249 @@
+# inference.py
+"""
+Bounded executor for blocking work (model inference, image decoding, database).
+
+The API endpoints are async; running app_model.get() or psycopg2 calls on the
+event loop freezes every other request in the worker, including /health. Work
+is handed to a fixed-size thread pool instead, with a cap on how many jobs may
+wait for a thread (callers get Saturated and should answer 503) and a timeout
+per job.
+
+ProcessInferencePool moves the model work itself into separate processes, each
+with its own preloaded FaceAnalysis app, so one API process can keep several
+cores busy. Frames reach the workers through shared memory rather than being
+pickled; only the (small) per-face results come back.
+"""
+import asyncio
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from multiprocessing import shared_memory
+
+import numpy as np
+
+
+class Saturated(Exception):
+    """Raised when the executor already has its maximum number of pending jobs."""
+
+    def __init__(self, retry_after):
+        super().__init__("Inference queue is full")
+        self.retry_after = retry_after
+
+
+class BoundedExecutor:
+    """
+    Thread pool with max_workers running jobs and at most max_queue waiting.
+    A job that times out still holds its slot until the thread actually
+    finishes, so backpressure reflects the real CPU load.
+    """
+
+    def __init__(self, max_workers=2, max_queue=8, timeout=120.0, retry_after=5):
+        self.max_workers = max_workers
+        self.max_queue = max_queue
+        self.timeout = timeout
+        self.retry_after = retry_after
+        self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="inference")
+        self._pending = 0
+        self._lock = threading.Lock()
+
+    @property
+    def pending(self):
+        return self._pending
+
+    @property
+    def queued(self):
+        return max(0, self._pending - self.max_workers)
+
+    def _release(self, _future):
+        with self._lock:
+            self._pending -= 1
+
+    def submit(self, fn, *args, **kwargs):
+        """Submit a job, or raise Saturated when running + queued jobs are at the limit."""
+        with self._lock:
+            if self._pending >= self.max_workers + self.max_queue:
+                raise Saturated(self.retry_after)
+            self._pending += 1
+        try:
+            future = self._pool.submit(fn, *args, **kwargs)
+        except Exception:
+            self._release(None)
+            raise
+        future.add_done_callback(self._release)
+        return future
+
+    async def run(self, fn, *args, timeout=None, on_submit=None, **kwargs):
+        """
+        Run fn(*args, **kwargs) in the pool and await its result
+        (asyncio.TimeoutError on timeout). on_submit receives the pool's
+        future, which outlives a timeout until the thread really finishes.
+        """
+        future = self.submit(fn, *args, **kwargs)
+        if on_submit is not None:
+            on_submit(future)
+        return await asyncio.wait_for(asyncio.wrap_future(future), timeout or self.timeout)
+
+    def stats(self):
+        return {
+            "workers": self.max_workers,
+            "maxQueue": self.max_queue,
+            "running": min(self._pending, self.max_workers),
+            "queued": self.queued,
+        }
+
+    def shutdown(self):
+        self._pool.shutdown(wait=False, cancel_futures=True)
+
+
+# --------------------
+# Inference worker processes
+# --------------------
+_worker = {}
+
+def _init_worker(profile, small_face_mode, min_face_area, intra_op_threads=None):
+    """Load and warm up the model once per worker process, within its share of the thread budget."""
+    import cv2
+
+    from face_models import load_face_app, warm_up
+
+    if intra_op_threads:
+        cv2.setNumThreads(intra_op_threads)
+    _worker["app"] = load_face_app(profile, intra_op_threads=intra_op_threads)
+    _worker["small_face_mode"] = small_face_mode
+    _worker["min_face_area"] = min_face_area
+    # First run initializes the ONNX graphs; do it before real frames arrive
+    warm_up(_worker["app"])
+
+def _worker_pid(_):
+    # Only runs once the worker's initializer (model load + warm-up) has finished
+    time.sleep(0.05)
+    return os.getpid()
+
+def _run_shared(op, name, shape, dtype, args=None):
+    """Run one recognition step on a frame that the API process placed in shared memory."""
+    from recognition import analyze_frame, detect_faces, embed_keypoints, expand_candidates
+
+    app_model = _worker["app"]
+    shm = shared_memory.SharedMemory(name=name)
+    try:
+        img = np.ndarray(shape, dtype=np.dtype(dtype), buffer=shm.buf)
+        if op == "analyze":
+            result = analyze_frame(app_model, img, _worker["small_face_mode"], _worker["min_face_area"])
+        elif op == "detect":
+            result = detect_faces(app_model, img, _worker["min_face_area"], _worker["small_face_mode"], args is not False)
+        elif op == "embed":
+            result = embed_keypoints(app_model, img, [face["kps"] for face in args])
+        elif op == "expand":
+            result = expand_candidates(app_model, img, args, _worker["small_face_mode"])
+        else:
+            raise ValueError(f"Unknown operation {op}")
+        # Drop the view before closing, the buffer can't be released while it's exported
+        del img
+        return result
+    finally:
+        shm.close()
+
+
+class _SharedFrameAnalyzer:
+    """
+    Frames of one request copied into shared memory for the lifetime of the
+    context, so several steps (detect, embed, expand) can run on them without
+    copying the pixels again. Same interface as recognition.LocalFrameAnalyzer.
+    """
+
+    def __init__(self, pool, processes, frames, timeout):
+        self._pool = pool
+        self._processes = processes
+        self._timeout = timeout
+        self._blocks = []
+        self._handles = []
+        try:
+            for img in frames:
+                img = np.ascontiguousarray(img)
+                shm = shared_memory.SharedMemory(create=True, size=max(1, img.nbytes))
+                self._blocks.append(shm)
+                view = np.ndarray(img.shape, dtype=img.dtype, buffer=shm.buf)
+                view[:] = img
+                del view
+                self._handles.append((shm.name, img.shape, img.dtype.str))
+        except Exception:
+            self.close()
+            raise
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+        return False
+
+    def close(self):
+        for shm in self._blocks:
+            shm.close()
+            shm.unlink()
+        self._blocks = []
+
+    @property
+    def parallelism(self):
+        return self._processes
+
+    def _run(self, op, positions=None, args_per_frame=None):
+        if positions is None:
+            positions = range(len(self._handles))
+        pending = []
+        for i, pos in enumerate(positions):
+            args = None if args_per_frame is None else args_per_frame[i]
+            if op in ("expand", "embed") and not args:
+                pending.append(None)
+                continue
+            pending.append(self._pool.apply_async(_run_shared, (op, *self._handles[pos], args)))
+        return [[] if result is None else result.get(self._timeout) for result in pending]
+
+    def analyze(self, positions=None):
+        return self._run("analyze", positions)
+
+    def detect(self, positions=None, embed=True):
+        count = len(self._handles) if positions is None else len(positions)
+        return self._run("detect", positions, [embed] * count)
+
+    def embed(self, faces_per_frame, positions=None):
+        return self._run("embed", positions, faces_per_frame)
+
+    def expand(self, faces_per_frame, positions=None):
+        return self._run("expand", positions, faces_per_frame)
+
+
+class ProcessInferencePool:
+    """Pool of worker processes running the recognition steps on shared-memory frames."""
+
+    def __init__(self, processes, profile="recognize", small_face_mode="aligned", min_face_area=40 * 40,
+                 intra_op_threads=None):
+        self.processes = processes
+        # spawn: workers must not inherit the API process's threads or ONNX sessions
+        ctx = multiprocessing.get_context("spawn")
+        self._pool = ctx.Pool(
+            processes,
+            initializer=_init_worker,
+            initargs=(profile, small_face_mode, min_face_area, intra_op_threads),
+        )
+
+    def analyzer(self, frames, timeout=None):
+        """Context manager giving analyze/detect/embed/expand over RGB frames, run in parallel across the workers."""
+        return _SharedFrameAnalyzer(self._pool, self.processes, frames, timeout)
+
+    def wait_ready(self, timeout=300.0):
+        """Block until every worker has loaded and warmed up its model. Returns False on timeout."""
+        deadline = time.monotonic() + timeout
+        seen = set()
+        while len(seen) < self.processes and time.monotonic() < deadline:
+            pending = self._pool.map_async(_worker_pid, range(self.processes * 2), chunksize=1)
+            try:
+                seen.update(pending.get(timeout=max(0.0, deadline - time.monotonic())))
+            except multiprocessing.TimeoutError:
+                break
+        return len(seen) >= self.processes
+
+    def shutdown(self):
+        self._pool.terminate()
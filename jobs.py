@@ -0,0 +1,156 @@
+# jobs.py
+"""
+Background training jobs.
+
+Training embeds every student folder and can take far longer than a proxy
+will hold an HTTP request open, so /api/train only enqueues a job and returns
+its id. Jobs run one at a time on their own thread (not the inference
+executor, which they would block for minutes) and report progress through the
+TrainingJob they are given; cancellation is cooperative, checked between
+students.
+"""
+import threading
+import time
+import uuid
+
+
+class JobCancelled(Exception):
+    """Raised inside a running job when it was cancelled or ran past its deadline."""
+
+
+class JobConflict(Exception):
+    """Raised when a job is submitted while another one is still queued or running."""
+
+    def __init__(self, job):
+        super().__init__(f"Training job {job.id} is already {job.status}")
+        self.job = job
+
+
+class TrainingJob:
+    """State and progress of one training run, updated by the job and read by the status endpoint."""
+
+    def __init__(self, timeout=None, options=None):
+        self.id = uuid.uuid4().hex
+        self.options = options or {}
+        self.status = "queued"  # queued | running | succeeded | failed | cancelled
+        self.created_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self.students_total = 0
+        self.students_processed = 0
+        self.samples = 0
+        self.images = 0
+        self.errors = []
+        self.result = None
+        self.timeout = timeout
+        self._cancel = threading.Event()
+
+    @property
+    def active(self):
+        return self.status in ("queued", "running")
+
+    def cancel(self):
+        self._cancel.set()
+
+    def check_cancelled(self):
+        """Call between units of work; raises JobCancelled when the job should stop."""
+        if self._cancel.is_set():
+            raise JobCancelled("Cancelled")
+        if self.timeout and self.started_at and time.time() - self.started_at > self.timeout:
+            raise JobCancelled(f"Timed out after {self.timeout:.0f}s")
+
+    def begin(self, students_total):
+        self.students_total = students_total
+
+    def student_done(self, samples, images=0):
+        self.students_processed += 1
+        self.samples += samples
+        self.images += images
+
+    def images_per_second(self):
+        if not self.started_at or not self.images:
+            return None
+        elapsed = (self.finished_at or time.time()) - self.started_at
+        return round(self.images / elapsed, 2) if elapsed > 0 else None
+
+    def add_error(self, message):
+        self.errors.append(message)
+
+    def eta_seconds(self):
+        if self.status != "running" or not self.students_processed:
+            return None
+        elapsed = time.time() - self.started_at
+        remaining = self.students_total - self.students_processed
+        return round(elapsed / self.students_processed * remaining, 1)
+
+    def to_dict(self):
+        return {
+            "jobId": self.id,
+            "status": self.status,
+            "options": self.options,
+            "studentsTotal": self.students_total,
+            "studentsProcessed": self.students_processed,
+            "samples": self.samples,
+            "images": self.images,
+            "imagesPerSecond": self.images_per_second(),
+            "etaSeconds": self.eta_seconds(),
+            "errors": list(self.errors),
+            "createdAt": self.created_at,
+            "startedAt": self.started_at,
+            "finishedAt": self.finished_at,
+            "result": self.result,
+        }
+
+
+class TrainingJobs:
+    """
+    Runs run_fn(job) for submitted jobs, one at a time, each on a fresh
+    daemon thread. Keeps the most recent `keep` jobs for status queries.
+    """
+
+    def __init__(self, run_fn, keep=20, timeout=None):
+        self.run_fn = run_fn
+        self.keep = keep
+        self.timeout = timeout
+        self._jobs = {}  # job id -> TrainingJob, oldest first
+        self._lock = threading.Lock()
+
+    def active(self):
+        with self._lock:
+            return next((job for job in self._jobs.values() if job.active), None)
+
+    def submit(self, **options):
+        """Start a new job, or raise JobConflict if one is already queued or running."""
+        with self._lock:
+            for job in self._jobs.values():
+                if job.active:
+                    raise JobConflict(job)
+            job = TrainingJob(timeout=self.timeout, options=options)
+            self._jobs[job.id] = job
+            while len(self._jobs) > self.keep:
+                del self._jobs[next(iter(self._jobs))]
+        threading.Thread(target=self._run, args=(job,), name=f"train-{job.id[:8]}", daemon=True).start()
+        return job
+
+    def get(self, job_id):
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def latest(self):
+        with self._lock:
+            return next(reversed(self._jobs.values()), None)
+
+    def _run(self, job):
+        job.status = "running"
+        job.started_at = time.time()
+        try:
+            job.result = self.run_fn(job)
+            job.status = "succeeded"
+        except JobCancelled as e:
+            job.status = "cancelled"
+            job.add_error(str(e))
+        except Exception as e:
+            job.status = "failed"
+            job.add_error(getattr(e, "detail", None) or str(e))
+        finally:
+            job.finished_at = time.time()
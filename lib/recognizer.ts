@@ -0,0 +1,16 @@
+// lib/recognizer.ts
+
+const PYTHON_API_URL = process.env.PYTHON_API_URL || "http://localhost:8000";
+
+// Tell the recognition API that a course's enrollment changed so it drops its
+// cached per-course gallery. Best effort: the API also re-checks enrollment
+// on its own after a short TTL.
+export async function invalidateCourseGallery(courseId: string) {
+  try {
+    await fetch(`${PYTHON_API_URL}/api/courses/${encodeURIComponent(courseId)}/invalidate`, {
+      method: "POST",
+    });
+  } catch (error) {
+    console.warn("Failed to invalidate course gallery:", error);
+  }
+}
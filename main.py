@@ -1,34 +1,41 @@
 # main.py
 from fastapi import FastAPI, File, UploadFile, Form, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, StreamingResponse
 import os
 import cv2
 import numpy as np
-import pickle
 from typing import List
-import shutil
 from pathlib import Path
 import json
-import mediapipe as mp
-import psycopg2
-from psycopg2.extras import execute_values
+import uuid
+import time
+import asyncio
+import threading
+import importlib.util
 from dotenv import load_dotenv
+# Heavy optional dependencies (mediapipe, albumentations, psycopg2) are only
+# imported by the code paths that use them; see scripts/benchmark_startup.py.
 # Use albumentations instead of imgaug for NumPy 2.0 compatibility
-try:
-    import albumentations as A
-    AUGMENTATION_AVAILABLE = True
-except ImportError:
-    AUGMENTATION_AVAILABLE = False
+AUGMENTATION_AVAILABLE = importlib.util.find_spec("albumentations") is not None
+if not AUGMENTATION_AVAILABLE:
     print("Warning: albumentations not installed. Augmentation will be skipped.")
-from PIL import Image, ImageDraw, ImageFont, ImageEnhance
+from face_gallery import CourseGalleryCache, ResidentGallery, load_gallery, migrate_legacy_gallery, save_gallery
+from face_index import build_gallery_index, load_index, save_index
+from gallery_sync import DatabaseGallery
+from face_models import MODEL_PACK, load_face_app, threads_per_worker, warm_up
+from recognition import MIN_FACE_AREA, ConfirmedStudents, LocalFrameAnalyzer, as_embedding_matrix
+from tracking import link_tracks
+from inference import BoundedExecutor, ProcessInferencePool, Saturated
+from batching import BatchScheduler
+from jobs import JobConflict, TrainingJobs
+from training_manifest import TrainingManifest, scan_dataset
+from training import TrainingPool, embed_students_serial, median_embedding, training_settings
+from db import Database, upsert_embeddings
 
 load_dotenv()
 
 app = FastAPI(title="Face Recognition API")
-@app.get("/health")
-def health():
-    return {"status": "ok"}
 # CORS Configuration
 app.add_middleware(
     CORSMiddleware,
@@ -44,131 +51,286 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Small faces: "aligned" embeds jittered keypoint-aligned crops with one batched
+# ArcFace call; "crops" runs the full pipeline on each zoom crop (legacy);
+# "tiled" detects on overlapping full-resolution windows (TILE_SCALES,
+# TILE_OVERLAP) instead and adds no zoom candidates
+SMALL_FACE_MODE = os.getenv("SMALL_FACE_MODE", "aligned")
+
+# Minimum cosine similarity between a face and a student's embedding to count as a match
+SIMILARITY_THRESHOLD = 0.45
+
+# Link detector boxes across the frames of one submission and embed only each
+# track's TRACK_BEST_OBSERVATIONS best faces (small-face variants included);
+# the response then also lists every track with the frames it appeared in
+TRACK_FACES = os.getenv("TRACK_FACES", "false").lower() == "true"
+TRACK_BEST_OBSERVATIONS = int(os.getenv("TRACK_BEST_OBSERVATIONS", "2"))
+TRACK_IOU_THRESHOLD = float(os.getenv("TRACK_IOU_THRESHOLD", "0.3"))
+TRACK_SIMILARITY_THRESHOLD = float(os.getenv("TRACK_SIMILARITY_THRESHOLD", "0.3"))
+
+# Stop processing frames (and skip zoom candidates) once every enrolled student
+# has been matched at EARLY_EXIT_CONFIDENCE or above
+EARLY_EXIT = os.getenv("EARLY_EXIT", "false").lower() == "true"
+EARLY_EXIT_CONFIDENCE = float(os.getenv("EARLY_EXIT_CONFIDENCE", "0.6"))
+
+# Keep a copy of every recognition frame under test-images/<request id>/ (debugging only)
+SAVE_RECOGNITION_FRAMES = os.getenv("SAVE_RECOGNITION_FRAMES", "false").lower() == "true"
+
 # Paths
 DATASET_PATH = "dataset"
 TEST_IMAGES_PATH = "test-images"
 OUTPUT_PATH = "output"
-EMBEDDINGS_FILE = "face_embeddings.pkl"
+EMBEDDINGS_FILE = "face_gallery.bin"
+# Pickled gallery of older versions, converted to EMBEDDINGS_FILE on startup
+LEGACY_EMBEDDINGS_FILE = "face_embeddings.pkl"
+# Storage type of the gallery matrix written by training: float32 (fastest to
+# match), or float16 (half the memory) / int8 (a quarter, per-row scales), which
+# only save memory and match more slowly; see scripts/benchmark_gallery.py
+GALLERY_DTYPE = os.getenv("GALLERY_DTYPE", "float32")
+# Nearest-neighbour index built by training: "exact" scores every student; "ivf"
+# clusters the gallery and only scores the GALLERY_INDEX_NPROBE closest of
+# GALLERY_INDEX_LISTS clusters (0: sqrt(students)) per face. Raise nprobe for
+# recall, lower it for speed; it applies on the next gallery load, no retraining.
+GALLERY_INDEX = os.getenv("GALLERY_INDEX", "exact")
+GALLERY_INDEX_LISTS = int(os.getenv("GALLERY_INDEX_LISTS", "0"))
+GALLERY_INDEX_NPROBE = int(os.getenv("GALLERY_INDEX_NPROBE", "8"))
+INDEX_FILE = "face_gallery.index.npz"
+# Where recognition reads the gallery from: "file" (EMBEDDINGS_FILE on this host)
+# or "database" (Student.faceEmbedding, kept current through LISTEN/NOTIFY), so
+# replicas on other hosts don't need the file. Training always writes both.
+GALLERY_SOURCE = os.getenv("GALLERY_SOURCE", "file")
+# Full re-fetch interval in database mode, covering notifications missed while disconnected
+GALLERY_RESYNC_SECONDS = float(os.getenv("GALLERY_RESYNC_SECONDS", "600"))
+# Photo hashes of the last training run, so retraining only re-embeds changed students
+MANIFEST_FILE = "face_manifest.json"
 
 # Create directories
 for path in [DATASET_PATH, TEST_IMAGES_PATH, OUTPUT_PATH]:
     Path(path).mkdir(parents=True, exist_ok=True)
 
-# Initialize models (lazy loading)
-face_app = None
-face_mesh = None
+def load_indexed_gallery(path):
+    """The gallery file plus its nearest-neighbour index, if one was built for it"""
+    matcher = load_gallery(path, expected_model=MODEL_PACK)
+    matcher.index = load_index(INDEX_FILE, matcher, nprobe=GALLERY_INDEX_NPROBE)
+    return matcher
+
+# Known embeddings, loaded once and kept resident (reloaded when the file changes).
+# Training merges into this one; recognition uses `gallery`, which is this one
+# too unless GALLERY_SOURCE=database (set up once the database pool exists)
+local_gallery = ResidentGallery(EMBEDDINGS_FILE, loader=load_indexed_gallery)
+gallery = local_gallery
+
+@app.on_event("startup")
+def load_gallery_on_startup():
+    if migrate_legacy_gallery(LEGACY_EMBEDDINGS_FILE, EMBEDDINGS_FILE, model_name=MODEL_PACK):
+        print(f"Converted {LEGACY_EMBEDDINGS_FILE} to {EMBEDDINGS_FILE}")
+    if gallery is not local_gallery:
+        gallery.start()
+    matcher = gallery.get()
+    if matcher is not None:
+        index = matcher.index.describe() if matcher.index is not None else {"kind": "exact"}
+        print(f"Loaded face gallery from {GALLERY_SOURCE} ({len(matcher)} students, index {index})")
+
+# Blocking work (inference, decoding, database) runs here, off the event loop
+executor = BoundedExecutor(
+    max_workers=int(os.getenv("INFERENCE_WORKERS", "2")),
+    max_queue=int(os.getenv("INFERENCE_QUEUE", "8")),
+    timeout=float(os.getenv("INFERENCE_TIMEOUT", "120")),
+    retry_after=int(os.getenv("INFERENCE_RETRY_AFTER", "5")),
+)
 
-def get_face_app():
-    """Lazy load FaceAnalysis - only import when needed"""
-    global face_app
-    if face_app is None:
-        try:
-            # Import here to avoid startup errors
-            from insightface.app import FaceAnalysis
-            face_app = FaceAnalysis(name='buffalo_l', providers=['CPUExecutionProvider'])
-            # prepare may vary depending on insightface version
-            try:
-                face_app.prepare(ctx_id=0, det_size=(640, 640))
-            except Exception:
-                # fallback if prepare signature differs
-                pass
-        except ImportError as e:
-            print(f"Failed to load insightface: {e}")
-            raise HTTPException(
-                status_code=500,
-                detail="Face recognition model not available. Check onnxruntime / insightface installation."
-            )
-    return face_app
+# Training runs as a background job, one at a time; TRAIN_TIMEOUT caps its duration
+TRAIN_TIMEOUT = float(os.getenv("TRAIN_TIMEOUT", "1800"))
+training_jobs = TrainingJobs(lambda job: run_training(job), timeout=TRAIN_TIMEOUT)
+
+# Training worker processes (0 = embed students one by one in the API process)
+# and the ONNX/OpenCV threads each may use (0 = TRAIN_THREAD_BUDGET / processes).
+# TRAIN_THREAD_BUDGET (0 = ORT_THREAD_BUDGET, i.e. all cores) can be lowered to
+# leave cores to recognition while a training run is going on.
+TRAIN_PROCESSES = int(os.getenv("TRAIN_PROCESSES", "0"))
+TRAIN_THREADS_PER_WORKER = int(os.getenv("TRAIN_THREADS_PER_WORKER", "0"))
+TRAIN_THREAD_BUDGET = int(os.getenv("TRAIN_THREAD_BUDGET", "0"))
+
+# Recognition inference processes (0 = run the models in the API process itself)
+INFERENCE_PROCESSES = int(os.getenv("INFERENCE_PROCESSES", "0"))
+process_pool = None
+
+# Every uvicorn worker (WEB_CONCURRENCY) runs models in INFERENCE_PROCESSES
+# processes, or in itself; each of those gets an equal share of ORT_THREAD_BUDGET
+# (see face_models.ORT_SETTINGS for the other ONNX Runtime session settings)
+MODEL_WORKERS = int(os.getenv("WEB_CONCURRENCY", "1")) * max(1, INFERENCE_PROCESSES)
+INFERENCE_THREADS = threads_per_worker(MODEL_WORKERS)
+
+async def run_blocking(fn, *args, timeout=None, on_submit=None):
+    """Run fn in the bounded executor, mapping a full queue to 503 and a timeout to 504."""
+    try:
+        return await executor.run(fn, *args, timeout=timeout, on_submit=on_submit)
+    except Saturated as e:
+        raise HTTPException(
+            status_code=503,
+            detail="Server busy, retry shortly",
+            headers={"Retry-After": str(e.retry_after)},
+        )
+    except asyncio.TimeoutError:
+        raise HTTPException(status_code=504, detail="Processing timed out")
+
+@app.on_event("startup")
+def start_process_pool():
+    global process_pool
+    if INFERENCE_PROCESSES > 0:
+        process_pool = ProcessInferencePool(
+            INFERENCE_PROCESSES,
+            profile=RECOGNIZE_PROFILE,
+            small_face_mode=SMALL_FACE_MODE,
+            min_face_area=MIN_FACE_AREA,
+            intra_op_threads=INFERENCE_THREADS,
+        )
+        print(f"Started {INFERENCE_PROCESSES} inference worker processes ({INFERENCE_THREADS} threads each)")
+
+@app.on_event("shutdown")
+def shutdown_executor():
+    job = training_jobs.active()
+    if job is not None:
+        job.cancel()
+    executor.shutdown()
+    if gallery is not local_gallery:
+        gallery.stop()
+    db.close()
+    if process_pool is not None:
+        process_pool.shutdown()
+
+# Initialize models (lazy loading), one FaceAnalysis app per model profile
+face_apps = {}
+face_mesh = None
+model_lock = threading.Lock()
+# One FaceMesh graph is shared by the executor threads and isn't thread-safe
+face_mesh_lock = threading.Lock()
+
+# Micro-batch detector/ArcFace calls of concurrent requests (0 = off)
+BATCH_WINDOW_MS = float(os.getenv("BATCH_WINDOW_MS", "0"))
+BATCH_MAX_SIZE = int(os.getenv("BATCH_MAX_SIZE", "32"))
+
+# Model profile used by each endpoint (see face_models.PROFILES)
+RECOGNIZE_PROFILE = os.getenv("RECOGNIZE_PROFILE", "recognize")
+TRAIN_PROFILE = os.getenv("TRAIN_PROFILE", "enroll")
+# Loaded and warmed up at startup instead of on the first request: model
+# profiles plus "mesh" for MediaPipe, e.g. "recognize,enroll,mesh". Empty keeps
+# lazy loading. /ready answers 503 until these (and the worker processes) are warm.
+PRELOAD_MODELS = [name.strip() for name in os.getenv("PRELOAD_MODELS", "").split(",") if name.strip()]
+# Detector input sizes warmed up besides each profile's own, e.g. "480x480,800x800"
+WARMUP_DET_SIZES = [
+    tuple(int(v) for v in size.lower().split("x"))
+    for size in os.getenv("WARMUP_DET_SIZES", "").split(",") if size.strip()
+]
+
+def get_face_app(profile=RECOGNIZE_PROFILE):
+    """Lazy load FaceAnalysis for a model profile - only import when needed"""
+    if profile not in face_apps:
+        # Executor threads may ask for the same profile at once; load it only once
+        with model_lock:
+            if profile not in face_apps:
+                try:
+                    face_app = load_face_app(profile, intra_op_threads=INFERENCE_THREADS)
+                    print(f"Loaded model profile: {face_app.profile_stats}")
+                    if BATCH_WINDOW_MS > 0:
+                        face_app = BatchScheduler(face_app, window_ms=BATCH_WINDOW_MS, max_batch=BATCH_MAX_SIZE)
+                    face_apps[profile] = face_app
+                except ImportError as e:
+                    print(f"Failed to load insightface: {e}")
+                    raise HTTPException(
+                        status_code=500,
+                        detail="Face recognition model not available. Check onnxruntime / insightface installation."
+                    )
+    return face_apps[profile]
 
 def get_face_mesh():
     global face_mesh
     if face_mesh is None:
-        mp_face_mesh = mp.solutions.face_mesh
-        face_mesh = mp_face_mesh.FaceMesh(static_image_mode=True, max_num_faces=1, refine_landmarks=True)
+        with model_lock:
+            if face_mesh is None:
+                # mediapipe brings in a TFLite runtime that only /api/process-student needs
+                import mediapipe as mp
+
+                mp_face_mesh = mp.solutions.face_mesh
+                face_mesh = mp_face_mesh.FaceMesh(static_image_mode=True, max_num_faces=1, refine_landmarks=True)
     return face_mesh
 
-def get_db_connection():
+# Startup warm-up state reported by /ready
+readiness = {"ready": False, "warmup": {}, "error": None, "startedAt": None, "finishedAt": None}
+
+def warm_up_models():
+    """Load every PRELOAD_MODELS entry and run it once on synthetic input, then wait for the worker processes"""
+    readiness["startedAt"] = time.time()
     try:
-        database_url = os.getenv('DATABASE_URL')
-        if not database_url:
-            return None
-        return psycopg2.connect(database_url)
+        for name in PRELOAD_MODELS:
+            if name == "mesh":
+                started = time.perf_counter()
+                mesh = get_face_mesh()
+                with face_mesh_lock:
+                    mesh.process(np.zeros((480, 640, 3), dtype=np.uint8))
+                readiness["warmup"]["mesh"] = {"process": round(time.perf_counter() - started, 3)}
+            else:
+                face_app = get_face_app(name)
+                # Warm the model itself, not through the batcher threads
+                readiness["warmup"][name] = warm_up(getattr(face_app, "face_app", face_app), WARMUP_DET_SIZES)
+            print(f"Warmed up {name}: {readiness['warmup'][name]}")
+        if process_pool is not None and not process_pool.wait_ready():
+            raise RuntimeError("Inference worker processes did not start in time")
+        readiness["ready"] = True
+    except Exception as e:
+        readiness["error"] = getattr(e, "detail", None) or str(e)
+        print(f"Warm-up failed: {readiness['error']}")
+    finally:
+        readiness["finishedAt"] = time.time()
+
+@app.on_event("startup")
+def start_warm_up():
+    # In the background so /health answers while models load; /ready tells when it's done
+    threading.Thread(target=warm_up_models, name="warm-up", daemon=True).start()
+
+# One connection pool for all endpoints (connections are expensive on managed Postgres)
+db = Database(os.getenv("DATABASE_URL"), maxconn=int(os.getenv("DB_POOL_MAX", "5")))
+
+if GALLERY_SOURCE == "database":
+    gallery = DatabaseGallery(
+        db,
+        index_kind=GALLERY_INDEX,
+        index_lists=GALLERY_INDEX_LISTS or None,
+        index_nprobe=GALLERY_INDEX_NPROBE,
+        resync_interval=GALLERY_RESYNC_SECONDS,
+        # The trigger is installed once per database by scripts/install_embedding_trigger.py;
+        # replicas only run its DDL themselves when this is set
+        install_trigger=os.getenv("GALLERY_INSTALL_TRIGGER", "false").lower() == "true",
+    )
+
+def fetch_course_student_ids(course_id):
+    """Ids of students enrolled in a course (Prisma "CourseStudents" relation), or None without a database."""
+    try:
+        with db.connection() as conn:
+            if conn is None:
+                return None
+            cursor = conn.cursor()
+            # Implicit many-to-many table: "A" = Course.id, "B" = Student.id
+            cursor.execute('SELECT "B" FROM "_CourseStudents" WHERE "A" = %s', (course_id,))
+            ids = [row[0] for row in cursor.fetchall()]
+            cursor.close()
+            return ids
     except Exception as e:
-        print(f"Database connection failed: {e}")
+        print(f"Course enrollment lookup failed: {e}")
         return None
 
-# --------------------
-# Helper functions for digital zoom & augmented crops
-# --------------------
-def clamp(val, a, b):
-    return max(a, min(b, val))
-
-def crop_with_margin(img, x1, y1, x2, y2, margin=0.4):
-    """Crop image around bbox with relative margin (fraction of bbox size)."""
-    h, w = img.shape[:2]
-    bw = x2 - x1
-    bh = y2 - y1
-    mx = int(bw * margin)
-    my = int(bh * margin)
-    cx1 = clamp(x1 - mx, 0, w - 1)
-    cy1 = clamp(y1 - my, 0, h - 1)
-    cx2 = clamp(x2 + mx, 0, w - 1)
-    cy2 = clamp(y2 + my, 0, h - 1)
-    # ensure indices are valid
-    if cx2 <= cx1 or cy2 <= cy1:
-        return img[0:1, 0:1].copy()
-    return img[cy1:cy2, cx1:cx2].copy()
-
-def make_augmented_crops(img_rgb, bbox, zoom_scales=(1.6, 2.2), shifts_px=(0.0, 0.08, -0.08), rotations_deg=(0, -10, 10)):
-    """
-    Given an RGB image and bbox (x1,y1,x2,y2), produce a list of augmented crops:
-    - zoom_scales: relative scale factor to increase crop size (digital zoom)
-    - shifts_px: relative horizontal shifts (fraction of face width). Positive -> right.
-    - rotations_deg: small rotation angles to simulate different head tilts
-    Returns list of crops (RGB numpy arrays).
-    """
-    h, w = img_rgb.shape[:2]
-    x1, y1, x2, y2 = [int(v) for v in bbox]
-    bw = max(1, x2 - x1)
-    bh = max(1, y2 - y1)
-    center_x = x1 + bw // 2
-    center_y = y1 + bh // 2
-
-    crops = []
-    for scale in zoom_scales:
-        crop_w = int(bw * scale)
-        crop_h = int(bh * scale)
-        for shift_frac in shifts_px:
-            shift_x = int(shift_frac * bw)
-            cx = clamp(center_x + shift_x, 0, w - 1)
-            cy = clamp(center_y, 0, h - 1)
-            x_start = clamp(cx - crop_w // 2, 0, w - 1)
-            y_start = clamp(cy - crop_h // 2, 0, h - 1)
-            x_end = clamp(x_start + crop_w, 0, w)
-            y_end = clamp(y_start + crop_h, 0, h)
-            if x_end <= x_start or y_end <= y_start:
-                continue
-            crop = img_rgb[y_start:y_end, x_start:x_end].copy()
-            if crop.size == 0:
-                continue
+# Per-course galleries restricted to enrolled students
+course_galleries = CourseGalleryCache(
+    fetch_course_student_ids,
+    enrollment_ttl=float(os.getenv("COURSE_ENROLLMENT_TTL", "30")),
+)
 
-            # Add small rotations
-            for angle in rotations_deg:
-                if angle == 0:
-                    crops.append(crop)
-                else:
-                    (ch, cw) = crop.shape[:2]
-                    M = cv2.getRotationMatrix2D((cw // 2, ch // 2), angle, 1.0)
-                    rotated = cv2.warpAffine(crop, M, (cw, ch), flags=cv2.INTER_LINEAR, borderMode=cv2.BORDER_REPLICATE)
-                    crops.append(rotated)
-    # also return a slightly padded original crop as baseline
-    try:
-        original_pad = crop_with_margin(img_rgb, x1, y1, x2, y2, margin=0.25)
-        if original_pad is not None and original_pad.size > 0:
-            crops.insert(0, original_pad)
-    except Exception:
-        pass
-    return crops
+def decode_image(data):
+    """Decode uploaded image bytes to a BGR array without touching disk (None if not an image)."""
+    if not data:
+        return None
+    buffer = np.frombuffer(data, dtype=np.uint8)
+    return cv2.imdecode(buffer, cv2.IMREAD_COLOR)
 
 # --------------------
 # Endpoints
@@ -183,8 +345,20 @@ async def health_check():
     return {
         "status": "healthy",
         "api": "running",
-        "python_version": "3.11"
+        "python_version": "3.11",
+        "inference": executor.stats(),
+    }
+
+@app.get("/ready")
+async def readiness_check():
+    """503 until startup warm-up has finished, so a load balancer only routes to warm instances"""
+    matcher = gallery.get()
+    body = {
+        **readiness,
+        "preload": PRELOAD_MODELS,
+        "galleryStudents": len(matcher) if matcher is not None else 0,
     }
+    return JSONResponse(status_code=200 if readiness["ready"] else 503, content=body)
 
 @app.post("/api/process-student")
 async def process_student(
@@ -194,6 +368,11 @@ async def process_student(
     right: UploadFile = File(...),
 ):
     """Process and validate student photos"""
+    uploads = [(pose, await file.read()) for pose, file in [("front", front), ("left", left), ("right", right)]]
+    return await run_blocking(validate_student_photos, studentId, uploads)
+
+def validate_student_photos(studentId, uploads):
+    """Save the (pose, bytes) uploads under dataset/<studentId> and check each has a face"""
     try:
         student_dir = Path(DATASET_PATH) / studentId
         student_dir.mkdir(parents=True, exist_ok=True)
@@ -201,11 +380,10 @@ async def process_student(
         mesh = get_face_mesh()
         results = {}
 
-        for pose, file in [("front", front), ("left", left), ("right", right)]:
+        for pose, data in uploads:
             # Save file
             file_path = student_dir / f"{pose}.jpg"
-            with open(file_path, "wb") as buffer:
-                shutil.copyfileobj(file.file, buffer)
+            file_path.write_bytes(data)
 
             # Validate face
             img = cv2.imread(str(file_path))
@@ -214,7 +392,8 @@ async def process_student(
                 continue
 
             rgb = cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
-            face_results = mesh.process(rgb)
+            with face_mesh_lock:
+                face_results = mesh.process(rgb)
 
             if face_results.multi_face_landmarks:
                 cv2.imwrite(str(file_path), img)
@@ -233,125 +412,161 @@ async def process_student(
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
-@app.post("/api/train")
-async def train_faces():
-    """Train face recognition model"""
+@app.post("/api/train", status_code=202)
+async def train_faces(full: bool = False):
+    """
+    Start a background training job; poll GET /api/train/{jobId} for progress.
+    Only new or changed student folders are embedded unless full=true.
+    """
+    if not os.path.exists(DATASET_PATH):
+        raise HTTPException(status_code=400, detail="No dataset found")
     try:
-        if not os.path.exists(DATASET_PATH):
-            raise HTTPException(status_code=400, detail="No dataset found")
-
-        app_model = get_face_app()  # This will now fail gracefully if onnxruntime issues
-        face_dict = {}
-        embedding_vectors = []
-        labels = []
-
-        # Initialize augmenter if albumentations is available
-        augmenter = None
-        if AUGMENTATION_AVAILABLE:
-            augmenter = A.Compose([
-                A.HorizontalFlip(p=0.5),
-                A.Rotate(limit=15, p=0.8),
-                A.RandomBrightnessContrast(brightness_limit=0.2, contrast_limit=0.2, p=0.8),
-                A.HueSaturationValue(hue_shift_limit=10, sat_shift_limit=20, val_shift_limit=20, p=0.5),
-            ])
-
-        student_folders = [
-            d
-            for d in os.listdir(DATASET_PATH)
-            if os.path.isdir(os.path.join(DATASET_PATH, d))
-        ]
-
-        for student_folder in student_folders:
-            person_path = os.path.join(DATASET_PATH, student_folder)
-            person_embeddings = []
-
-            image_files = [
-                f
-                for f in os.listdir(person_path)
-                if f.lower().endswith((".jpg", ".jpeg", ".png"))
-            ]
-
-            for image_name in image_files:
-                image_path = os.path.join(person_path, image_name)
-                img = cv2.imread(image_path)
-                if img is None:
-                    continue
-
-                img_rgb = cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
-                faces = app_model.get(img_rgb)
-
-                if len(faces) > 0:
-                    face = max(
-                        faces,
-                        key=lambda f: (f.bbox[2] - f.bbox[0]) * (f.bbox[3] - f.bbox[1]),
-                    )
-                    emb = getattr(face, "normed_embedding", None)
-                    if emb is not None:
-                        person_embeddings.append(emb)
-                        embedding_vectors.append(emb)
-                        labels.append(student_folder)
-
-                # Augmentation (only if augmenter is available)
-                if augmenter is not None:
-                    for _ in range(2):
-                        try:
-                            # albumentations expects numpy array in RGB format
-                            augmented = augmenter(image=img_rgb)
-                            aug_img = augmented['image']
-                        except Exception:
-                            aug_img = img_rgb
-                        faces_aug = app_model.get(aug_img)
-                        if len(faces_aug) > 0:
-                            face_aug = max(
-                                faces_aug,
-                                key=lambda f: (f.bbox[2] - f.bbox[0]) * (f.bbox[3] - f.bbox[1]),
-                            )
-                            emb_aug = getattr(face_aug, "normed_embedding", None)
-                            if emb_aug is not None:
-                                person_embeddings.append(emb_aug)
-                                embedding_vectors.append(emb_aug)
-                                labels.append(student_folder)
-
-            if person_embeddings:
-                median_embedding = np.median(person_embeddings, axis=0)
-                if np.linalg.norm(median_embedding) > 0:
-                    median_embedding = median_embedding / np.linalg.norm(median_embedding)
-                face_dict[student_folder.lower()] = median_embedding
-
-                # Update database
-                conn = get_db_connection()
-                if conn:
-                    try:
-                        cursor = conn.cursor()
-                        embedding_bytes = median_embedding.tobytes()
-                        cursor.execute(
-                            """
-                            UPDATE "Student" 
-                            SET "faceEmbedding" = %s 
-                            WHERE id = %s
-                        """,
-                            (embedding_bytes, student_folder),
-                        )
-                        conn.commit()
-                        cursor.close()
-                        conn.close()
-                    except Exception as e:
-                        print(f"DB update error: {e}")
-
-        # Save embeddings
-        with open(EMBEDDINGS_FILE, "wb") as f:
-            pickle.dump(face_dict, f)
+        job = training_jobs.submit(full=full)
+    except JobConflict as e:
+        raise HTTPException(status_code=409, detail={"error": str(e), "jobId": e.job.id})
+    return job.to_dict()
+
+@app.get("/api/train/latest")
+async def latest_training_job():
+    """Status of the most recent training job"""
+    job = training_jobs.latest()
+    if job is None:
+        raise HTTPException(status_code=404, detail="No training job")
+    return job.to_dict()
+
+@app.get("/api/train/{jobId}")
+async def training_job_status(jobId: str):
+    """Progress of a training job: students processed, samples, ETA and errors"""
+    job = training_jobs.get(jobId)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Training job not found")
+    return job.to_dict()
+
+@app.delete("/api/train/{jobId}")
+async def cancel_training_job(jobId: str):
+    """Ask a training job to stop after the student it is working on; the gallery is left unchanged"""
+    job = training_jobs.get(jobId)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Training job not found")
+    job.cancel()
+    return job.to_dict()
+
+def run_training(job):
+    """Embed every student folder in dataset/ and rebuild the gallery, reporting progress on job"""
+    if not os.path.exists(DATASET_PATH):
+        raise HTTPException(status_code=400, detail="No dataset found")
+
+    # Only folders whose photos changed since the last run are embedded again
+    scan = scan_dataset(DATASET_PATH)
+    preset = "light" if AUGMENTATION_AVAILABLE else None
+    settings = training_settings(MODEL_PACK, TRAIN_PROFILE, preset)
+    if job.options.get("full"):
+        manifest = TrainingManifest(MANIFEST_FILE, settings)
+        existing = {}
+    else:
+        manifest = TrainingManifest.load(MANIFEST_FILE, settings)
+        current = local_gallery.get()
+        existing = current.to_dict() if current is not None else {}
+    student_folders, unchanged, removed = manifest.plan(scan, existing.keys())
+
+    job.begin(len(student_folders))
+    tasks = [(folder, os.path.join(DATASET_PATH, folder), list(scan[folder])) for folder in student_folders]
+    results = {}
+    started = time.perf_counter()
+
+    if TRAIN_PROCESSES > 0 and len(tasks) > 1:
+        # Students fan out across worker processes, each with its own model and thread budget
+        processes = min(TRAIN_PROCESSES, len(tasks))
+        threads = TRAIN_THREADS_PER_WORKER or threads_per_worker(processes, TRAIN_THREAD_BUDGET or None)
+        pool = TrainingPool(processes, TRAIN_PROFILE, preset, threads)
+    else:
+        pool = None
+    try:
+        embedded = pool.embed_students(tasks) if pool else embed_students_serial(get_face_app(TRAIN_PROFILE), tasks, preset)
+        for student_folder, result in embedded:
+            results[student_folder] = result
+            for error in result["errors"]:
+                job.add_error(error)
+            job.student_done(len(result["embeddings"]), result["images"])
+            job.check_cancelled()
+    finally:
+        if pool is not None:
+            pool.close()
+    elapsed = time.perf_counter() - started
+
+    # Aggregate in sorted folder order so the outcome doesn't depend on which worker finished first
+    face_dict = {}
+    # Retrained folders in which no photo has a usable face any more
+    no_face = []
+    total_samples = 0
+    total_images = 0
+    for student_folder in sorted(results):
+        result = results[student_folder]
+        total_samples += len(result["embeddings"])
+        total_images += result["images"]
+        if len(result["embeddings"]):
+            face_dict[student_folder.lower()] = median_embedding(result["embeddings"])
+        else:
+            no_face.append(student_folder)
+        manifest.record(student_folder, scan[student_folder], embedded=bool(len(result["embeddings"])))
+
+    for student_folder in removed:
+        manifest.remove(student_folder)
+
+    # Last chance to cancel; from here on the database and gallery are updated
+    job.check_cancelled()
+
+    # Update database: one set-based statement for every retrained student
+    try:
+        with db.connection() as conn:
+            if conn is not None:
+                trained = {folder: face_dict[folder.lower()] for folder in student_folders if folder.lower() in face_dict}
+                matched = upsert_embeddings(conn, trained)
+                for folder in sorted(set(trained) - matched):
+                    job.add_error(f"{folder}: no matching student in the database")
+    except Exception as e:
+        print(f"DB update error: {e}")
+        job.add_error(f"Database update failed ({e})")
+
+    # Merge into the existing gallery (dropping deleted folders, and retrained
+    # ones without a face rather than keeping their old embedding), rebuild the
+    # index, save, and swap the resident gallery to the new version; the
+    # manifest goes last so a crash in between only means more students are
+    # re-embedded next time. The index is written first: until the gallery it
+    # belongs to replaces the old one, loading ignores it and searches exactly.
+    present = {folder.lower() for folder in scan} - {folder.lower() for folder in no_face}
+    merged = {student_id: emb for student_id, emb in existing.items() if student_id in present}
+    merged.update(face_dict)
+    if no_face:
+        print(f"Dropped from the gallery, no face in any photo: {', '.join(no_face)}")
+    merged, index = build_gallery_index(merged, GALLERY_INDEX, GALLERY_INDEX_LISTS or None, GALLERY_INDEX_NPROBE)
+    save_index(INDEX_FILE, index)
+    save_gallery(EMBEDDINGS_FILE, merged, model_name=MODEL_PACK, dtype=GALLERY_DTYPE)
+    manifest.save()
+    local_gallery.reload()
+    # A database-sourced gallery picks the new embeddings up from the trigger
+    # Training can touch any course's students: rebuild every course subset and re-fetch enrollment
+    course_galleries.invalidate()
 
-        return JSONResponse(
-            content={
-                "success": True,
-                "studentsTrained": len(face_dict),
-                "totalSamples": len(embedding_vectors),
-            }
-        )
+    return {
+        "success": True,
+        "studentsTrained": len(face_dict),
+        "studentsUnchanged": len(unchanged),
+        "studentsRemoved": len(removed),
+        "studentsWithoutFace": no_face,
+        "galleryStudents": len(merged),
+        "galleryIndex": index.describe() if index is not None else {"kind": "exact"},
+        "totalSamples": total_samples,
+        "imagesProcessed": total_images,
+        "imagesPerSecond": round(total_images / elapsed, 2) if elapsed > 0 else 0.0,
+        "trainProcesses": pool.processes if pool is not None else 0,
+    }
 
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
+@app.post("/api/courses/{courseId}/invalidate")
+async def invalidate_course_gallery(courseId: str):
+    """Drop the cached enrollment for a course after its students change"""
+    course_galleries.invalidate(courseId)
+    return {"success": True, "courseId": courseId}
 
 # --- REPLACED recognize endpoint with digital-zoom + angle crops for small faces ---
 @app.post("/api/recognize")
@@ -360,142 +575,304 @@ async def recognize_faces(
     courseId: str = Form(...),
 ):
     """Recognize faces from uploaded frames with automatic digital-zoom + small-angle crops for small faces."""
-    try:
-        # Clear and save new frames
-        shutil.rmtree(TEST_IMAGES_PATH, ignore_errors=True)
-        Path(TEST_IMAGES_PATH).mkdir(parents=True, exist_ok=True)
-
-        for idx, frame in enumerate(frames):
-            file_path = Path(TEST_IMAGES_PATH) / f"frame_{idx}.jpg"
-            with open(file_path, "wb") as buffer:
-                shutil.copyfileobj(frame.file, buffer)
-
-        # Load embeddings
-        if not os.path.exists(EMBEDDINGS_FILE):
-            raise HTTPException(status_code=400, detail="No trained model found")
-
-        with open(EMBEDDINGS_FILE, "rb") as f:
-            known_faces = pickle.load(f)
-
-        app_model = get_face_app()
-        recognized_students = set()
-        all_detections = []
-        confidences = []
-
-        image_files = sorted(
-            [
-                f
-                for f in os.listdir(TEST_IMAGES_PATH)
-                if f.lower().endswith((".jpg", ".jpeg", ".png"))
-            ]
+    # Read frames into memory, in upload order
+    frame_bytes = [await frame.read() for frame in frames]
+    return await run_blocking(run_recognition, frame_bytes, courseId)
+
+def detection_entry(image_idx, face, student_id, similarity):
+    return {
+        "imageIndex": image_idx,
+        "faceIndex": face["faceIndex"],
+        "confidence": float(similarity),
+        "studentId": student_id,
+        "bbox": [int(v) for v in face["bbox"]],
+        "was_small": face["small"],
+    }
+
+def frame_chunks(analyzer, n_frames, confirmed, incremental=False):
+    """
+    Frame positions to process together: everything at once, or one chunk per
+    round of workers when results are wanted incrementally. With early exit,
+    stop once every enrolled student is confirmed.
+    """
+    if confirmed is None and not incremental:
+        yield list(range(n_frames))
+        return
+    step = max(1, analyzer.parallelism)
+    for start in range(0, n_frames, step):
+        if confirmed is not None and confirmed.complete:
+            return
+        yield list(range(start, min(n_frames, start + step)))
+
+def direct_candidates(face):
+    return as_embedding_matrix([] if face["embedding"] is None else [face["embedding"]])
+
+def iter_frame_matches(analyzer, image_indices, matcher, threshold, confirmed=None, incremental=False):
+    """Match every face of every frame independently, yielding (image index, detections) per frame."""
+    for positions in frame_chunks(analyzer, len(image_indices), confirmed, incremental):
+        if confirmed is None:
+            for pos, frame_faces in zip(positions, analyzer.analyze(positions)):
+                # Score every candidate of every face in this frame with one matrix multiply
+                matches = matcher.best_matches([face["candidates"] for face in frame_faces], threshold)
+                yield image_indices[pos], [
+                    detection_entry(image_indices[pos], face, best_match, best_sim)
+                    for face, (best_match, best_sim) in zip(frame_faces, matches)
+                    if best_match
+                ]
+            continue
+
+        detected = analyzer.detect(positions)
+
+        # Zoom candidates only for small faces that might still reveal someone not yet confirmed
+        direct = [matcher.best_matches([direct_candidates(face) for face in faces], threshold) for faces in detected]
+        to_expand = [
+            [face for face, (match, _) in zip(faces, matches) if face["small"] and match not in confirmed]
+            for faces, matches in zip(detected, direct)
+        ]
+        variants = {}
+        for faces, embeddings in zip(to_expand, analyzer.expand(to_expand, positions)):
+            for face, embs in zip(faces, embeddings):
+                variants[id(face)] = embs
+
+        for pos, faces in zip(positions, detected):
+            groups = [as_embedding_matrix(list(direct_candidates(face)) + list(variants.get(id(face), []))) for face in faces]
+            frame_detections = []
+            for face, (best_match, best_sim) in zip(faces, matcher.best_matches(groups, threshold)):
+                if best_match:
+                    confirmed.update(best_match, best_sim)
+                    frame_detections.append(detection_entry(image_indices[pos], face, best_match, best_sim))
+            yield image_indices[pos], frame_detections
+
+def match_frames(analyzer, image_indices, matcher, threshold, confirmed=None):
+    """Match every face of every frame independently. Returns (detections, frames processed, None)."""
+    detections = []
+    processed = 0
+    for _, frame_detections in iter_frame_matches(analyzer, image_indices, matcher, threshold, confirmed):
+        detections.extend(frame_detections)
+        processed += 1
+    return detections, processed, None
+
+def embed_observations(analyzer, n_frames, observations):
+    """Fill in the direct embedding of the (frame position, face) observations not embedded yet, one pass per frame."""
+    to_embed = [[] for _ in range(n_frames)]
+    for frame_pos, face in observations:
+        if not face.get("embedded"):
+            face["embedded"] = True
+            to_embed[frame_pos].append(face)
+    for faces, embeddings in zip(to_embed, analyzer.embed(to_embed)):
+        for face, emb in zip(faces, embeddings):
+            face["embedding"] = None if emb is None else np.asarray(emb, dtype=np.float32)
+
+def match_tracks(analyzer, image_indices, matcher, threshold, confirmed=None):
+    """
+    Link detector boxes across frames into tracks before anything is
+    embedded, embed only each track's TRACK_BEST_OBSERVATIONS best
+    observations (plus small-face candidates for those), and match each track
+    once. Every observation of a matched track is reported as a detection with
+    its trackId. Returns (detections, frames processed, one summary per track).
+    """
+    detected = [[] for _ in image_indices]
+    tracks = []
+    processed = 0
+    for positions in frame_chunks(analyzer, len(image_indices), confirmed):
+        for pos, faces in zip(positions, analyzer.detect(positions, embed=False)):
+            detected[pos] = faces
+        # No embeddings yet, so tracks are linked on box overlap alone
+        tracks = link_tracks(
+            [(pos, detected[pos]) for pos in positions],
+            iou_threshold=TRACK_IOU_THRESHOLD,
+            similarity_threshold=TRACK_SIMILARITY_THRESHOLD,
+            tracks=tracks,
         )
+        processed += len(positions)
+        if confirmed is not None:
+            # Each track's best face so far decides whether later frames are still needed
+            embed_observations(analyzer, len(detected), [obs for track in tracks for obs in track.best(1)])
+            direct = matcher.best_matches([track_candidates(track) for track in tracks], threshold)
+            for best_match, best_sim in direct:
+                confirmed.update(best_match, best_sim)
+
+    embed_observations(analyzer, len(detected), [obs for track in tracks for obs in track.best(TRACK_BEST_OBSERVATIONS)])
+
+    # Tracks whose direct match is already confirmed gain nothing from zoom candidates
+    skip = set()
+    if confirmed is not None:
+        direct = matcher.best_matches([track_candidates(track) for track in tracks], threshold)
+        skip = {track.track_id for track, (best_match, _) in zip(tracks, direct) if best_match in confirmed}
+
+    # Small faces of each track's best observations, grouped by frame for one expand pass
+    to_expand = [[] for _ in detected]
+    for track in tracks:
+        if track.track_id in skip:
+            continue
+        for frame_pos, face in track.best(TRACK_BEST_OBSERVATIONS):
+            if face["small"]:
+                to_expand[frame_pos].append(face)
+    variants = {}
+    for faces, embeddings in zip(to_expand, analyzer.expand(to_expand)):
+        for face, embs in zip(faces, embeddings):
+            variants[id(face)] = embs
+
+    candidate_groups = [track_candidates(track, variants) for track in tracks]
+    detections, summaries = [], []
+    for track, (best_match, best_sim) in zip(tracks, matcher.best_matches(candidate_groups, threshold)):
+        summaries.append({
+            "trackId": track.track_id,
+            "studentId": best_match,
+            "confidence": float(best_sim) if best_match else None,
+            "imageIndices": [image_indices[frame_pos] for frame_pos in track.frames],
+            "embeddedObservations": sum(1 for _, face in track.observations if face.get("embedded")),
+        })
+        if not best_match:
+            continue
+        for frame_pos, face in track.observations:
+            entry = detection_entry(image_indices[frame_pos], face, best_match, best_sim)
+            entry["trackId"] = track.track_id
+            detections.append(entry)
+    return detections, processed, summaries
+
+def track_candidates(track, variants=None):
+    """Direct embeddings of all of a track's observations plus any expanded variants."""
+    candidates = []
+    for _, face in track.observations:
+        if face["embedding"] is not None:
+            candidates.append(face["embedding"])
+        if variants:
+            candidates.extend(variants.get(id(face), []))
+    return as_embedding_matrix(candidates)
+
+def prepare_recognition(frame_bytes, courseId):
+    """Course-narrowed gallery snapshot and the decoded (index, RGB frame) pairs of one request"""
+    if SAVE_RECOGNITION_FRAMES:
+        # Per-request folder so concurrent requests never touch each other's frames
+        request_dir = Path(TEST_IMAGES_PATH) / uuid.uuid4().hex
+        request_dir.mkdir(parents=True, exist_ok=True)
+        for idx, data in enumerate(frame_bytes):
+            (request_dir / f"frame_{idx}.jpg").write_bytes(data)
+
+    # Snapshot of the resident gallery for the whole request, narrowed to the course's students
+    matcher = gallery.get()
+    if matcher is None:
+        raise HTTPException(status_code=400, detail="No trained model found")
+    matcher = course_galleries.get(courseId, matcher)
+
+    images = []
+    for idx, data in enumerate(frame_bytes):
+        img = decode_image(data)
+        if img is not None:
+            images.append((idx, cv2.cvtColor(img, cv2.COLOR_BGR2RGB)))
+    return matcher, images
+
+def open_analyzer(frames):
+    if process_pool is not None:
+        # Frames fan out across the worker processes; this thread only aggregates
+        return process_pool.analyzer(frames, timeout=executor.timeout)
+    return LocalFrameAnalyzer(get_face_app(RECOGNIZE_PROFILE), frames, SMALL_FACE_MODE, MIN_FACE_AREA)
+
+def recognition_summary(detections, frames_processed, tracks=None):
+    """The /api/recognize response body for a list of detections (and, with TRACK_FACES, the tracks)"""
+    confidences = [d["confidence"] for d in detections]
+    summary = {
+        "totalFaces": len(detections),
+        "recognizedStudents": list({d["studentId"]: None for d in detections}),
+        "averageConfidence": float(np.mean(confidences)) if confidences else 0.0,
+        "detections": detections,
+        "framesProcessed": frames_processed,
+    }
+    if tracks is not None:
+        summary["tracks"] = tracks
+    return summary
 
-        # Thresholds you can tune:
-        MIN_FACE_AREA = 40 * 40  # if face bbox area < this we consider it "small" (pixels^2)
-        SIMILARITY_THRESHOLD = 0.45
+def run_recognition(frame_bytes, courseId):
+    """Detect, embed and match faces in the decoded frames"""
+    try:
+        matcher, images = prepare_recognition(frame_bytes, courseId)
+
+        # Early exit: stop once every enrolled student is confirmed
+        confirmed = ConfirmedStudents(matcher.ids, EARLY_EXIT_CONFIDENCE) if EARLY_EXIT else None
+        match = match_tracks if TRACK_FACES else match_frames
+        with open_analyzer([img_rgb for _, img_rgb in images]) as analyzer:
+            detections, frames_processed, tracks = match(
+                analyzer, [idx for idx, _ in images], matcher, SIMILARITY_THRESHOLD, confirmed
+            )
 
-        for idx, img_name in enumerate(image_files):
-            img_path = os.path.join(TEST_IMAGES_PATH, img_name)
-            img = cv2.imread(img_path)
-            if img is None:
-                continue
+        return JSONResponse(content=recognition_summary(detections, frames_processed, tracks))
 
-            img_rgb = cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
-            faces = app_model.get(img_rgb)
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
 
-            for face_idx, face in enumerate(faces):
-                # insightface bbox format: [x1,y1,x2,y2] but confirm with your version
-                try:
-                    x1, y1, x2, y2 = [int(v) for v in face.bbox[:4]]
-                except Exception:
-                    # fallback - skip if bbox not available
-                    continue
-
-                bw = max(1, x2 - x1)
-                bh = max(1, y2 - y1)
-                area = bw * bh
-
-                candidate_embeddings = []
-
-                # Always include the direct embedding if available
-                emb = getattr(face, "normed_embedding", None)
-                if emb is not None and np.linalg.norm(emb) > 0:
-                    emb = emb / np.linalg.norm(emb)
-                    candidate_embeddings.append(emb)
-
-                # If face is small, create augmented crops (digital zoom + small angle/shift)
-                if area < MIN_FACE_AREA:
-                    crops = make_augmented_crops(
-                        img_rgb,
-                        (x1, y1, x2, y2),
-                        zoom_scales=(1.8, 2.6),
-                        shifts_px=(0.0, 0.10, -0.10),
-                        rotations_deg=(0, -8, 8),
-                    )
-                    # Run detector/feature extractor on crops
-                    for crop in crops:
-                        try:
-                            faces_c = app_model.get(crop)
-                        except Exception:
-                            faces_c = []
-
-                        if not faces_c:
-                            continue
-                        # choose the largest face in the crop
-                        f_best = max(
-                            faces_c,
-                            key=lambda f: (f.bbox[2] - f.bbox[0]) * (f.bbox[3] - f.bbox[1]),
-                        )
-                        emb_c = getattr(f_best, "normed_embedding", None)
-                        if emb_c is not None and np.linalg.norm(emb_c) > 0:
-                            emb_c = emb_c / np.linalg.norm(emb_c)
-                            candidate_embeddings.append(emb_c)
-
-                # Now compare all candidate embeddings to known faces and pick best
-                best_match, best_sim = None, 0.0
-                for emb_candidate in candidate_embeddings:
-                    if emb_candidate is None or np.linalg.norm(emb_candidate) == 0:
-                        continue
-                    for name, known_emb in known_faces.items():
-                        # ensure both normalized
-                        try:
-                            ke = known_emb / np.linalg.norm(known_emb) if np.linalg.norm(known_emb) > 0 else known_emb
-                        except Exception:
-                            ke = known_emb
-                        denom = np.linalg.norm(emb_candidate) * np.linalg.norm(ke)
-                        if denom == 0:
-                            continue
-                        sim = float(np.dot(emb_candidate, ke) / denom)
-                        if sim > best_sim and sim > SIMILARITY_THRESHOLD:
-                            best_match, best_sim = name, sim
+@app.post("/api/recognize/stream")
+async def recognize_faces_stream(
+    frames: List[UploadFile] = File(...),
+    courseId: str = Form(...),
+):
+    """
+    Same recognition as /api/recognize, streamed as NDJSON: one
+    {"type": "frame"} line per frame as soon as it is matched (its detections
+    and the students it recognized for the first time), then one
+    {"type": "summary"} line with the /api/recognize response body. Frames are
+    matched independently (no cross-frame tracking) so each result is final.
+    """
+    frame_bytes = [await frame.read() for frame in frames]
+    # Errors before the first frame (busy, no gallery) still come back as HTTP status codes
+    matcher, images = await run_blocking(prepare_recognition, frame_bytes, courseId)
+    return StreamingResponse(stream_recognition(matcher, images), media_type="application/x-ndjson")
 
-                if best_match:
-                    recognized_students.add(best_match)
-                    confidences.append(best_sim)
-                    all_detections.append(
-                        {
-                            "imageIndex": idx,
-                            "faceIndex": face_idx,
-                            "confidence": float(best_sim),
-                            "studentId": best_match,
-                            "bbox": [int(x1), int(y1), int(x2), int(y2)],
-                            "was_small": area < MIN_FACE_AREA,
-                        }
-                    )
+def close_when_idle(submitted):
+    """
+    Close a stream's analyzer once the last of its executor jobs has finished.
+    submitted holds the pool futures in order, the first one opening the
+    analyzer. A step that timed out (504) or whose client disconnected keeps
+    running on its thread, and closing before it ends would unlink the shared
+    memory it is still reading.
+    """
+    if not submitted:
+        return
+    opened = submitted[0]
 
-        avg_confidence = float(np.mean(confidences)) if confidences else 0.0
+    def close(_):
+        if not opened.cancelled() and opened.exception() is None:
+            opened.result().__exit__(None, None, None)
 
-        return JSONResponse(
-            content={
-                "totalFaces": len(all_detections),
-                "recognizedStudents": list(recognized_students),
-                "averageConfidence": avg_confidence,
-                "detections": all_detections,
-            }
-        )
+    # Runs right away if idle, otherwise on the job's thread when it finishes
+    submitted[-1].add_done_callback(close)
 
+async def stream_recognition(matcher, images):
+    confirmed = ConfirmedStudents(matcher.ids, EARLY_EXIT_CONFIDENCE) if EARLY_EXIT else None
+    submitted = []
+    detections, seen, processed = [], set(), 0
+    try:
+        analyzer = await run_blocking(open_analyzer, [img_rgb for _, img_rgb in images], on_submit=submitted.append)
+        steps = iter_frame_matches(
+            analyzer, [idx for idx, _ in images], matcher, SIMILARITY_THRESHOLD, confirmed, incremental=True
+        )
+        while True:
+            # One executor job per step, so streams share the inference queue with everything else
+            step = await run_blocking(next, steps, None, on_submit=submitted.append)
+            if step is None:
+                break
+            image_idx, frame_detections = step
+            processed += 1
+            new_students = [sid for sid in dict.fromkeys(d["studentId"] for d in frame_detections) if sid not in seen]
+            seen.update(new_students)
+            detections.extend(frame_detections)
+            yield json.dumps(
+                {
+                    "type": "frame",
+                    "imageIndex": image_idx,
+                    "detections": frame_detections,
+                    "newStudents": new_students,
+                }
+            ) + "\n"
+        yield json.dumps({"type": "summary", **recognition_summary(detections, processed)}) + "\n"
+    except HTTPException as e:
+        yield json.dumps({"type": "error", "status": e.status_code, "detail": e.detail}) + "\n"
     except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
+        yield json.dumps({"type": "error", "status": 500, "detail": str(e)}) + "\n"
+    finally:
+        close_when_idle(submitted)
 
 if __name__ == "__main__":
     import uvicorn
@@ -0,0 +1,331 @@
+# recognition.py
+"""
+Per-frame face analysis shared by the API and the inference worker processes:
+detect faces, embed them, and add zoom/shift/rotation candidate embeddings for
+small faces. Matching against the gallery happens in the caller.
+"""
+import os
+from types import SimpleNamespace
+
+import cv2
+import numpy as np
+
+from face_models import align_faces, embed_aligned, embed_small_faces, get_recognition_model
+from tiling import detect_tiled
+
+# if face bbox area < this we consider it "small" (pixels^2)
+MIN_FACE_AREA = 40 * 40
+
+# SMALL_FACE_MODE=tiled: detector scales and window overlap of the tiled pass
+TILE_SCALES = tuple(float(v) for v in os.getenv("TILE_SCALES", "1.0,0.5").split(","))
+TILE_OVERLAP = float(os.getenv("TILE_OVERLAP", "0.2"))
+
+# --------------------
+# Helper functions for digital zoom & augmented crops
+# --------------------
+def clamp(val, a, b):
+    return max(a, min(b, val))
+
+def crop_with_margin(img, x1, y1, x2, y2, margin=0.4):
+    """Crop image around bbox with relative margin (fraction of bbox size)."""
+    h, w = img.shape[:2]
+    bw = x2 - x1
+    bh = y2 - y1
+    mx = int(bw * margin)
+    my = int(bh * margin)
+    cx1 = clamp(x1 - mx, 0, w - 1)
+    cy1 = clamp(y1 - my, 0, h - 1)
+    cx2 = clamp(x2 + mx, 0, w - 1)
+    cy2 = clamp(y2 + my, 0, h - 1)
+    # ensure indices are valid
+    if cx2 <= cx1 or cy2 <= cy1:
+        return img[0:1, 0:1].copy()
+    return img[cy1:cy2, cx1:cx2].copy()
+
+def make_augmented_crops(img_rgb, bbox, zoom_scales=(1.6, 2.2), shifts_px=(0.0, 0.08, -0.08), rotations_deg=(0, -10, 10)):
+    """
+    Given an RGB image and bbox (x1,y1,x2,y2), produce a list of augmented crops:
+    - zoom_scales: relative scale factor to increase crop size (digital zoom)
+    - shifts_px: relative horizontal shifts (fraction of face width). Positive -> right.
+    - rotations_deg: small rotation angles to simulate different head tilts
+    Returns list of crops (RGB numpy arrays).
+    """
+    h, w = img_rgb.shape[:2]
+    x1, y1, x2, y2 = [int(v) for v in bbox]
+    bw = max(1, x2 - x1)
+    bh = max(1, y2 - y1)
+    center_x = x1 + bw // 2
+    center_y = y1 + bh // 2
+
+    crops = []
+    for scale in zoom_scales:
+        crop_w = int(bw * scale)
+        crop_h = int(bh * scale)
+        for shift_frac in shifts_px:
+            shift_x = int(shift_frac * bw)
+            cx = clamp(center_x + shift_x, 0, w - 1)
+            cy = clamp(center_y, 0, h - 1)
+            x_start = clamp(cx - crop_w // 2, 0, w - 1)
+            y_start = clamp(cy - crop_h // 2, 0, h - 1)
+            x_end = clamp(x_start + crop_w, 0, w)
+            y_end = clamp(y_start + crop_h, 0, h)
+            if x_end <= x_start or y_end <= y_start:
+                continue
+            crop = img_rgb[y_start:y_end, x_start:x_end].copy()
+            if crop.size == 0:
+                continue
+
+            # Add small rotations
+            for angle in rotations_deg:
+                if angle == 0:
+                    crops.append(crop)
+                else:
+                    (ch, cw) = crop.shape[:2]
+                    M = cv2.getRotationMatrix2D((cw // 2, ch // 2), angle, 1.0)
+                    rotated = cv2.warpAffine(crop, M, (cw, ch), flags=cv2.INTER_LINEAR, borderMode=cv2.BORDER_REPLICATE)
+                    crops.append(rotated)
+    # also return a slightly padded original crop as baseline
+    try:
+        original_pad = crop_with_margin(img_rgb, x1, y1, x2, y2, margin=0.25)
+        if original_pad is not None and original_pad.size > 0:
+            crops.insert(0, original_pad)
+    except Exception:
+        pass
+    return crops
+
+def largest_face(faces):
+    return max(faces, key=lambda f: (f.bbox[2] - f.bbox[0]) * (f.bbox[3] - f.bbox[1]))
+
+def embed_keypoints(app_model, img_rgb, keypoint_sets):
+    """Normalized ArcFace embeddings of the faces at these 5-point landmarks, one batch (None where unusable)."""
+    rec_model = get_recognition_model(app_model)
+    usable = [i for i, kps in enumerate(keypoint_sets) if kps is not None]
+    embeddings = [None] * len(keypoint_sets)
+    if rec_model is None or not usable:
+        return embeddings
+    crops = align_faces(img_rgb, [keypoint_sets[i] for i in usable], image_size=rec_model.input_size[0])
+    for i, emb in zip(usable, embed_aligned(rec_model, crops)):
+        norm = np.linalg.norm(emb)
+        embeddings[i] = emb / norm if norm > 0 else None
+    return embeddings
+
+def detect_boxes(app_model, img_rgb, small_face_mode="aligned"):
+    """
+    Detector pass only, without ArcFace: faces with bbox, kps and det_score
+    (normed_embedding None), like the FaceAnalysis faces detect_faces reads.
+    """
+    if small_face_mode == "tiled":
+        bboxes, kpss = detect_tiled(app_model, img_rgb, scales=TILE_SCALES, overlap=TILE_OVERLAP)
+    elif hasattr(app_model, "detect"):
+        # BatchScheduler
+        bboxes, kpss = app_model.detect(img_rgb)
+    else:
+        bboxes, kpss = app_model.det_model.detect(img_rgb, max_num=0, metric="default")
+    return [
+        SimpleNamespace(bbox=bboxes[i, :4], kps=None if kpss is None else kpss[i], det_score=float(bboxes[i, 4]), normed_embedding=None)
+        for i in range(bboxes.shape[0])
+    ]
+
+def get_faces_tiled(app_model, img_rgb):
+    """Faces from the tiled multi-scale detector pass, embedded in one ArcFace batch."""
+    faces = detect_boxes(app_model, img_rgb, "tiled")
+    for face, emb in zip(faces, embed_keypoints(app_model, img_rgb, [face.kps for face in faces])):
+        face.normed_embedding = emb
+    return faces
+
+def detect_faces(app_model, img_rgb, min_face_area=MIN_FACE_AREA, small_face_mode="aligned", embed=True):
+    """
+    Detect faces in an RGB frame. Returns one dict per face: faceIndex, bbox,
+    kps, detScore, area, small, and embedding - the detector-aligned
+    embedding (None if it is missing or zero, and always None with
+    embed=False, which runs the detector alone). small_face_mode "tiled" runs
+    the tiled multi-scale detector instead of one full-frame pass.
+    """
+    if not embed:
+        detected = detect_boxes(app_model, img_rgb, small_face_mode)
+    elif small_face_mode == "tiled":
+        detected = get_faces_tiled(app_model, img_rgb)
+    else:
+        detected = app_model.get(img_rgb)
+
+    frame_faces = []
+    for face_idx, face in enumerate(detected):
+        # insightface bbox format: [x1,y1,x2,y2] but confirm with your version
+        try:
+            x1, y1, x2, y2 = [int(v) for v in face.bbox[:4]]
+        except Exception:
+            # fallback - skip if bbox not available
+            continue
+
+        bw = max(1, x2 - x1)
+        bh = max(1, y2 - y1)
+        area = bw * bh
+
+        emb = getattr(face, "normed_embedding", None)
+        if emb is not None and np.linalg.norm(emb) > 0:
+            emb = np.asarray(emb, dtype=np.float32)
+        else:
+            emb = None
+
+        kps = getattr(face, "kps", None)
+        frame_faces.append(
+            {
+                "faceIndex": face_idx,
+                "bbox": (x1, y1, x2, y2),
+                "kps": None if kps is None else np.asarray(kps, dtype=np.float32),
+                "detScore": float(getattr(face, "det_score", 0.0) or 0.0),
+                "area": area,
+                "small": area < min_face_area,
+                "embedding": emb,
+            }
+        )
+    return frame_faces
+
+def expand_candidates(app_model, img_rgb, faces, small_face_mode="aligned"):
+    """
+    Extra candidate embeddings (digital zoom + small angle/shift) for the given
+    detected faces. Returns one (k, d) float32 array per face, in order. In
+    "tiled" mode small faces were already detected at full resolution, so
+    there are none.
+    """
+    if small_face_mode == "tiled":
+        return [as_embedding_matrix([]) for _ in faces]
+    rec_model = get_recognition_model(app_model) if small_face_mode == "aligned" else None
+    expanded = [[] for _ in faces]
+
+    aligned = []  # (index into faces, kps, face width) for the batched path
+    for i, face in enumerate(faces):
+        x1, y1, x2, y2 = face["bbox"]
+        if rec_model is not None and face["kps"] is not None:
+            # Embedded below together with the other faces of this frame
+            aligned.append((i, face["kps"], max(1, x2 - x1)))
+            continue
+
+        crops = make_augmented_crops(
+            img_rgb,
+            (x1, y1, x2, y2),
+            zoom_scales=(1.8, 2.6),
+            shifts_px=(0.0, 0.10, -0.10),
+            rotations_deg=(0, -8, 8),
+        )
+        # Run detector/feature extractor on crops
+        for crop in crops:
+            try:
+                faces_c = app_model.get(crop)
+            except Exception:
+                faces_c = []
+
+            if not faces_c:
+                continue
+            # choose the largest face in the crop
+            emb_c = getattr(largest_face(faces_c), "normed_embedding", None)
+            if emb_c is not None and np.linalg.norm(emb_c) > 0:
+                expanded[i].append(emb_c)
+
+    # Aligned zoom/shift/rotation variants, one ArcFace batch per frame
+    if aligned:
+        try:
+            variant_embeddings = embed_small_faces(
+                rec_model,
+                img_rgb,
+                [(kps, bw) for _, kps, bw in aligned],
+            )
+        except Exception as e:
+            print(f"Batched small-face embedding failed: {e}")
+            variant_embeddings = []
+        for (i, _, _), embs in zip(aligned, variant_embeddings):
+            expanded[i].extend(embs)
+
+    return [as_embedding_matrix(embs) for embs in expanded]
+
+def as_embedding_matrix(embeddings):
+    """Stack a list of embeddings into a (k, d) float32 array ((0, 0) when empty)."""
+    if len(embeddings) == 0:
+        return np.zeros((0, 0), dtype=np.float32)
+    return np.asarray(embeddings, dtype=np.float32).reshape(len(embeddings), -1)
+
+def analyze_frame(app_model, img_rgb, small_face_mode="aligned", min_face_area=MIN_FACE_AREA):
+    """
+    Detect and embed every face in an RGB frame. Returns the detect_faces dicts
+    with candidates added - an (k, d) float32 array of candidate embeddings
+    (the direct one plus zoom variants for small faces).
+    """
+    frame_faces = detect_faces(app_model, img_rgb, min_face_area, small_face_mode)
+    small = [face for face in frame_faces if face["small"]]
+    variants = dict(zip(map(id, small), expand_candidates(app_model, img_rgb, small, small_face_mode)))
+
+    for face in frame_faces:
+        candidates = [] if face["embedding"] is None else [face["embedding"]]
+        if id(face) in variants:
+            candidates.extend(variants[id(face)])
+        face["candidates"] = as_embedding_matrix(candidates)
+    return frame_faces
+
+class ConfirmedStudents:
+    """Which of the enrolled students have been matched at or above `confidence` so far."""
+
+    def __init__(self, enrolled_ids, confidence):
+        self.enrolled = set(enrolled_ids)
+        self.confidence = confidence
+        self.confirmed = set()
+
+    def update(self, student_id, similarity):
+        if student_id in self.enrolled and similarity >= self.confidence:
+            self.confirmed.add(student_id)
+
+    def __contains__(self, student_id):
+        return student_id in self.confirmed
+
+    @property
+    def complete(self):
+        return bool(self.enrolled) and self.confirmed >= self.enrolled
+
+class LocalFrameAnalyzer:
+    """
+    Runs the per-frame steps on a list of RGB frames in this process. Same
+    interface as the shared-memory analyzer of inference.ProcessInferencePool:
+    positions selects frames (default all), and results come back in that order.
+    """
+
+    # Frames worth handing out at once; the analyzer itself works one at a time
+    parallelism = 1
+
+    def __init__(self, app_model, frames, small_face_mode="aligned", min_face_area=MIN_FACE_AREA):
+        self.app_model = app_model
+        self.frames = frames
+        self.small_face_mode = small_face_mode
+        self.min_face_area = min_face_area
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def _selected(self, positions):
+        return self.frames if positions is None else [self.frames[pos] for pos in positions]
+
+    def analyze(self, positions=None):
+        return [
+            analyze_frame(self.app_model, img, self.small_face_mode, self.min_face_area)
+            for img in self._selected(positions)
+        ]
+
+    def detect(self, positions=None, embed=True):
+        return [
+            detect_faces(self.app_model, img, self.min_face_area, self.small_face_mode, embed)
+            for img in self._selected(positions)
+        ]
+
+    def embed(self, faces_per_frame, positions=None):
+        """Direct embeddings (or None) of the given detect_faces dicts, one list per frame."""
+        return [
+            embed_keypoints(self.app_model, img, [face["kps"] for face in faces]) if faces else []
+            for img, faces in zip(self._selected(positions), faces_per_frame)
+        ]
+
+    def expand(self, faces_per_frame, positions=None):
+        return [
+            expand_candidates(self.app_model, img, faces, self.small_face_mode) if faces else []
+            for img, faces in zip(self._selected(positions), faces_per_frame)
+        ]
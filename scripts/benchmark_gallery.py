@@ -0,0 +1,179 @@
+#!/usr/bin/env python3
+"""
+Gallery Quantization Benchmark
+Stores the gallery as float32, float16 and int8 and reports, for each, the
+memory it takes, matching throughput and how often its top-1 match agrees with
+float32 (plus the largest score difference). --nprobe 1,4,16 also builds an
+IVF index over the float32 gallery and reports the same for each nprobe, to
+pick GALLERY_INDEX_NPROBE.
+
+Queries are the embeddings of the photos in dataset/ (--dataset, needs the
+model) or gallery rows with Gaussian noise added, which is roughly how a new
+capture of an enrolled student differs from their median embedding.
+--synthetic N benchmarks a random N-student gallery instead of face_gallery.bin,
+to see how the encodings scale past the size of one school.
+
+Usage: python scripts/benchmark_gallery.py [--gallery face_gallery.bin] [--synthetic 50000]
+                                           [--dataset] [--queries 1000] [--noise 0.05] [--repeat 5]
+                                           [--nprobe 1,4,8,16] [--nlist 0]
+"""
+
+import os
+import sys
+import json
+import time
+import argparse
+
+import cv2
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from face_gallery import GALLERY_DTYPES, GalleryMatcher, load_gallery
+from face_index import build_ivf
+
+DATASET_PATH = "dataset"
+
+
+def dataset_queries(limit):
+    """Embeddings of the largest face in each dataset photo, as (n, d) float32."""
+    from face_models import load_face_app
+    from training import largest_face_embedding
+
+    app = load_face_app("enroll")
+    embeddings = []
+    for folder in sorted(os.listdir(DATASET_PATH)):
+        person_path = os.path.join(DATASET_PATH, folder)
+        if not os.path.isdir(person_path):
+            continue
+        for name in sorted(os.listdir(person_path)):
+            if len(embeddings) >= limit:
+                break
+            img = cv2.imread(os.path.join(person_path, name))
+            if img is None:
+                continue
+            emb = largest_face_embedding(app, cv2.cvtColor(img, cv2.COLOR_BGR2RGB))
+            if emb is not None:
+                embeddings.append(emb)
+    return np.asarray(embeddings, dtype=np.float32)
+
+
+def noisy_queries(reference, count, noise, rng):
+    rows = rng.integers(0, len(reference), size=count)
+    return reference.matrix[rows] + rng.normal(0.0, noise, size=(count, reference.dim)).astype(np.float32)
+
+
+def median_seconds(fn, repeat):
+    fn()  # warm up
+    elapsed = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn()
+        elapsed.append(time.perf_counter() - started)
+    return float(np.median(elapsed))
+
+
+def run_dtype(reference, dtype, queries, repeat, reference_scores):
+    matcher = reference.quantized(dtype)
+    median = median_seconds(lambda: matcher.scores(queries), repeat)
+    scores = matcher.scores(queries)
+
+    return {
+        "dtype": dtype,
+        "index": "exact",
+        "students": len(matcher),
+        "dim": matcher.dim,
+        "bytes": int(matcher.nbytes),
+        "megabytes": round(matcher.nbytes / 1e6, 2),
+        "queries": len(queries),
+        "queriesPerSecond": round(len(queries) / median, 1),
+        "comparisonsPerSecond": round(len(queries) * len(matcher) / median),
+        "top1Agreement": round(float(np.mean(scores.argmax(axis=1) == reference_scores.argmax(axis=1))), 5),
+        "maxScoreError": round(float(np.abs(scores - reference_scores).max()), 6),
+    }
+
+
+def run_ivf(reference, nprobes, nlist, queries, repeat, reference_scores):
+    """Top-1 recall and speed of an IVF index at each nprobe, against exact float32 search."""
+    exact_ids = reference.ids[reference_scores.argmax(axis=1)]
+    exact_seconds = median_seconds(lambda: reference.top_k(queries, 1), repeat)
+    index, order = build_ivf(reference.matrix, nlist=nlist)
+    matcher = GalleryMatcher.from_matrix(reference.ids[order], np.ascontiguousarray(reference.matrix[order]))
+    matcher.index = index
+
+    results = []
+    for nprobe in nprobes:
+        index.nprobe = nprobe
+        median = median_seconds(lambda: matcher.top_k(queries, 1), repeat)
+        ids, scores = matcher.top_k(queries, 1)
+        results.append({
+            "dtype": "float32",
+            "index": f"ivf/{index.nlist}/{nprobe}",
+            "nlist": index.nlist,
+            "nprobe": nprobe,
+            "students": len(matcher),
+            "dim": matcher.dim,
+            "bytes": int(matcher.nbytes + index.centroids.nbytes),
+            "megabytes": round((matcher.nbytes + index.centroids.nbytes) / 1e6, 2),
+            "queries": len(queries),
+            "queriesPerSecond": round(len(queries) / median, 1),
+            "speedupVsExact": round(exact_seconds / median, 2),
+            "top1Agreement": round(float(np.mean(ids[:, 0] == exact_ids)), 5),
+            "maxScoreError": round(float(np.abs(scores[:, 0] - reference_scores.max(axis=1)).max()), 6),
+        })
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--gallery", default="face_gallery.bin")
+    parser.add_argument("--synthetic", type=int, help="random gallery of this many students")
+    parser.add_argument("--dim", type=int, default=512)
+    parser.add_argument("--dataset", action="store_true", help="query with the dataset photos (loads the model)")
+    parser.add_argument("--queries", type=int, default=1000)
+    parser.add_argument("--noise", type=float, default=0.05)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--nprobe", help="comma-separated IVF nprobe values to benchmark")
+    parser.add_argument("--nlist", type=int, default=0, help="IVF lists (0: sqrt(students))")
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(args.seed)
+    if args.synthetic:
+        reference = GalleryMatcher(
+            [f"student-{i}" for i in range(args.synthetic)],
+            rng.standard_normal((args.synthetic, args.dim)).astype(np.float32),
+        )
+    else:
+        if not os.path.exists(args.gallery):
+            raise SystemExit(f"{args.gallery} not found (train first, or use --synthetic N)")
+        # Always start from full precision, whatever the file was saved as
+        stored = load_gallery(args.gallery)
+        reference = GalleryMatcher.from_matrix(stored.ids, np.ascontiguousarray(stored.dense()))
+    if len(reference) == 0:
+        raise SystemExit("Gallery is empty")
+
+    if args.dataset:
+        queries = dataset_queries(args.queries)
+        if len(queries) == 0:
+            raise SystemExit(f"No faces found in {DATASET_PATH}")
+    else:
+        queries = noisy_queries(reference, args.queries, args.noise, rng)
+    reference_scores = reference.scores(queries)
+
+    results = [run_dtype(reference, dtype, queries, args.repeat, reference_scores) for dtype in GALLERY_DTYPES]
+    if args.nprobe:
+        nprobes = [int(n) for n in args.nprobe.split(",")]
+        results += run_ivf(reference, nprobes, args.nlist or None, queries, args.repeat, reference_scores)
+
+    print(f"{'dtype':<8} {'index':<14} {'students':>9} {'MB':>8} {'queries/s':>11} {'top-1 agree':>12} {'max err':>9}", file=sys.stderr)
+    for r in results:
+        print(
+            f"{r['dtype']:<8} {r['index']:<14} {r['students']:>9} {r['megabytes']:>8} {r['queriesPerSecond']:>11} "
+            f"{r['top1Agreement']:>12} {r['maxScoreError']:>9}",
+            file=sys.stderr,
+        )
+    print(json.dumps(results))
+
+
+if __name__ == "__main__":
+    main()
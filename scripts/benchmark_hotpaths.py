@@ -0,0 +1,321 @@
+#!/usr/bin/env python3
+"""
+Hot Path Microbenchmarks
+Times the recognition and training code paths we maintain (cropping, small-face
+candidates, gallery matching, overlap dedup, image enhancement, training
+aggregation) with a stub face model, so it runs without downloading buffalo_l
+and measures our code rather than ONNX Runtime. Benchmarks are parameterized
+over gallery size and faces per frame.
+
+Results are written as JSON (stdout, or --output) with the git commit and
+library versions; --compare takes an earlier results file and prints the
+change per benchmark, to catch regressions between commits.
+
+Usage: python scripts/benchmark_hotpaths.py [--gallery-sizes 100,1000,10000] [--faces 5,20,50]
+                                            [--only match_frame,analyze_aligned] [--min-time 0.3]
+                                            [--output results.json] [--compare baseline.json]
+"""
+
+import os
+import sys
+import json
+import time
+import atexit
+import shutil
+import platform
+import argparse
+import tempfile
+import subprocess
+from types import SimpleNamespace
+
+import cv2
+import numpy as np
+
+SCRIPTS_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.dirname(SCRIPTS_DIR)
+sys.path.insert(0, ROOT)
+sys.path.insert(0, SCRIPTS_DIR)
+from face_gallery import GalleryMatcher
+from recognition import MIN_FACE_AREA, analyze_frame, crop_with_margin, make_augmented_crops
+from training import build_augmenter, embed_student, median_embedding
+
+import recognize as recognize_script
+
+EMBEDDING_DIM = 512
+FRAME_SHAPE = (720, 1280)
+# Training samples per student: photos plus augmented copies
+SAMPLES_PER_STUDENT = 9
+
+
+# --------------------
+# Stub face model
+# --------------------
+def _unit(rng, n=None):
+    v = rng.standard_normal((n or 1, EMBEDDING_DIM)).astype(np.float32)
+    v /= np.linalg.norm(v, axis=1, keepdims=True)
+    return v if n else v[0]
+
+
+def _stub_face(rng, x1, y1, size):
+    # Eye, eye, nose, mouth corners, roughly where SCRFD puts them
+    kps = np.array([[0.3, 0.4], [0.7, 0.4], [0.5, 0.6], [0.35, 0.8], [0.65, 0.8]], dtype=np.float32) * size
+    return SimpleNamespace(
+        bbox=np.array([x1, y1, x1 + size, y1 + size], dtype=np.float32),
+        kps=kps + np.array([x1, y1], dtype=np.float32),
+        det_score=0.9,
+        normed_embedding=_unit(rng),
+    )
+
+
+class StubRecognition:
+    """ArcFace stand-in: a fixed-cost random unit embedding per crop."""
+
+    input_size = (112, 112)
+
+    def __init__(self, seed=0):
+        self.rng = np.random.default_rng(seed)
+
+    def get_feat(self, crops):
+        return _unit(self.rng, len(crops))
+
+
+class StubFaceApp:
+    """
+    FaceAnalysis stand-in. Frames of FRAME_SHAPE get `faces` faces on a grid,
+    alternately small (below MIN_FACE_AREA) and large; any other image (crops,
+    enrollment photos) gets one centered face.
+    """
+
+    def __init__(self, faces, seed=0):
+        rng = np.random.default_rng(seed)
+        self.det_size = (640, 640)
+        # Own seed: crop embeddings must not repeat the detected faces' embeddings
+        self.models = {"recognition": StubRecognition(seed + 1)}
+        height, width = FRAME_SHAPE
+        cols = int(np.ceil(np.sqrt(faces * width / height)))
+        cell = width // cols
+        small = int(np.sqrt(MIN_FACE_AREA)) - 10
+        self.frame_faces = [
+            _stub_face(rng, (i % cols) * cell + 5, (i // cols) * cell + 5, small if i % 2 else min(cell - 10, 90))
+            for i in range(faces)
+        ]
+        self.single_face = _stub_face(rng, 0, 0, 1)
+
+    def get(self, img):
+        h, w = img.shape[:2]
+        if (h, w) == FRAME_SHAPE:
+            return list(self.frame_faces)
+        size = int(min(h, w) * 0.6)
+        face = _stub_face(np.random.default_rng(0), (w - size) // 2, (h - size) // 2, max(size, 1))
+        face.normed_embedding = self.single_face.normed_embedding
+        return [face]
+
+
+def synthetic_frame(seed=0):
+    rng = np.random.default_rng(seed)
+    return rng.integers(0, 256, (*FRAME_SHAPE, 3), dtype=np.uint8)
+
+
+def synthetic_gallery(students, seed=1):
+    return GalleryMatcher([f"student-{i}" for i in range(students)], _unit(np.random.default_rng(seed), students))
+
+
+# --------------------
+# Benchmarks: each takes its parameters and returns the function to time
+# --------------------
+def bench_crop_with_margin(faces, **_):
+    app, img = StubFaceApp(faces), synthetic_frame()
+    boxes = [[int(v) for v in face.bbox] for face in app.frame_faces]
+    return lambda: [crop_with_margin(img, *box) for box in boxes]
+
+
+def bench_make_augmented_crops(faces, **_):
+    app, img = StubFaceApp(faces), synthetic_frame()
+    return lambda: [make_augmented_crops(img, face.bbox) for face in app.frame_faces]
+
+
+def bench_analyze_aligned(faces, **_):
+    app, img = StubFaceApp(faces), synthetic_frame()
+    return lambda: analyze_frame(app, img, "aligned")
+
+
+def bench_analyze_crops(faces, **_):
+    app, img = StubFaceApp(faces), synthetic_frame()
+    return lambda: analyze_frame(app, img, "crops")
+
+
+def bench_match_frame(faces, gallery, **_):
+    """API matching: every face's candidates (direct + small-face variants) scored in one call."""
+    app, img = StubFaceApp(faces), synthetic_frame()
+    groups = [face["candidates"] for face in analyze_frame(app, img, "aligned")]
+    matcher = synthetic_gallery(gallery)
+    return lambda: matcher.best_matches(groups, 0.45)
+
+
+def bench_assign_unique(faces, gallery, **_):
+    """scripts/recognize.py matching: one embedding per face, each student at most once."""
+    matcher = synthetic_gallery(gallery)
+    queries = _unit(np.random.default_rng(2), faces)
+    return lambda: matcher.assign_unique(queries, 0.45)
+
+
+def bench_dedupe_overlapping(faces, **_):
+    # process_image detects on the frame and on its enhanced copy, so every face comes twice
+    app = StubFaceApp(faces)
+    detected = app.frame_faces + app.frame_faces
+    return lambda: recognize_script.dedupe_overlapping_faces(detected)
+
+
+def bench_enhance_image(**_):
+    img = synthetic_frame()
+    return lambda: recognize_script.enhance_image(img)
+
+
+def bench_train_aggregate(gallery, **_):
+    """Per-student median of the training samples, then the gallery matrix built from them."""
+    rng = np.random.default_rng(3)
+    samples = {f"student-{i}": _unit(rng, SAMPLES_PER_STUDENT) for i in range(gallery)}
+
+    def run():
+        face_dict = {folder: median_embedding(samples[folder]) for folder in sorted(samples)}
+        return GalleryMatcher.from_dict(face_dict)
+
+    return run
+
+
+def bench_train_embed_student(**_):
+    """One student's photos through augmentation and the (stub) model, as in training."""
+    folder = tempfile.mkdtemp(prefix="bench-student-")
+    atexit.register(shutil.rmtree, folder, ignore_errors=True)
+    rng = np.random.default_rng(4)
+    images = []
+    for i in range(5):
+        name = f"photo_{i}.jpg"
+        cv2.imwrite(os.path.join(folder, name), rng.integers(0, 256, (480, 640, 3), dtype=np.uint8))
+        images.append(name)
+    app, augmenter = StubFaceApp(1), build_augmenter("light")
+    preset = "light" if augmenter is not None else None
+    return lambda: embed_student(app, "student", folder, images, augmenter, preset)
+
+
+# name -> (function, parameters it takes)
+BENCHMARKS = {
+    "crop_with_margin": (bench_crop_with_margin, ("faces",)),
+    "make_augmented_crops": (bench_make_augmented_crops, ("faces",)),
+    "analyze_aligned": (bench_analyze_aligned, ("faces",)),
+    "analyze_crops": (bench_analyze_crops, ("faces",)),
+    "match_frame": (bench_match_frame, ("faces", "gallery")),
+    "assign_unique": (bench_assign_unique, ("faces", "gallery")),
+    "dedupe_overlapping": (bench_dedupe_overlapping, ("faces",)),
+    "enhance_image": (bench_enhance_image, ()),
+    "train_aggregate": (bench_train_aggregate, ("gallery",)),
+    "train_embed_student": (bench_train_embed_student, ()),
+}
+
+
+def time_calls(fn, min_time, min_calls):
+    """Per-call seconds of fn, called until both min_time and min_calls are reached (after one warm-up call)."""
+    fn()
+    durations = []
+    started = time.perf_counter()
+    while len(durations) < min_calls or time.perf_counter() - started < min_time:
+        call_started = time.perf_counter()
+        fn()
+        durations.append(time.perf_counter() - call_started)
+    return np.asarray(durations)
+
+
+def parameter_grid(takes, values):
+    grid = [{}]
+    for name in takes:
+        grid = [{**point, name: value} for point in grid for value in values[name]]
+    return grid
+
+
+def result_key(result):
+    return (result["benchmark"], tuple(sorted(result["params"].items())))
+
+
+def environment():
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, cwd=ROOT
+        ).stdout.strip() or None
+    except OSError:
+        commit = None
+    return {
+        "commit": commit,
+        "timestamp": time.time(),
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "opencv": cv2.__version__,
+        "cpuCount": os.cpu_count(),
+        "platform": platform.platform(),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--gallery-sizes", default="100,1000,10000")
+    parser.add_argument("--faces", default="5,20,50", help="faces per frame")
+    parser.add_argument("--only", help="comma-separated benchmark names (default: all)")
+    parser.add_argument("--min-time", type=float, default=0.3, help="seconds to run each benchmark for")
+    parser.add_argument("--min-calls", type=int, default=5)
+    parser.add_argument("--output", help="also write the results to this file")
+    parser.add_argument("--compare", help="results file of an earlier run to compare against")
+    parser.add_argument("--list", action="store_true", help="list the benchmarks and exit")
+    args = parser.parse_args()
+
+    if args.list:
+        for name, (fn, takes) in BENCHMARKS.items():
+            print(f"{name:<22} params: {','.join(takes) or '-':<14} {(fn.__doc__ or '').strip()}")
+        return
+
+    values = {
+        "gallery": [int(v) for v in args.gallery_sizes.split(",")],
+        "faces": [int(v) for v in args.faces.split(",")],
+    }
+    names = args.only.split(",") if args.only else list(BENCHMARKS)
+    unknown = [name for name in names if name not in BENCHMARKS]
+    if unknown:
+        raise SystemExit(f"Unknown benchmark(s): {', '.join(unknown)} (see --list)")
+
+    results = []
+    for name in names:
+        fn, takes = BENCHMARKS[name]
+        for params in parameter_grid(takes, values):
+            durations = time_calls(fn(**params), args.min_time, args.min_calls)
+            results.append({
+                "benchmark": name,
+                "params": params,
+                "calls": len(durations),
+                "meanMs": round(float(durations.mean()) * 1000, 4),
+                "medianMs": round(float(np.median(durations)) * 1000, 4),
+                "p95Ms": round(float(np.percentile(durations, 95)) * 1000, 4),
+            })
+            print(f"  {name} {params}: {results[-1]['medianMs']} ms", file=sys.stderr)
+
+    baseline = {}
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = {result_key(r): r for r in json.load(f)["results"]}
+
+    print(f"\n{'benchmark':<22} {'params':<26} {'median ms':>10} {'p95 ms':>10} {'calls':>7} {'vs base':>8}", file=sys.stderr)
+    for r in results:
+        params = ",".join(f"{k}={v}" for k, v in r["params"].items()) or "-"
+        base = baseline.get(result_key(r))
+        change = f"{(r['medianMs'] / base['medianMs'] - 1) * 100:+.1f}%" if base and base["medianMs"] else ""
+        print(
+            f"{r['benchmark']:<22} {params:<26} {r['medianMs']:>10} {r['p95Ms']:>10} {r['calls']:>7} {change:>8}",
+            file=sys.stderr,
+        )
+
+    report = {"environment": environment(), "results": results}
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=1)
+    print(json.dumps(report))
+
+
+if __name__ == "__main__":
+    main()
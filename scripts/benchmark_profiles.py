@@ -0,0 +1,100 @@
+#!/usr/bin/env python3
+"""
+Model Profile Benchmark
+Loads each FaceAnalysis model profile in a fresh process and reports load time,
+resident memory and per-frame latency on the images in test-images/.
+
+Usage: python scripts/benchmark_profiles.py [--profiles recognize,enroll,full] [--repeat 3]
+"""
+
+import os
+import sys
+import json
+import time
+import argparse
+import subprocess
+
+import cv2
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from face_models import PROFILES, current_rss_mb, load_face_app
+
+TEST_FOLDER = "test-images"
+
+
+def load_frames(folder):
+    frames = []
+    for name in sorted(os.listdir(folder)):
+        if name.lower().endswith((".jpg", ".jpeg", ".png")):
+            img = cv2.imread(os.path.join(folder, name))
+            if img is not None:
+                frames.append(cv2.cvtColor(img, cv2.COLOR_BGR2RGB))
+    return frames
+
+
+def run_profile(profile, repeat):
+    """Benchmark one profile in this process and return its stats."""
+    frames = load_frames(TEST_FOLDER)
+    if not frames:
+        raise SystemExit(f"No images found in {TEST_FOLDER}")
+
+    rss_start = current_rss_mb()
+    face_app = load_face_app(profile)
+    # First call pays ONNX graph initialization; keep it out of the latency numbers
+    face_app.get(frames[0])
+
+    latencies, faces = [], 0
+    for _ in range(repeat):
+        for frame in frames:
+            started = time.perf_counter()
+            faces += len(face_app.get(frame))
+            latencies.append((time.perf_counter() - started) * 1000)
+
+    return {
+        **face_app.profile_stats,
+        "rssMb": round(current_rss_mb(), 1),
+        "rssAfterLoadDeltaMb": round(current_rss_mb() - rss_start, 1),
+        "frames": len(latencies),
+        "facesPerFrame": round(faces / len(latencies), 2),
+        "frameMsMean": round(float(np.mean(latencies)), 2),
+        "frameMsP95": round(float(np.percentile(latencies, 95)), 2),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--profiles", default=",".join(PROFILES))
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--worker", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        print(json.dumps(run_profile(args.worker, args.repeat)))
+        return
+
+    # Each profile runs in its own process so memory numbers don't overlap
+    results = []
+    for profile in args.profiles.split(","):
+        out = subprocess.run(
+            [sys.executable, os.path.abspath(__file__), "--worker", profile, "--repeat", str(args.repeat)],
+            capture_output=True,
+            text=True,
+        )
+        if out.returncode != 0:
+            print(f"[X] {profile} failed:\n{out.stderr}", file=sys.stderr)
+            continue
+        results.append(json.loads(out.stdout.strip().splitlines()[-1]))
+
+    print(f"{'profile':<10} {'modules':<40} {'load s':>7} {'RSS MB':>8} {'frame ms':>9} {'p95 ms':>8}", file=sys.stderr)
+    for r in results:
+        print(
+            f"{r['profile']:<10} {','.join(r['modules']):<40} {r['loadSeconds']:>7} "
+            f"{r['rssAfterLoadDeltaMb']:>8} {r['frameMsMean']:>9} {r['frameMsP95']:>8}",
+            file=sys.stderr,
+        )
+    print(json.dumps(results))
+
+
+if __name__ == "__main__":
+    main()
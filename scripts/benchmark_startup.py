@@ -0,0 +1,95 @@
+#!/usr/bin/env python3
+"""
+Startup Benchmark
+Imports the API module (and, for comparison, each heavy dependency on its own)
+in fresh interpreters and reports import time, resident memory after import
+and which heavy dependencies the import pulled in. Run it before and after
+touching imports to keep cold starts in check.
+
+Usage: python scripts/benchmark_startup.py [--targets main,cv2,mediapipe] [--repeat 5]
+"""
+
+import os
+import sys
+import json
+import argparse
+import subprocess
+
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+HEAVY_MODULES = [
+    "cv2", "onnxruntime", "insightface", "mediapipe", "albumentations",
+    "PIL", "psycopg2", "sklearn", "matplotlib",
+]
+DEFAULT_TARGETS = ["main"] + HEAVY_MODULES
+
+# Runs in the child interpreter: time one import, then report RSS and loaded heavy modules
+CHILD = """
+import json, os, sys, time
+sys.path.insert(0, {root!r})
+baseline = time.perf_counter()
+import {target}
+seconds = time.perf_counter() - baseline
+
+def rss_mb():
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / (1024 * 1024)
+    except (OSError, ValueError, IndexError):
+        import resource
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+print(json.dumps({{
+    "seconds": seconds,
+    "rssMb": rss_mb(),
+    "loaded": [m for m in {heavy!r} if m in sys.modules],
+}}))
+"""
+
+
+def measure(target, repeat):
+    """Median import time / RSS of `import target` over `repeat` fresh interpreters."""
+    runs = []
+    for _ in range(repeat):
+        out = subprocess.run(
+            [sys.executable, "-c", CHILD.format(root=ROOT, target=target, heavy=HEAVY_MODULES)],
+            capture_output=True,
+            text=True,
+            cwd=ROOT,
+        )
+        if out.returncode != 0:
+            error = (out.stderr.strip().splitlines() or ["failed"])[-1]
+            return {"target": target, "error": error}
+        runs.append(json.loads(out.stdout.strip().splitlines()[-1]))
+    return {
+        "target": target,
+        "importSeconds": round(float(np.median([r["seconds"] for r in runs])), 3),
+        "rssMb": round(float(np.median([r["rssMb"] for r in runs])), 1),
+        "heavyModulesLoaded": runs[-1]["loaded"],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--targets", default=",".join(DEFAULT_TARGETS))
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    results = [measure(target, args.repeat) for target in args.targets.split(",")]
+
+    print(f"{'target':<16} {'import s':>9} {'RSS MB':>8}  heavy modules loaded", file=sys.stderr)
+    for r in results:
+        if "error" in r:
+            print(f"{r['target']:<16} {'-':>9} {'-':>8}  {r['error']}", file=sys.stderr)
+            continue
+        print(
+            f"{r['target']:<16} {r['importSeconds']:>9} {r['rssMb']:>8}  {','.join(r['heavyModulesLoaded'])}",
+            file=sys.stderr,
+        )
+    print(json.dumps(results))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,49 @@
+#!/usr/bin/env python3
+"""
+Install the faceEmbedding change trigger
+Creates (or replaces) the trigger on "Student" that sends every changed
+student id on the channel replicas with GALLERY_SOURCE=database listen to.
+Run it once per database after `prisma db push` / migrations, instead of
+having every API replica run the DDL at startup; --print-sql writes the
+statements out for a migration or a DBA instead of executing them.
+
+Usage: python scripts/install_embedding_trigger.py [--print-sql]
+"""
+
+import os
+import sys
+import argparse
+
+from dotenv import load_dotenv
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from db import EMBEDDING_CHANNEL, EMBEDDING_TRIGGER_SQL, Database, install_embedding_trigger
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--print-sql", action="store_true", help="print the SQL instead of running it")
+    args = parser.parse_args()
+
+    if args.print_sql:
+        print(EMBEDDING_TRIGGER_SQL)
+        return
+
+    load_dotenv()
+    database_url = os.getenv("DATABASE_URL")
+    if not database_url:
+        raise SystemExit("DATABASE_URL is not set")
+
+    db = Database(database_url, maxconn=1)
+    try:
+        with db.connection() as conn:
+            if conn is None:
+                raise SystemExit("Could not connect to the database")
+            install_embedding_trigger(conn)
+    finally:
+        db.close()
+    print(f"Installed the faceEmbedding trigger (channel {EMBEDDING_CHANNEL})")
+
+
+if __name__ == "__main__":
+    main()
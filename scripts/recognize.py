@@ -7,8 +7,6 @@ Processes images from test-images/ folder and outputs JSON results only.
 import os
 import cv2
 import numpy as np
-from insightface.app import FaceAnalysis
-import pickle
 from PIL import Image, ImageDraw, ImageFont, ImageEnhance
 import json
 import sys
@@ -17,6 +15,11 @@ import contextlib
 import io
 import shutil
 
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from face_gallery import load_gallery, migrate_legacy_gallery
+from face_index import load_index
+from face_models import MODEL_PACK, load_face_app
+
 # ----------------- Logging Setup -----------------
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.INFO)
@@ -30,7 +33,9 @@ logger.addHandler(stderr_handler)
 # ----------------- Paths -----------------
 TEST_FOLDER = "test-images"
 OUTPUT_FOLDER = "output"
-EMBEDDINGS_FILE = "face_embeddings.pkl"
+EMBEDDINGS_FILE = "face_gallery.bin"
+LEGACY_EMBEDDINGS_FILE = "face_embeddings.pkl"
+INDEX_FILE = "face_gallery.index.npz"
 
 # ----------------- Helper Functions -----------------
 def enhance_image(img):
@@ -44,32 +49,17 @@ def enhance_image(img):
         logger.warning(f"Image enhancement failed: {e}")
         return img
 
-def cosine_similarity(a, b):
-    return np.dot(a, b) / (np.linalg.norm(a) * np.linalg.norm(b))
-
-def save_annotated_image(pil_image, faces, known_faces, image_name, confidence_threshold):
+def save_annotated_image(pil_image, faces, matcher, image_name, confidence_threshold):
     try:
         draw = ImageDraw.Draw(pil_image)
         try:
             font = ImageFont.truetype("arial.ttf", 20)
         except:
             font = ImageFont.load_default()
-        recognized = set()
-        for idx, face in enumerate(faces):
+        matches = matcher.assign_unique([face.normed_embedding for face in faces], confidence_threshold) if faces else []
+        for face, (name, best_sim) in zip(faces, matches):
             bbox = face.bbox.astype(int)
-            embedding = face.normed_embedding
-            if np.linalg.norm(embedding) > 0:
-                embedding = embedding / np.linalg.norm(embedding)
-            best_match, best_sim = "Unknown", 0.0
-            for name, known_emb in known_faces.items():
-                try:
-                    sim = cosine_similarity(embedding, known_emb)
-                    if sim > best_sim and sim > confidence_threshold and name not in recognized:
-                        best_match, best_sim = name.title(), sim
-                except:
-                    continue
-            if best_match != "Unknown":
-                recognized.add(best_match.lower())
+            best_match = name.title() if name else "Unknown"
             color = "lime" if best_match != "Unknown" else "red"
             text_color = "black" if best_match != "Unknown" else "white"
             draw.rectangle([bbox[0]-1, bbox[1]-1, bbox[2]+1, bbox[3]+1], outline=color, width=3)
@@ -87,7 +77,21 @@ def safe_get(app, img):
         sys.stderr.write(out + "\n")
     return faces
 
-def process_image(image_path, known_faces, app, idx, confidence_threshold=0.45):
+def dedupe_overlapping_faces(faces, overlap=0.7):
+    """Keep the first of any faces whose intersection covers more than `overlap` of the smaller box."""
+    unique_faces = []
+    for face in faces:
+        bbox = face.bbox
+        if not any(
+            max(0, min(bbox[2], uf.bbox[2])-max(bbox[0], uf.bbox[0])) *
+            max(0, min(bbox[3], uf.bbox[3])-max(bbox[1], uf.bbox[1])) / 
+            min((bbox[2]-bbox[0])*(bbox[3]-bbox[1]), (uf.bbox[2]-uf.bbox[0])*(uf.bbox[3]-uf.bbox[1])) > overlap
+            for uf in unique_faces
+        ):
+            unique_faces.append(face)
+    return unique_faces
+
+def process_image(image_path, matcher, app, idx, confidence_threshold=0.45):
     detections = []
     try:
         img = cv2.imread(image_path)
@@ -104,29 +108,12 @@ def process_image(image_path, known_faces, app, idx, confidence_threshold=0.45):
             except Exception as e:
                 logger.debug(f"Face detection error: {e}")
         # Remove overlapping faces
-        unique_faces = []
-        for face in faces:
-            bbox = face.bbox
-            if not any(
-                max(0, min(bbox[2], uf.bbox[2])-max(bbox[0], uf.bbox[0])) *
-                max(0, min(bbox[3], uf.bbox[3])-max(bbox[1], uf.bbox[1])) / 
-                min((bbox[2]-bbox[0])*(bbox[3]-bbox[1]), (uf.bbox[2]-uf.bbox[0])*(uf.bbox[3]-uf.bbox[1])) > 0.7
-                for uf in unique_faces
-            ):
-                unique_faces.append(face)
-        recognized = set()
-        for i, face in enumerate(unique_faces):
+        unique_faces = dedupe_overlapping_faces(faces)
+        # Score all faces of the image against the gallery at once
+        scored = [(i, face) for i, face in enumerate(unique_faces) if np.linalg.norm(face.normed_embedding) > 0]
+        matches = matcher.assign_unique([face.normed_embedding for _, face in scored], confidence_threshold) if scored else []
+        for (i, face), (best_match, best_sim) in zip(scored, matches):
             bbox = face.bbox.astype(int).tolist()
-            emb = face.normed_embedding
-            if np.linalg.norm(emb) > 0:
-                emb = emb / np.linalg.norm(emb)
-            else:
-                continue
-            best_match, best_sim = None, 0.0
-            for name, known_emb in known_faces.items():
-                sim = cosine_similarity(emb, known_emb)
-                if sim > best_sim and sim > confidence_threshold and name not in recognized:
-                    best_match, best_sim = name, sim
             detections.append({
                 "imageIndex": idx,
                 "faceIndex": i,
@@ -135,9 +122,8 @@ def process_image(image_path, known_faces, app, idx, confidence_threshold=0.45):
                 "studentId": best_match if best_match else None
             })
             if best_match:
-                recognized.add(best_match)
                 logger.info(f"✓ Recognized: {best_match} ({best_sim:.3f})")
-        save_annotated_image(pil, unique_faces, known_faces, os.path.basename(image_path), confidence_threshold)
+        save_annotated_image(pil, unique_faces, matcher, os.path.basename(image_path), confidence_threshold)
     except Exception as e:
         logger.error(f"Error processing {image_path}: {e}")
     return detections
@@ -160,6 +146,7 @@ def main():
                 logger.warning(f"Failed to delete {file_path}: {e}")
 
         # Load known face embeddings
+        migrate_legacy_gallery(LEGACY_EMBEDDINGS_FILE, EMBEDDINGS_FILE, model_name=MODEL_PACK)
         if not os.path.exists(EMBEDDINGS_FILE):
             print(json.dumps({
                 "error": "No trained model found",
@@ -167,10 +154,10 @@ def main():
             }))
             sys.exit(1)
 
-        with open(EMBEDDINGS_FILE, "rb") as f:
-            known_faces = pickle.load(f)
+        matcher = load_gallery(EMBEDDINGS_FILE, expected_model=MODEL_PACK)
+        matcher.index = load_index(INDEX_FILE, matcher, nprobe=int(os.getenv("GALLERY_INDEX_NPROBE", "8")))
 
-        if not known_faces:
+        if len(matcher) == 0:
             print(json.dumps({
                 "error": "No trained faces found",
                 "totalFaces": 0, "recognizedStudents": [], "averageConfidence": 0.0, "detections": []
@@ -178,8 +165,7 @@ def main():
             sys.exit(1)
 
         with contextlib.redirect_stdout(sys.stderr):
-            app = FaceAnalysis(name='buffalo_l', providers=['CPUExecutionProvider'])
-            app.prepare(ctx_id=0, det_size=(640,640))
+            app = load_face_app(os.getenv("RECOGNIZE_PROFILE", "recognize"))
 
         if not os.path.exists(TEST_FOLDER):
             print(json.dumps({
@@ -199,7 +185,7 @@ def main():
         all_detections, total_faces, recognized_students, confidences = [], 0, set(), []
 
         for idx, img_name in enumerate(sorted(image_files)):
-            dets = process_image(os.path.join(TEST_FOLDER, img_name), known_faces, app, idx)
+            dets = process_image(os.path.join(TEST_FOLDER, img_name), matcher, app, idx)
             all_detections.extend(dets)
             for d in dets:
                 total_faces += 1
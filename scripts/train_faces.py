@@ -1,96 +1,68 @@
 # -*- coding: utf-8 -*-
 import os
-import cv2
+import importlib.util
 import numpy as np
-# Use albumentations instead of imgaug for NumPy 2.0 compatibility
-try:
-    import albumentations as A
-    AUGMENTATION_AVAILABLE = True
-except ImportError:
-    AUGMENTATION_AVAILABLE = False
+# Use albumentations instead of imgaug for NumPy 2.0 compatibility; training.build_augmenter imports it
+AUGMENTATION_AVAILABLE = importlib.util.find_spec("albumentations") is not None
+if not AUGMENTATION_AVAILABLE:
     print("Warning: albumentations not installed. Augmentation will be skipped.")
 import matplotlib.pyplot as plt
 from sklearn.manifold import TSNE
 from sklearn.preprocessing import StandardScaler
-from insightface.app import FaceAnalysis
-import pickle
 import sys
-import psycopg2
-from psycopg2.extras import execute_values
+import time
+import argparse
 from dotenv import load_dotenv
 
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from face_gallery import load_gallery, migrate_legacy_gallery, save_gallery
+from face_index import build_gallery_index, save_index
+from face_models import MODEL_PACK, load_face_app
+from training_manifest import TrainingManifest, scan_dataset
+from training import TrainingPool, embed_students_serial, median_embedding, training_settings
+from db import Database, upsert_embeddings
+
 # Load environment variables
 load_dotenv()
 
 # Path Configuration
 DATASET_PATH = "dataset"
-OUTPUT_FILE = "face_embeddings.pkl"
+OUTPUT_FILE = "face_gallery.bin"
+LEGACY_OUTPUT_FILE = "face_embeddings.pkl"
+INDEX_FILE = "face_gallery.index.npz"
+MANIFEST_FILE = "face_manifest.json"
 VISUALIZATION_PATH = "training_visualization.png"
 
-def get_db_connection():
-    """Get PostgreSQL database connection"""
-    try:
-        database_url = os.getenv('DATABASE_URL')
-        if not database_url:
-            print("Warning: DATABASE_URL not found in environment variables")
-            return None
-        
-        conn = psycopg2.connect(database_url)
-        return conn
-    except Exception as e:
-        print(f"Database connection failed: {e}")
-        return None
-
-def update_student_embedding(student_id, embedding_data):
-    """Update student face embedding in database"""
-    conn = get_db_connection()
-    if not conn:
-        print(f"Skipping database update for {student_id} (no connection)")
-        return False
-    
+def update_student_embeddings(embeddings):
+    """Store {student folder: embedding} in the database with one bulk statement; returns the folders matched"""
+    database_url = os.getenv('DATABASE_URL')
+    if not database_url:
+        print("Warning: DATABASE_URL not found in environment variables")
+        return set()
+
+    db = Database(database_url, maxconn=1)
     try:
-        cursor = conn.cursor()
-        
-        # Convert embedding to bytes
-        embedding_bytes = embedding_data.tobytes()
-        
-        # 1. Try to find by student ID first
-        cursor.execute("""
-            UPDATE "Student" 
-            SET "faceEmbedding" = %s 
-            WHERE id = %s
-        """, (embedding_bytes, student_id))
-        
-        if cursor.rowcount == 0:
-            # 2. Try to find by email prefix
-            cursor.execute("""
-                UPDATE "Student" 
-                SET "faceEmbedding" = %s 
-                FROM "User"
-                WHERE "Student"."userId" = "User".id 
-                AND "User".email LIKE %s
-            """, (embedding_bytes, f"{student_id}%"))
-        
-        conn.commit()
-        
-        if cursor.rowcount > 0:
-            print(f"  [OK] Database updated for {student_id}")
-            return True
-        else:
-            print(f"  [!] Student {student_id} not found in database")
-            return False
-            
+        with db.connection() as conn:
+            if conn is None:
+                print("  [!] Skipping database update (no connection)")
+                return set()
+            # Folders here may be named after the student's email instead of their id
+            return upsert_embeddings(conn, embeddings, match_email_prefix=True)
     except Exception as e:
-        print(f"  [X] Database update failed for {student_id}: {e}")
-        conn.rollback()
-        return False
+        print(f"  [X] Database update failed: {e}")
+        return set()
     finally:
-        if 'cursor' in locals() and cursor:
-            cursor.close()
-        if 'conn' in locals() and conn:
-            conn.close()
+        db.close()
 
 def main():
+    parser = argparse.ArgumentParser(description="Embed student photos under dataset/ into face_gallery.bin")
+    parser.add_argument("--full", action="store_true", help="re-embed every student, not only changed ones")
+    parser.add_argument("--processes", type=int, default=int(os.getenv("TRAIN_PROCESSES", "0")),
+                        help="worker processes embedding students in parallel (0 = serial)")
+    parser.add_argument("--threads", type=int, default=int(os.getenv("TRAIN_THREADS_PER_WORKER", "0")),
+                        help="ONNX/OpenCV threads per worker (0 = ORT_THREAD_BUDGET / processes)")
+    args = parser.parse_args()
+
     try:
         print("=" * 60)
         print("Face Recognition Training System")
@@ -102,32 +74,28 @@ def main():
             print(f"Please run photo.py first to capture student photos")
             sys.exit(1)
 
-        # Initialize InsightFace ArcFace model
+        # Initialize InsightFace ArcFace model (the workers load their own in parallel mode)
         print("\n[1/5] Initializing face recognition model...")
-        app = FaceAnalysis(name='buffalo_l', providers=['CPUExecutionProvider'])
-        app.prepare(ctx_id=0, det_size=(640, 640))
-        print("  [OK] Model loaded successfully")
+        train_profile = os.getenv("TRAIN_PROFILE", "enroll")
+        if args.processes > 0:
+            app = None
+            print(f"  [OK] {args.processes} worker processes will load '{train_profile}'")
+        else:
+            app = load_face_app(train_profile)
+            print(f"  [OK] Model loaded successfully ({app.profile_stats})")
 
         # Storage
         embedding_vectors = []
         labels = []
         face_dict = {}
-        db_update_results = {}
-        total_students = 0
+        # Retrained folders in which no photo has a usable face any more
+        no_face = []
         total_images_processed = 0
 
         # Enhanced augmentation pipeline
         print("\n[2/5] Setting up augmentation pipeline...")
-        augmenter = None
-        if AUGMENTATION_AVAILABLE:
-            augmenter = A.Compose([
-                A.HorizontalFlip(p=0.5),
-                A.Rotate(limit=15, p=0.8),
-                A.RandomBrightnessContrast(brightness_limit=0.2, contrast_limit=0.2, p=0.8),
-                A.HueSaturationValue(hue_shift_limit=10, sat_shift_limit=20, val_shift_limit=20, p=0.5),
-                A.GaussianBlur(blur_limit=(3, 5), p=0.3),
-                A.MultiplicativeNoise(multiplier=(0.9, 1.1), p=0.3),
-            ])
+        preset = "strong" if AUGMENTATION_AVAILABLE else None
+        if preset:
             print("  [OK] Augmentation ready (albumentations)")
         else:
             print("  [!] Augmentation disabled (albumentations not installed)")
@@ -135,125 +103,111 @@ def main():
         print("\n[3/5] Processing student photos...")
         print("-" * 60)
 
-        # Process each student folder
-        student_folders = [d for d in os.listdir(DATASET_PATH) 
-                           if os.path.isdir(os.path.join(DATASET_PATH, d))]
-        
-        if not student_folders:
+        # Process each new or changed student folder (--full re-embeds everything)
+        scan = scan_dataset(DATASET_PATH)
+        if not scan:
             print("Error: No student folders found in dataset/")
             print("Please run photo.py to capture photos first")
             sys.exit(1)
 
-        for idx, student_folder in enumerate(sorted(student_folders), 1):
-            person_path = os.path.join(DATASET_PATH, student_folder)
-            total_students += 1
-            person_embeddings = []
-            images_for_person = 0
-
-            print(f"\n[{idx}/{len(student_folders)}] Processing: {student_folder}")
-
-            # Get all image files
-            image_files = [f for f in os.listdir(person_path) 
-                           if f.lower().endswith(('.jpg', '.jpeg', '.png'))]
-            
-            if not image_files:
-                print(f"  [!] No images found for {student_folder}")
-                continue
-
-            for image_name in image_files:
-                image_path = os.path.join(person_path, image_name)
-                
+        settings = training_settings(MODEL_PACK, train_profile, preset)
+        existing = {}
+        if args.full:
+            manifest = TrainingManifest(MANIFEST_FILE, settings)
+        else:
+            manifest = TrainingManifest.load(MANIFEST_FILE, settings)
+            migrate_legacy_gallery(LEGACY_OUTPUT_FILE, OUTPUT_FILE, model_name=MODEL_PACK)
+            if os.path.exists(OUTPUT_FILE):
                 try:
-                    # Load image
-                    img = cv2.imread(image_path)
-                    if img is None:
-                        print(f"  [!] Skipping corrupted: {image_name}")
-                        continue
-                        
-                    img_rgb = cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
-
-                    # Detect faces in original
-                    faces = app.get(img_rgb)
-                    if len(faces) > 0:
-                        face = max(faces, key=lambda f: (f.bbox[2] - f.bbox[0]) * (f.bbox[3] - f.bbox[1]))
-                        emb = face.normed_embedding
-                        person_embeddings.append(emb)
-                        embedding_vectors.append(emb)
-                        labels.append(student_folder)
-                        images_for_person += 1
-
-                    # Augmentation (only if augmenter is available)
-                    if augmenter is not None:
-                        num_augmentations = min(3, max(1, 5 - len(image_files)))
-                        
-                        for aug_idx in range(num_augmentations):
-                            try:
-                                # Apply albumentations augmentation
-                                augmented = augmenter(image=img_rgb)
-                                aug_img = augmented['image']
-                                
-                                faces_aug = app.get(aug_img)
-                                
-                                if len(faces_aug) > 0:
-                                    face_aug = max(faces_aug, key=lambda f: (f.bbox[2] - f.bbox[0]) * (f.bbox[3] - f.bbox[1]))
-                                    emb_aug = face_aug.normed_embedding
-                                    person_embeddings.append(emb_aug)
-                                    embedding_vectors.append(emb_aug)
-                                    labels.append(student_folder)
-                                    
-                            except Exception as e:
-                                continue
-
+                    existing = load_gallery(OUTPUT_FILE, expected_model=MODEL_PACK).to_dict()
                 except Exception as e:
-                    print(f"  [!] Error processing {image_name}: {e}")
-                    continue
-
-            # Create representative embedding
-            if person_embeddings:
-                person_embeddings = np.array(person_embeddings)
-                
-                # Calculate median embedding and re-normalize
-                median_embedding = np.median(person_embeddings, axis=0)
-                median_embedding = median_embedding / np.linalg.norm(median_embedding)
-                
-                face_dict[student_folder.lower()] = median_embedding
-                total_images_processed += images_for_person
-                
-                print(f"  [OK] Processed {images_for_person} images")
-                print(f"  [OK] Generated {len(person_embeddings)} training samples")
+                    print(f"  [!] Could not read existing embeddings, retraining everyone: {e}")
+                    manifest = TrainingManifest(MANIFEST_FILE, settings)
+        student_folders, unchanged, removed = manifest.plan(scan, existing.keys())
+        print(f"  {len(student_folders)} to train, {len(unchanged)} unchanged, {len(removed)} removed")
+
+        tasks = [(folder, os.path.join(DATASET_PATH, folder), list(scan[folder])) for folder in sorted(student_folders)]
+        started = time.perf_counter()
+        results = {}
+        if args.processes > 0 and tasks:
+            with TrainingPool(min(args.processes, len(tasks)), train_profile, preset, args.threads or None) as pool:
+                for idx, (student_folder, result) in enumerate(pool.embed_students(tasks), 1):
+                    print(f"  [{idx}/{len(tasks)}] {student_folder}: {len(result['embeddings'])} samples")
+                    results[student_folder] = result
+        else:
+            for idx, (student_folder, result) in enumerate(embed_students_serial(app, tasks, preset), 1):
+                print(f"  [{idx}/{len(tasks)}] {student_folder}: {len(result['embeddings'])} samples")
+                results[student_folder] = result
+        elapsed = time.perf_counter() - started
+
+        # Aggregate in sorted order so the result doesn't depend on which worker finished first
+        for student_folder in sorted(results):
+            result = results[student_folder]
+            for error in result["errors"]:
+                print(f"  [!] {error}")
+            if len(result["embeddings"]):
+                face_dict[student_folder.lower()] = median_embedding(result["embeddings"])
+                embedding_vectors.extend(result["embeddings"])
+                labels.extend([student_folder] * len(result["embeddings"]))
+                total_images_processed += result["images"]
             else:
-                print(f"  [X] No faces detected for {student_folder}")
+                no_face.append(student_folder)
+            manifest.record(student_folder, scan[student_folder], embedded=bool(len(result["embeddings"])))
+
+        if tasks:
+            print(f"\n  [OK] {total_images_processed} images in {elapsed:.1f}s ({total_images_processed / max(elapsed, 1e-9):.1f} images/s)")
+
+        for student_folder in removed:
+            manifest.remove(student_folder)
 
         print("\n" + "-" * 60)
 
+        # Merge with the students that didn't change, dropping deleted folders and
+        # retrained ones without a face (their old embedding no longer matches the photos)
+        present = {folder.lower() for folder in scan} - {folder.lower() for folder in no_face}
+        merged = {student_id: emb for student_id, emb in existing.items() if student_id in present}
+        merged.update(face_dict)
+        for student_folder in no_face:
+            print(f"  [!] {student_folder}: no face in any photo, removed from the gallery")
+
         # Validate results
-        if not face_dict:
+        if not merged:
             print("Error: No valid face embeddings generated!")
             sys.exit(1)
 
-        if len(face_dict) < 2:
+        if len(merged) < 2:
             print("Warning: Only one student trained. Add more students for better results.")
 
-        # Save embeddings
+        # Save embeddings (manifest last, so a crash only means more retraining next time)
         print("\n[4/5] Saving embeddings...")
-        with open(OUTPUT_FILE, "wb") as f:
-            pickle.dump(face_dict, f)
-        print(f"  [OK] Saved to '{OUTPUT_FILE}'")
+        merged, index = build_gallery_index(
+            merged,
+            os.getenv("GALLERY_INDEX", "exact"),
+            int(os.getenv("GALLERY_INDEX_LISTS", "0")) or None,
+            int(os.getenv("GALLERY_INDEX_NPROBE", "8")),
+        )
+        save_index(INDEX_FILE, index)
+        save_gallery(OUTPUT_FILE, merged, model_name=MODEL_PACK, dtype=os.getenv("GALLERY_DTYPE", "float32"))
+        manifest.save()
+        print(f"  [OK] Saved to '{OUTPUT_FILE}' ({len(merged)} students)")
+        if index is not None:
+            print(f"  [OK] Index: {index.describe()} -> '{INDEX_FILE}'")
 
         # Update database
         print("\n[5/5] Updating database...")
-        db_success_count = 0
-        for student_id, embedding in face_dict.items():
-            if update_student_embedding(student_id, embedding):
-                db_success_count += 1
-        
-        print(f"  [OK] Updated {db_success_count}/{len(face_dict)} records in database")
+        trained = {folder: face_dict[folder.lower()] for folder in results if folder.lower() in face_dict}
+        matched = update_student_embeddings(trained)
+        for folder in sorted(set(trained) - matched):
+            print(f"  [!] Student {folder} not found in database")
+        db_success_count = len(matched)
+
+        print(f"  [OK] Updated {db_success_count}/{len(trained)} records in database")
 
         # Summary
         print("\n" + "=" * 60)
         print("TRAINING COMPLETE!")
         print("=" * 60)
-        print(f"[OK] Students trained: {len(face_dict)}")
+        print(f"[OK] Students trained: {len(face_dict)} ({len(unchanged)} unchanged, {len(removed)} removed, {len(no_face)} without a face)")
         print(f"[OK] Total images processed: {total_images_processed}")
         print(f"[OK] Total training samples: {len(embedding_vectors)}")
         print(f"[OK] Embeddings file: '{OUTPUT_FILE}'")
@@ -267,7 +221,7 @@ def main():
 
         # Quality assessment
         print("\n" + "=" * 60)
-        assess_training_quality(face_dict, labels)
+        assess_training_quality(merged, labels)
         print("=" * 60)
 
     except Exception as e:
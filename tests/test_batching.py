@@ -0,0 +1,95 @@
+import os
+import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from batching import BatchScheduler, MicroBatcher
+
+
+def test_micro_batcher_coalesces_concurrent_callers():
+    batches = []
+    batcher = MicroBatcher(lambda items: batches.append(list(items)) or [item * 2 for item in items], window_ms=50)
+
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        results = list(pool.map(lambda i: batcher.submit([i, i + 100]), range(8)))
+
+    assert results == [[i * 2, (i + 100) * 2] for i in range(8)]
+    assert sum(len(batch) for batch in batches) == 16
+    assert len(batches) < 8
+
+
+def test_micro_batcher_respects_max_batch():
+    batches = []
+    batcher = MicroBatcher(lambda items: batches.append(len(items)) or list(items), window_ms=50, max_batch=4)
+
+    assert batcher.submit(list(range(10))) == list(range(10))
+    assert max(batches) <= 4
+
+
+def test_micro_batcher_raises_in_every_caller_of_a_failed_batch():
+    def fail(items):
+        raise RuntimeError("model crashed")
+
+    batcher = MicroBatcher(fail, window_ms=1)
+    with pytest.raises(RuntimeError, match="model crashed"):
+        batcher.submit([1, 2])
+
+
+class FixedBatchDetector:
+    """SCRFD stand-in exported with a fixed batch size of 1, like buffalo_l's det_10g."""
+
+    input_shape = [1, 3, 640, 640]
+
+    def __init__(self):
+        self.threads = set()
+
+    def detect(self, img, max_num=0, metric="default"):
+        self.threads.add(threading.current_thread().name)
+        return np.zeros((0, 5), dtype=np.float32), None
+
+
+class FixedBatchRecognition:
+    input_size = (112, 112)
+    taskname = "recognition"
+
+    def __init__(self):
+        self.calls = []
+
+    def get_feat(self, crops):
+        self.calls.append(len(crops))
+        if len(crops) > 1:
+            raise ValueError("batch size must be 1")
+        return np.ones((1, 512), dtype=np.float32)
+
+
+def face_app():
+    return SimpleNamespace(
+        det_model=FixedBatchDetector(),
+        det_size=(640, 640),
+        models={"recognition": FixedBatchRecognition()},
+    )
+
+
+def test_scheduler_detects_in_the_caller_thread_when_the_detector_cannot_batch():
+    app = face_app()
+    scheduler = BatchScheduler(app)
+
+    results = scheduler.detect_many([np.zeros((64, 64, 3), dtype=np.uint8)] * 3)
+
+    assert len(results) == 3
+    assert app.det_model.threads == {threading.current_thread().name}
+
+
+def test_scheduler_falls_back_to_single_crops_for_a_fixed_batch_embedder():
+    app = face_app()
+    scheduler = BatchScheduler(app, window_ms=20)
+
+    feats = scheduler.models["recognition"].get_feat([np.zeros((112, 112, 3), dtype=np.uint8)] * 3)
+
+    assert np.asarray(feats).shape == (3, 512)
+    assert app.models["recognition"].calls == [3, 1, 1, 1]
@@ -0,0 +1,62 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from db import EMAIL_PREFIX_MATCH_SQL, UPSERT_EMBEDDINGS_SQL, Database
+
+
+class ExhaustedPool:
+    def getconn(self):
+        raise RuntimeError("connection pool exhausted")
+
+
+class FakeConnection:
+    closed = 0
+
+    def __init__(self):
+        self.rolled_back = False
+
+    def rollback(self):
+        self.rolled_back = True
+
+
+class OnePool:
+    def __init__(self):
+        self.conn = FakeConnection()
+        self.returned = []
+
+    def getconn(self):
+        return self.conn
+
+    def putconn(self, conn, close=False):
+        self.returned.append((conn, close))
+
+
+def test_connection_without_url_yields_none():
+    with Database(None).connection() as conn:
+        assert conn is None
+
+
+def test_connection_yields_none_when_pool_cannot_hand_one_out():
+    db = Database("postgresql://fake")
+    db._pool = ExhaustedPool()
+    with db.connection() as conn:
+        assert conn is None
+
+
+def test_connection_rolls_back_and_returns_on_error():
+    db = Database("postgresql://fake")
+    db._pool = pool = OnePool()
+    with pytest.raises(ValueError):
+        with db.connection() as conn:
+            raise ValueError("query failed")
+    assert conn.rolled_back
+    assert pool.returned == [(conn, False)]
+
+
+def test_email_prefix_fallback_is_opt_in():
+    exact = UPSERT_EMBEDDINGS_SQL.format(email_prefix_match="")
+    assert "LIKE" not in exact
+    assert "LIKE" in UPSERT_EMBEDDINGS_SQL.format(email_prefix_match=EMAIL_PREFIX_MATCH_SQL)
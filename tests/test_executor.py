@@ -0,0 +1,52 @@
+import asyncio
+import os
+import sys
+import threading
+
+import pytest
+from fastapi import HTTPException
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import main
+from inference import BoundedExecutor, Saturated
+
+
+def test_submit_raises_saturated_once_workers_and_queue_are_full():
+    executor = BoundedExecutor(max_workers=1, max_queue=1, retry_after=7)
+    release = threading.Event()
+    try:
+        running = executor.submit(release.wait)
+        queued = executor.submit(release.wait)
+        with pytest.raises(Saturated) as raised:
+            executor.submit(release.wait)
+        assert raised.value.retry_after == 7
+        assert executor.stats() == {"workers": 1, "maxQueue": 1, "running": 1, "queued": 1}
+    finally:
+        release.set()
+    running.result(1)
+    queued.result(1)
+    # Slots are released as jobs finish
+    assert executor.submit(lambda: 42).result(1) == 42
+
+
+def test_run_blocking_maps_saturation_to_503_and_timeout_to_504(monkeypatch):
+    executor = BoundedExecutor(max_workers=1, max_queue=0, timeout=0.05, retry_after=3)
+    monkeypatch.setattr(main, "executor", executor)
+    release = threading.Event()
+
+    async def scenario():
+        with pytest.raises(HTTPException) as timed_out:
+            await main.run_blocking(release.wait)
+        # The timed-out job still holds the only slot until its thread finishes
+        with pytest.raises(HTTPException) as busy:
+            await main.run_blocking(lambda: None)
+        return timed_out.value, busy.value
+
+    try:
+        timed_out, busy = asyncio.run(scenario())
+    finally:
+        release.set()
+
+    assert timed_out.status_code == 504
+    assert busy.status_code == 503
+    assert busy.headers == {"Retry-After": "3"}
@@ -0,0 +1,79 @@
+import os
+import sys
+
+import numpy as np
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from face_gallery import GALLERY_DTYPES, CourseGalleryCache, GalleryMatcher, load_gallery, save_gallery
+
+
+def random_gallery(n, dim=64, seed=0):
+    rng = np.random.default_rng(seed)
+    return {f"student-{i}": rng.standard_normal(dim).astype(np.float32) for i in range(n)}
+
+
+@pytest.mark.parametrize("dtype", GALLERY_DTYPES)
+def test_save_load_round_trip(tmp_path, dtype):
+    faces = random_gallery(50)
+    path = str(tmp_path / "gallery.bin")
+    save_gallery(path, faces, model_name="buffalo_l", dtype=dtype)
+
+    matcher = load_gallery(path, expected_model="buffalo_l")
+
+    assert list(matcher.ids) == list(faces)
+    assert matcher.dtype == dtype
+    reference = GalleryMatcher.from_dict(faces)
+    tolerance = {"float32": 1e-6, "float16": 1e-3, "int8": 1e-2}[dtype]
+    np.testing.assert_allclose(matcher.dense(), reference.dense(), atol=tolerance)
+
+
+def test_load_rejects_other_model(tmp_path):
+    path = str(tmp_path / "gallery.bin")
+    save_gallery(path, random_gallery(3), model_name="buffalo_l")
+    with pytest.raises(ValueError):
+        load_gallery(path, expected_model="antelopev2")
+
+
+@pytest.mark.parametrize("dtype", GALLERY_DTYPES)
+def test_quantized_scores_stay_in_range_and_agree_on_top1(dtype):
+    reference = GalleryMatcher.from_dict(random_gallery(200, seed=1))
+    matcher = reference.quantized(dtype)
+    # Gallery rows themselves: the exact score is 1, rounding must not push it past
+    queries = reference.dense()
+
+    scores = matcher.scores(queries)
+
+    assert scores.max() <= 1.0 and scores.min() >= -1.0
+    assert (np.argmax(scores, axis=1) == np.arange(len(reference))).all()
+
+
+def test_best_matches_applies_threshold():
+    faces = random_gallery(5, seed=2)
+    matcher = GalleryMatcher.from_dict(faces)
+    queries = [np.stack([faces["student-3"]]), np.random.default_rng(9).standard_normal((1, 64))]
+
+    (hit, hit_sim), (miss, miss_sim) = matcher.best_matches(queries, 0.9)
+
+    assert hit == "student-3" and hit_sim > 0.99
+    assert miss is None
+
+
+def test_course_cache_refetches_enrollment_after_invalidate():
+    matcher = GalleryMatcher.from_dict(random_gallery(5, seed=3))
+    enrolled = {"course-1": ["student-1", "STUDENT-2"]}
+    fetches = []
+
+    def fetch(course_id):
+        fetches.append(course_id)
+        return enrolled[course_id]
+
+    cache = CourseGalleryCache(fetch, enrollment_ttl=3600)
+    assert sorted(cache.get("course-1", matcher).ids) == ["student-1", "student-2"]
+    assert cache.get("course-1", matcher) is cache.get("course-1", matcher)
+
+    enrolled["course-1"] = ["student-4"]
+    cache.invalidate()
+
+    assert list(cache.get("course-1", matcher).ids) == ["student-4"]
+    assert fetches == ["course-1", "course-1"]
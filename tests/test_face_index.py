@@ -0,0 +1,73 @@
+import os
+import sys
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from face_gallery import GalleryMatcher, load_gallery, save_gallery
+from face_index import build_gallery_index, load_index, save_index
+
+
+def clustered_gallery(n, dim=64, clusters=20, seed=0):
+    """Embeddings grouped around a few directions, like students photographed under similar conditions."""
+    rng = np.random.default_rng(seed)
+    centers = rng.standard_normal((clusters, dim))
+    rows = centers[rng.integers(0, clusters, n)] + 0.5 * rng.standard_normal((n, dim))
+    return {f"student-{i}": row.astype(np.float32) for i, row in enumerate(rows)}
+
+
+def noisy_queries(matcher, n, noise=0.05, seed=1):
+    rng = np.random.default_rng(seed)
+    rows = rng.choice(len(matcher), n, replace=False)
+    return matcher.dense()[rows] + noise * rng.standard_normal((n, matcher.dim)).astype(np.float32)
+
+
+def indexed_matcher(faces, nlist, nprobe):
+    ordered, index = build_gallery_index(faces, "ivf", nlist=nlist, nprobe=nprobe)
+    matcher = GalleryMatcher.from_dict(ordered)
+    matcher.index = index
+    return matcher
+
+
+def test_ivf_recall_against_exact_search():
+    faces = clustered_gallery(3000)
+    matcher = indexed_matcher(faces, nlist=32, nprobe=8)
+    exact = GalleryMatcher.from_dict(dict(zip(matcher.ids, matcher.dense())))
+    queries = noisy_queries(matcher, 300)
+
+    ivf_ids, ivf_sims = matcher.top_k(queries, k=5)
+    exact_ids, exact_sims = exact.top_k(queries, k=5)
+
+    recall_at_1 = np.mean(ivf_ids[:, 0] == exact_ids[:, 0])
+    assert recall_at_1 >= 0.95
+    # Whatever IVF returns is scored exactly, best first
+    found = ivf_ids[:, 0] == exact_ids[:, 0]
+    np.testing.assert_allclose(ivf_sims[found, 0], exact_sims[found, 0], rtol=1e-5)
+    assert (np.diff(ivf_sims, axis=1) <= 1e-6).all()
+
+
+def test_probing_every_list_is_exact():
+    faces = clustered_gallery(500, seed=2)
+    matcher = indexed_matcher(faces, nlist=10, nprobe=10)
+    exact = GalleryMatcher.from_dict(dict(zip(matcher.ids, matcher.dense())))
+    queries = noisy_queries(matcher, 50, seed=3)
+
+    assert (matcher.top_k(queries, k=3)[0] == exact.top_k(queries, k=3)[0]).all()
+
+
+def test_saved_index_only_loads_for_its_gallery(tmp_path):
+    faces = clustered_gallery(200, seed=4)
+    ordered, index = build_gallery_index(faces, "ivf", nlist=8, nprobe=2)
+    gallery_path, index_path = str(tmp_path / "gallery.bin"), str(tmp_path / "gallery.index.npz")
+    save_gallery(gallery_path, ordered)
+    save_index(index_path, index)
+
+    loaded = load_index(index_path, load_gallery(gallery_path))
+    assert loaded is not None and loaded.nlist == 8 and loaded.nprobe == 2
+
+    # Same students in another row order: the lists would point at the wrong rows
+    save_gallery(gallery_path, faces)
+    assert load_index(index_path, load_gallery(gallery_path)) is None
+
+    save_index(index_path, None)
+    assert not os.path.exists(index_path)
@@ -0,0 +1,70 @@
+import os
+import sys
+from contextlib import contextmanager
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import gallery_sync
+from gallery_sync import DatabaseGallery, decode_embedding
+
+
+def unit(seed, dim=8):
+    v = np.random.default_rng(seed).standard_normal(dim).astype(np.float32)
+    return v / np.linalg.norm(v)
+
+
+class FakeDatabase:
+    """Database stand-in: "Student" rows as {id: faceEmbedding bytes}."""
+
+    def __init__(self, rows, dsn="postgresql://fake"):
+        self.dsn = dsn
+        self.rows = rows
+
+    @contextmanager
+    def connection(self):
+        yield self if self.dsn else None
+
+    def listen_connection(self):
+        raise AssertionError("the listener must not connect")
+
+
+def fake_iter_face_embeddings(conn, student_ids=None):
+    for student_id, data in conn.rows.items():
+        if student_ids is None or student_id in student_ids:
+            yield student_id, data
+
+
+def test_decode_embedding_rejects_wrong_size_and_zero():
+    assert decode_embedding(unit(1).tobytes(), 8) is not None
+    assert decode_embedding(unit(1).tobytes(), 16) is None
+    assert decode_embedding(np.zeros(8, dtype=np.float32).tobytes(), 8) is None
+
+
+def test_reload_then_incremental_changes(monkeypatch):
+    monkeypatch.setattr(gallery_sync, "iter_face_embeddings", fake_iter_face_embeddings)
+    db = FakeDatabase({"Alice": unit(1).tobytes(), "bob": unit(2).tobytes(), "broken": b"xx"})
+    gallery = DatabaseGallery(db, dim=8)
+
+    matcher = gallery.reload()
+    assert sorted(matcher.ids) == ["alice", "bob"]
+
+    db.rows["bob"] = unit(3).tobytes()
+    del db.rows["Alice"]
+    db.rows["carol"] = unit(4).tobytes()
+    matcher = gallery.apply_changes(["Alice", "bob", "carol"])
+
+    assert sorted(matcher.ids) == ["bob", "carol"]
+    assert gallery.version == 2
+    best_match, best_sim = matcher.best_matches([unit(3)[None]], 0.5)[0]
+    assert best_match == "bob" and best_sim > 0.99
+
+
+def test_start_without_database_url_skips_listener(monkeypatch):
+    monkeypatch.setattr(gallery_sync, "iter_face_embeddings", fake_iter_face_embeddings)
+    gallery = DatabaseGallery(FakeDatabase({}, dsn=None), dim=8)
+
+    gallery.start()
+
+    assert gallery._thread is None
+    assert gallery.get() is None
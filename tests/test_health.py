@@ -0,0 +1,17 @@
+import os
+import sys
+
+from fastapi.testclient import TestClient
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import main
+
+
+def test_health_reports_inference_stats():
+    # No startup events (model warm-up, gallery load) without entering the client
+    response = TestClient(main.app).get("/health")
+
+    assert response.status_code == 200
+    body = response.json()
+    assert body["status"] == "healthy"
+    assert set(body["inference"]) == {"workers", "maxQueue", "running", "queued"}
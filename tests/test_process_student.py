@@ -0,0 +1,52 @@
+import json
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from types import SimpleNamespace
+
+import cv2
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import main
+
+
+class RecordingFaceMesh:
+    """FaceMesh stand-in that records how many calls overlap."""
+
+    def __init__(self):
+        self.active = 0
+        self.max_active = 0
+        self.calls = 0
+        self._lock = threading.Lock()
+
+    def process(self, rgb):
+        with self._lock:
+            self.active += 1
+            self.calls += 1
+            self.max_active = max(self.max_active, self.active)
+        time.sleep(0.005)
+        with self._lock:
+            self.active -= 1
+        return SimpleNamespace(multi_face_landmarks=[object()])
+
+
+def test_concurrent_validation_serializes_face_mesh(tmp_path, monkeypatch):
+    mesh = RecordingFaceMesh()
+    monkeypatch.setattr(main, "face_mesh", mesh)
+    monkeypatch.setattr(main, "DATASET_PATH", str(tmp_path))
+    photo = cv2.imencode(".jpg", np.full((64, 64, 3), 128, dtype=np.uint8))[1].tobytes()
+    uploads = [(pose, photo) for pose in ("front", "left", "right")]
+
+    with ThreadPoolExecutor(max_workers=6) as pool:
+        responses = list(pool.map(lambda i: main.validate_student_photos(f"student-{i}", uploads), range(12)))
+
+    assert mesh.calls == 36
+    assert mesh.max_active == 1
+    for i, response in enumerate(responses):
+        body = json.loads(response.body)
+        assert body["studentId"] == f"student-{i}"
+        assert all(result["success"] for result in body["results"].values())
+        assert (tmp_path / f"student-{i}" / "front.jpg").exists()
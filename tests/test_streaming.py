@@ -0,0 +1,74 @@
+import asyncio
+import json
+import os
+import sys
+import threading
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import main
+from face_gallery import GalleryMatcher
+from inference import BoundedExecutor
+
+
+class SlowAnalyzer:
+    """Analyzer stand-in whose frames take longer than the executor timeout."""
+
+    parallelism = 1
+
+    def __init__(self, delay):
+        self.delay = delay
+        self.running = False
+        self.finished = threading.Event()
+        self.closed_while_running = None
+
+    def analyze(self, positions=None):
+        self.running = True
+        time.sleep(self.delay)
+        self.running = False
+        self.finished.set()
+        return [[] for _ in positions]
+
+    def __exit__(self, *exc):
+        self.closed_while_running = self.running
+        return False
+
+
+async def collect(stream):
+    return [json.loads(line) async for line in stream]
+
+
+def test_timed_out_step_closes_analyzer_only_after_it_finishes(monkeypatch):
+    analyzer = SlowAnalyzer(delay=0.3)
+    monkeypatch.setattr(main, "executor", BoundedExecutor(max_workers=1, max_queue=1, timeout=0.05))
+    monkeypatch.setattr(main, "open_analyzer", lambda frames: analyzer)
+    monkeypatch.setattr(main, "EARLY_EXIT", False)
+    matcher = GalleryMatcher(["alice"], np.eye(1, 512, dtype=np.float32))
+    images = [(0, np.zeros((8, 8, 3), dtype=np.uint8))]
+
+    messages = asyncio.run(collect(main.stream_recognition(matcher, images)))
+
+    assert messages == [{"type": "error", "status": 504, "detail": "Processing timed out"}]
+    assert analyzer.closed_while_running is None
+    assert analyzer.finished.wait(2)
+    deadline = time.monotonic() + 2
+    while analyzer.closed_while_running is None and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert analyzer.closed_while_running is False
+
+
+def test_completed_stream_closes_analyzer(monkeypatch):
+    analyzer = SlowAnalyzer(delay=0)
+    monkeypatch.setattr(main, "executor", BoundedExecutor(max_workers=1, max_queue=1, timeout=5))
+    monkeypatch.setattr(main, "open_analyzer", lambda frames: analyzer)
+    monkeypatch.setattr(main, "EARLY_EXIT", False)
+    matcher = GalleryMatcher(["alice"], np.eye(1, 512, dtype=np.float32))
+    images = [(0, np.zeros((8, 8, 3), dtype=np.uint8)), (1, np.zeros((8, 8, 3), dtype=np.uint8))]
+
+    messages = asyncio.run(collect(main.stream_recognition(matcher, images)))
+
+    assert [m["type"] for m in messages] == ["frame", "frame", "summary"]
+    assert messages[-1]["framesProcessed"] == 2
+    assert analyzer.closed_while_running is False
@@ -0,0 +1,83 @@
+import os
+import sys
+from types import SimpleNamespace
+
+import cv2
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from tiling import detect_tiled, nms, tile_windows
+
+
+class BrightSquareDetector:
+    """SCRFD stand-in: every bright blob of the image is a face, its corners the keypoints."""
+
+    def __init__(self):
+        self.calls = []
+
+    def detect(self, img, max_num=0, metric="default"):
+        self.calls.append(img.shape[:2])
+        mask = (img[:, :, 0] > 128).astype(np.uint8)
+        count, _, stats, _ = cv2.connectedComponentsWithStats(mask)
+        boxes = [
+            [x, y, x + w, y + h, 0.9]
+            for x, y, w, h, _ in stats[1:count]
+        ]
+        bboxes = np.asarray(boxes, dtype=np.float32).reshape(-1, 5)
+        kpss = np.repeat(bboxes[:, None, :2], 5, axis=1)
+        return bboxes, kpss
+
+
+def frame_with_squares(height, width, squares):
+    img = np.zeros((height, width, 3), dtype=np.uint8)
+    for x, y, size in squares:
+        img[y:y + size, x:x + size] = 255
+    return img
+
+
+def test_tile_windows_cover_the_image_with_overlap():
+    windows = tile_windows(1080, 1920, tile=640, overlap=0.2)
+
+    covered = np.zeros((1080, 1920), dtype=bool)
+    for x1, y1, x2, y2 in windows:
+        assert x2 - x1 <= 640 and y2 - y1 <= 640
+        covered[y1:y2, x1:x2] = True
+    assert covered.all()
+    assert tile_windows(480, 640) == [(0, 0, 640, 480)]
+
+
+def test_nms_keeps_best_of_overlapping_boxes():
+    boxes = np.array([[0, 0, 10, 10], [1, 1, 11, 11], [50, 50, 60, 60]], dtype=np.float32)
+    scores = np.array([0.8, 0.9, 0.7], dtype=np.float32)
+
+    assert nms(boxes, scores, 0.4) == [1, 2]
+    assert nms(np.zeros((0, 4)), np.zeros(0)) == []
+
+
+def test_detect_tiled_maps_boxes_back_to_frame_coordinates():
+    # One face inside a single tile, one in the overlap of two (cut off by the second tile's edge)
+    squares = [(100, 120, 30), (500, 300, 40)]
+    img = frame_with_squares(720, 1280, squares)
+    detector = BrightSquareDetector()
+    app = SimpleNamespace(det_size=(640, 640), det_model=detector)
+
+    bboxes, kpss = detect_tiled(app, img, scales=(1.0,), overlap=0.2)
+
+    found = sorted(tuple(int(round(v)) for v in box[:4]) for box in bboxes)
+    assert found == [(100, 120, 130, 150), (500, 300, 540, 340)]
+    assert kpss.shape == (2, 5, 2)
+    np.testing.assert_allclose(sorted(kpss[:, 0].tolist()), [[100, 120], [500, 300]])
+
+
+def test_detect_tiled_skips_scales_after_seeing_the_whole_frame():
+    img = frame_with_squares(720, 1280, [(200, 200, 60)])
+    detector = BrightSquareDetector()
+    app = SimpleNamespace(det_size=(640, 640), det_model=detector)
+
+    bboxes, _ = detect_tiled(app, img, scales=(1.0, 0.5, 0.25), overlap=0.2)
+
+    full_tiles = len(tile_windows(720, 1280))
+    # 0.25 would shrink the frame below the detector input: the 0.5 pass already fits it
+    assert len(detector.calls) == full_tiles + 1
+    assert len(bboxes) == 1
+    np.testing.assert_allclose(bboxes[0, :4], [200, 200, 260, 260], atol=2)
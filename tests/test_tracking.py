@@ -0,0 +1,118 @@
+import os
+import sys
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import main
+from recognition import ConfirmedStudents
+from face_gallery import GalleryMatcher
+from tracking import box_iou, link_tracks
+
+
+def unit(seed):
+    v = np.random.default_rng(seed).standard_normal(512).astype(np.float32)
+    return v / np.linalg.norm(v)
+
+
+def face(x, y, size=100, score=0.9, embedding=None):
+    return {
+        "faceIndex": 0,
+        "bbox": [x, y, x + size, y + size],
+        "kps": None,
+        "detScore": score,
+        "area": size * size,
+        "small": False,
+        "embedding": embedding,
+    }
+
+
+def test_box_iou():
+    assert box_iou([0, 0, 10, 10], [0, 0, 10, 10]) == 1.0
+    assert box_iou([0, 0, 10, 10], [20, 20, 30, 30]) == 0.0
+    assert abs(box_iou([0, 0, 10, 10], [5, 0, 15, 10]) - 50 / 150) < 1e-9
+
+
+def test_link_tracks_follows_overlapping_boxes():
+    frames = [
+        (0, [face(0, 0), face(500, 0)]),
+        (1, [face(505, 2), face(4, 3)]),
+        (2, [face(8, 5), face(900, 0)]),
+    ]
+    tracks = link_tracks(frames)
+
+    assert [t.frames for t in tracks] == [[0, 1, 2], [0, 1], [2]]
+    assert tracks[0].observations[1][1]["bbox"][0] == 4
+
+
+def test_link_tracks_splits_on_disagreeing_embeddings():
+    frames = [(0, [face(0, 0, embedding=unit(1))]), (1, [face(2, 2, embedding=unit(2))])]
+    assert len(link_tracks(frames)) == 2
+    # Without embeddings the boxes alone decide
+    frames = [(0, [face(0, 0)]), (1, [face(2, 2)])]
+    assert len(link_tracks(frames)) == 1
+
+
+def test_link_tracks_continues_earlier_tracks():
+    tracks = link_tracks([(0, [face(0, 0)])])
+    tracks = link_tracks([(1, [face(3, 3)])], tracks=tracks)
+    assert len(tracks) == 1 and tracks[0].frames == [0, 1]
+
+
+def test_best_ranks_by_score_and_size():
+    tracks = link_tracks([(0, [face(0, 0, size=100)]), (1, [face(0, 0, size=110)]), (2, [face(0, 0, size=105)])])
+    assert [frame for frame, _ in tracks[0].best(2)] == [1, 2]
+
+
+class DetectOnlyAnalyzer:
+    """Analyzer stand-in: one student at a fixed place in every frame, embedded only on request."""
+
+    parallelism = 2
+
+    def __init__(self, n_frames, embedding):
+        self.n_frames = n_frames
+        self.embedding = embedding
+        self.embedded = 0
+
+    def detect(self, positions=None, embed=True):
+        assert not embed
+        positions = range(self.n_frames) if positions is None else positions
+        return [[face(10 + pos, 10, size=100 + pos)] for pos in positions]
+
+    def embed(self, faces_per_frame, positions=None):
+        self.embedded += sum(len(faces) for faces in faces_per_frame)
+        return [[self.embedding for _ in faces] for faces in faces_per_frame]
+
+    def expand(self, faces_per_frame, positions=None):
+        return [[[] for _ in faces] for faces in faces_per_frame]
+
+
+def test_match_tracks_embeds_only_the_best_observations(monkeypatch):
+    monkeypatch.setattr(main, "TRACK_BEST_OBSERVATIONS", 2)
+    student = unit(7)
+    matcher = GalleryMatcher(["alice", "bob"], np.stack([student, unit(8)]))
+    analyzer = DetectOnlyAnalyzer(5, student)
+
+    detections, processed, tracks = main.match_tracks(analyzer, [10, 11, 12, 13, 14], matcher, 0.45)
+
+    assert processed == 5
+    assert analyzer.embedded == 2
+    assert len(tracks) == 1
+    assert tracks[0]["studentId"] == "alice"
+    assert tracks[0]["imageIndices"] == [10, 11, 12, 13, 14]
+    assert tracks[0]["embeddedObservations"] == 2
+    assert [d["imageIndex"] for d in detections] == [10, 11, 12, 13, 14]
+    assert {d["trackId"] for d in detections} == {0}
+
+
+def test_match_tracks_stops_once_every_student_is_confirmed():
+    student = unit(7)
+    matcher = GalleryMatcher(["alice"], student[None])
+    analyzer = DetectOnlyAnalyzer(6, student)
+    confirmed = ConfirmedStudents(["alice"], 0.9)
+
+    _, processed, tracks = main.match_tracks(analyzer, list(range(6)), matcher, 0.45, confirmed)
+
+    assert processed == 2
+    assert tracks[0]["imageIndices"] == [0, 1]
+    assert analyzer.embedded <= main.TRACK_BEST_OBSERVATIONS
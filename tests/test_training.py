@@ -0,0 +1,59 @@
+import os
+import random
+import sys
+from types import SimpleNamespace
+
+import cv2
+import numpy as np
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from training import build_augmenter, embed_student
+
+
+class PixelEmbeddingApp:
+    """Face model stand-in: one whole-image face whose embedding depends on the pixels."""
+
+    def get(self, img):
+        h, w = img.shape[:2]
+        emb = cv2.resize(img, (8, 8)).astype(np.float32).ravel()
+        return [SimpleNamespace(bbox=np.array([0, 0, w, h]), normed_embedding=emb / np.linalg.norm(emb))]
+
+
+@pytest.fixture
+def student_folder(tmp_path):
+    rng = np.random.default_rng(0)
+    for i in range(2):
+        cv2.imwrite(str(tmp_path / f"photo_{i}.jpg"), rng.integers(0, 256, (64, 64, 3), dtype=np.uint8))
+    return str(tmp_path), sorted(os.listdir(tmp_path))
+
+
+def test_augmentation_is_reproducible_without_touching_global_rng(student_folder):
+    augmenter = build_augmenter("light")
+    if augmenter is None or not hasattr(augmenter, "set_random_seed"):
+        pytest.skip("needs albumentations 2.x")
+    path, images = student_folder
+    random.seed(123)
+    np.random.seed(123)
+    py_state, np_state = random.getstate(), np.random.get_state()
+
+    first = embed_student(PixelEmbeddingApp(), "alice", path, images, augmenter, "light")
+    # Another student in between must not change alice's samples
+    embed_student(PixelEmbeddingApp(), "bob", path, images, augmenter, "light")
+    second = embed_student(PixelEmbeddingApp(), "alice", path, images, build_augmenter("light"), "light")
+
+    assert first["embeddings"].shape == (6, 192)
+    np.testing.assert_array_equal(first["embeddings"], second["embeddings"])
+    assert random.getstate() == py_state
+    assert np.array_equal(np.random.get_state()[1], np_state[1])
+
+
+def test_folder_without_faces_returns_empty_matrix(student_folder):
+    path, images = student_folder
+    app = SimpleNamespace(get=lambda img: [])
+
+    result = embed_student(app, "alice", path, images)
+
+    assert result["embeddings"].shape[0] == 0
+    assert result["images"] == 2
+    assert result["errors"] == ["alice: no face found in any photo"]
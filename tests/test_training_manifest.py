@@ -0,0 +1,64 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from training import training_settings
+from training_manifest import TrainingManifest, scan_dataset
+
+
+def make_dataset(root, students):
+    for folder, photos in students.items():
+        (root / folder).mkdir(parents=True, exist_ok=True)
+        for name, content in photos.items():
+            (root / folder / name).write_bytes(content)
+    return scan_dataset(str(root))
+
+
+def trained_manifest(path, settings, scan):
+    manifest = TrainingManifest.load(path, settings)
+    for folder in scan:
+        manifest.record(folder, scan[folder], embedded=True)
+    manifest.save()
+    return manifest
+
+
+def test_plan_only_retrains_changed_folders(tmp_path):
+    scan = make_dataset(tmp_path / "dataset", {"alice": {"a.jpg": b"1"}, "bob": {"b.jpg": b"2"}})
+    path = str(tmp_path / "manifest.json")
+    settings = training_settings("buffalo_l", "enroll", "light")
+    trained_manifest(path, settings, scan)
+
+    make_dataset(tmp_path / "dataset", {"bob": {"b.jpg": b"changed"}, "carol": {"c.jpg": b"3"}})
+    (tmp_path / "dataset" / "alice" / "a.jpg").unlink()
+    (tmp_path / "dataset" / "alice").rmdir()
+    scan = scan_dataset(str(tmp_path / "dataset"))
+
+    to_train, unchanged, removed = TrainingManifest.load(path, settings).plan(scan, ["alice", "bob"])
+
+    assert sorted(to_train) == ["bob", "carol"]
+    assert unchanged == []
+    assert removed == ["alice"]
+
+
+def test_switching_augmentation_preset_keeps_unchanged_students(tmp_path):
+    scan = make_dataset(tmp_path / "dataset", {"alice": {"a.jpg": b"1"}, "bob": {"b.jpg": b"2"}})
+    path = str(tmp_path / "manifest.json")
+    trained_manifest(path, training_settings("buffalo_l", "enroll", "light"), scan)
+
+    strong = TrainingManifest.load(path, training_settings("buffalo_l", "enroll", "strong"))
+    to_train, unchanged, _ = strong.plan(scan, ["alice", "bob"])
+    strong.record("alice", scan["alice"], embedded=True)
+
+    assert to_train == [] and sorted(unchanged) == ["alice", "bob"]
+    assert strong.students["alice"]["augmentation"] == "strong"
+    assert strong.students["bob"]["augmentation"] == "light"
+
+
+def test_other_model_pack_retrains_everyone(tmp_path):
+    scan = make_dataset(tmp_path / "dataset", {"alice": {"a.jpg": b"1"}})
+    path = str(tmp_path / "manifest.json")
+    trained_manifest(path, training_settings("buffalo_l", "enroll", "light"), scan)
+
+    to_train, _, _ = TrainingManifest.load(path, training_settings("antelopev2", "enroll", "light")).plan(scan, ["alice"])
+
+    assert to_train == ["alice"]
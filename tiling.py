@@ -0,0 +1,123 @@
+# tiling.py
+"""
+Tiled multi-scale face detection for high-resolution classroom frames.
+
+Running SCRFD on the whole frame letterboxes it down to the detector input
+(640x640), so faces in the back rows shrink to a few pixels. Instead the frame
+is cut into overlapping detector-sized windows at one or two scales, the
+windows go through the detector (as one batch if it was exported with a
+dynamic batch dimension, else one call each; buffalo_l's det_10g is the
+latter), and the boxes are mapped back to frame coordinates and merged with
+NMS. Cost grows with image area rather than with the number of small faces.
+"""
+import cv2
+import numpy as np
+
+from batching import detect_batch
+
+
+def tile_windows(height, width, tile=640, overlap=0.2):
+    """(x1, y1, x2, y2) windows of at most tile x tile covering the image, overlapping by `overlap`."""
+    stride = max(1, int(tile * (1.0 - overlap)))
+
+    def starts(length):
+        if length <= tile:
+            return [0]
+        positions = list(range(0, length - tile, stride))
+        positions.append(length - tile)
+        return positions
+
+    return [
+        (x, y, min(x + tile, width), min(y + tile, height))
+        for y in starts(height)
+        for x in starts(width)
+    ]
+
+
+def nms(boxes, scores, iou_threshold=0.4):
+    """Indices of the boxes kept by greedy non-maximum suppression, best score first."""
+    if len(boxes) == 0:
+        return []
+    x1, y1, x2, y2 = boxes[:, 0], boxes[:, 1], boxes[:, 2], boxes[:, 3]
+    areas = np.maximum(0, x2 - x1) * np.maximum(0, y2 - y1)
+    order = np.argsort(scores)[::-1]
+    keep = []
+    while order.size > 0:
+        i = order[0]
+        keep.append(int(i))
+        xx1 = np.maximum(x1[i], x1[order[1:]])
+        yy1 = np.maximum(y1[i], y1[order[1:]])
+        xx2 = np.minimum(x2[i], x2[order[1:]])
+        yy2 = np.minimum(y2[i], y2[order[1:]])
+        inter = np.maximum(0, xx2 - xx1) * np.maximum(0, yy2 - yy1)
+        iou = inter / np.maximum(areas[i] + areas[order[1:]] - inter, 1e-6)
+        order = order[1:][iou <= iou_threshold]
+    return keep
+
+
+def _cut_by_tile_edge(box, window, width, height, margin=2):
+    """True if a (window-relative) box touches an inner edge of its window, i.e. the face is probably cut off."""
+    x1, y1, x2, y2 = window
+    return (
+        (x1 > 0 and box[0] <= margin)
+        or (y1 > 0 and box[1] <= margin)
+        or (x2 < width and box[2] >= x2 - x1 - margin)
+        or (y2 < height and box[3] >= y2 - y1 - margin)
+    )
+
+
+def run_detector(app_model, imgs):
+    """Detect on several images, through the BatchScheduler when there is one (batched if the detector allows)."""
+    if hasattr(app_model, "detect_many"):
+        return app_model.detect_many(imgs)
+    return detect_batch(app_model.det_model, imgs, tuple(app_model.det_size))
+
+
+def detect_tiled(app_model, img, scales=(1.0, 0.5), overlap=0.2, nms_threshold=0.4):
+    """
+    Detect faces in overlapping detector-sized windows of img, resized by each
+    of `scales`. Returns (bboxes (n, 5), kpss (n, 5, 2) or None) in img
+    coordinates, like SCRFD.detect.
+
+    Once a pass has seen the whole frame in one window, smaller scales are
+    skipped. A smaller scale that would shrink the frame below det_size
+    (which SCRFD's letterbox then scales back up) runs once at the scale that
+    fits det_size instead.
+    """
+    tile_w, tile_h = tuple(app_model.det_size)
+    height, width = img.shape[:2]
+    fit_scale = min(tile_w / width, tile_h / height)
+
+    tiles, placements = [], []  # placements: (window in scaled image, scale, scaled size)
+    whole_frame_seen = False
+    for scale in sorted(scales, reverse=True):
+        if whole_frame_seen:
+            break
+        if scale < 1.0 and scale < fit_scale:
+            scale = min(fit_scale, 1.0)
+        whole_frame_seen = width * scale <= tile_w and height * scale <= tile_h
+        scaled = img if scale == 1.0 else cv2.resize(img, (max(1, int(width * scale)), max(1, int(height * scale))))
+        sh, sw = scaled.shape[:2]
+        for window in tile_windows(sh, sw, tile=max(tile_w, tile_h), overlap=overlap):
+            x1, y1, x2, y2 = window
+            tiles.append(scaled[y1:y2, x1:x2])
+            placements.append((window, scale, (sw, sh)))
+
+    boxes, kps_list = [], []
+    for (bboxes, kpss), (window, scale, (sw, sh)) in zip(run_detector(app_model, tiles), placements):
+        for i in range(bboxes.shape[0]):
+            if _cut_by_tile_edge(bboxes[i], window, sw, sh):
+                continue
+            box = bboxes[i].copy()
+            box[[0, 2]] = (box[[0, 2]] + window[0]) / scale
+            box[[1, 3]] = (box[[1, 3]] + window[1]) / scale
+            boxes.append(box)
+            if kpss is not None:
+                kps_list.append((kpss[i] + np.array(window[:2], dtype=np.float32)) / scale)
+
+    if not boxes:
+        return np.zeros((0, 5), dtype=np.float32), None
+    boxes = np.asarray(boxes, dtype=np.float32)
+    keep = nms(boxes[:, :4], boxes[:, 4], nms_threshold)
+    kpss = np.asarray(kps_list, dtype=np.float32)[keep] if len(kps_list) == len(boxes) else None
+    return boxes[keep], kpss
@@ -0,0 +1,89 @@
+# tracking.py
+"""
+Links face detections across the burst frames of one submission.
+
+A teacher sends several frames of the same classroom, so most students appear
+in every frame at nearly the same place. Detector boxes are chained into
+tracks by overlap (IoU), plus agreement of their direct embeddings when both
+have one; the API links before embedding anything, so ArcFace (and the
+small-face candidate embeddings) then only runs on each track's best-quality
+observations instead of on every face of every frame.
+"""
+import numpy as np
+
+
+def box_iou(a, b):
+    """Intersection over union of two (x1, y1, x2, y2) boxes."""
+    ix = max(0, min(a[2], b[2]) - max(a[0], b[0]))
+    iy = max(0, min(a[3], b[3]) - max(a[1], b[1]))
+    inter = ix * iy
+    if inter == 0:
+        return 0.0
+    area_a = max(0, a[2] - a[0]) * max(0, a[3] - a[1])
+    area_b = max(0, b[2] - b[0]) * max(0, b[3] - b[1])
+    return inter / float(area_a + area_b - inter)
+
+
+def observation_quality(face):
+    """Detector confidence weighted by face size; larger, sharper detections embed better."""
+    return face["detScore"] * face["area"]
+
+
+class Track:
+    """One person across frames: a list of (frame index, face dict) observations."""
+
+    def __init__(self, track_id):
+        self.track_id = track_id
+        self.observations = []
+
+    @property
+    def last(self):
+        return self.observations[-1][1]
+
+    @property
+    def frames(self):
+        return [frame_idx for frame_idx, _ in self.observations]
+
+    def best(self, n=1):
+        """The n highest-quality observations."""
+        return sorted(self.observations, key=lambda obs: observation_quality(obs[1]), reverse=True)[:n]
+
+
+def link_tracks(frames, iou_threshold=0.3, similarity_threshold=0.3, tracks=None):
+    """
+    Greedily link detections frame by frame. frames is a list of
+    (frame index, list of detect_faces dicts). A detection joins the track
+    whose last observation overlaps it most (IoU >= iou_threshold) unless both
+    have embeddings that disagree (cosine < similarity_threshold); each track
+    takes at most one detection per frame. Pass the tracks of earlier frames
+    to continue them. Returns the list of Tracks.
+    """
+    tracks = [] if tracks is None else tracks
+    for frame_idx, faces in frames:
+        pairs = []
+        for face_i, face in enumerate(faces):
+            for track_i, track in enumerate(tracks):
+                if track.observations[-1][0] == frame_idx:
+                    continue
+                iou = box_iou(face["bbox"], track.last["bbox"])
+                if iou < iou_threshold:
+                    continue
+                emb_a, emb_b = face["embedding"], track.last["embedding"]
+                if emb_a is not None and emb_b is not None and float(np.dot(emb_a, emb_b)) < similarity_threshold:
+                    continue
+                pairs.append((iou, face_i, track_i))
+
+        taken_faces, taken_tracks = set(), set()
+        for _, face_i, track_i in sorted(pairs, reverse=True):
+            if face_i in taken_faces or track_i in taken_tracks:
+                continue
+            tracks[track_i].observations.append((frame_idx, faces[face_i]))
+            taken_faces.add(face_i)
+            taken_tracks.add(track_i)
+
+        for face_i, face in enumerate(faces):
+            if face_i not in taken_faces:
+                track = Track(len(tracks))
+                track.observations.append((frame_idx, face))
+                tracks.append(track)
+    return tracks
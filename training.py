@@ -0,0 +1,192 @@
+# training.py
+"""
+Per-student embedding for training, serial or across a process pool.
+
+Each student folder is embedded independently: every photo plus a few
+albumentations variants goes through the model and the largest face's
+embedding is kept. The augmenter's own generator is seeded from the folder
+name (the global random / np.random state is left alone), so a student gets
+the same samples whichever worker (or the serial loop) embeds it, and
+the median per student is taken by the caller in sorted folder order. The
+API and scripts/train_faces.py share this code through their augmentation
+presets.
+"""
+import multiprocessing
+import os
+import zlib
+
+import cv2
+import numpy as np
+
+
+def _light_transforms(A):
+    return [
+        A.HorizontalFlip(p=0.5),
+        A.Rotate(limit=15, p=0.8),
+        A.RandomBrightnessContrast(brightness_limit=0.2, contrast_limit=0.2, p=0.8),
+        A.HueSaturationValue(hue_shift_limit=10, sat_shift_limit=20, val_shift_limit=20, p=0.5),
+    ]
+
+
+def _strong_transforms(A):
+    return _light_transforms(A) + [
+        A.GaussianBlur(blur_limit=(3, 5), p=0.3),
+        A.MultiplicativeNoise(multiplier=(0.9, 1.1), p=0.3),
+    ]
+
+
+# name -> (transforms factory, augmented copies per photo). Copies are
+# (least, most, photos): enough to bring a folder up to `photos` samples,
+# clamped to [least, most]; plain data so training settings can record them.
+AUGMENTATION_PRESETS = {
+    # /api/train
+    "light": (_light_transforms, (2, 2, 0)),
+    # scripts/train_faces.py: more variants when a student has few photos
+    "strong": (_strong_transforms, (1, 3, 5)),
+}
+
+
+def augmented_copies(preset, n_images):
+    """Augmented copies made of each photo of a folder with n_images photos."""
+    least, most, photos = AUGMENTATION_PRESETS[preset][1]
+    return min(most, max(least, photos - n_images))
+
+
+def training_settings(model_pack, profile, preset):
+    """Everything stored embeddings depend on, for the training manifest (which decides what a change retrains)."""
+    return {
+        "modelPack": model_pack,
+        "profile": profile,
+        "augmentation": preset,
+        "augmentedCopies": list(AUGMENTATION_PRESETS[preset][1]) if preset else None,
+    }
+
+
+def build_augmenter(preset):
+    """albumentations pipeline for a preset, or None when albumentations isn't installed."""
+    if preset is None:
+        return None
+    try:
+        # Imported here: it takes about a second and is only needed while training
+        import albumentations as A
+    except ImportError:
+        return None
+    transforms, _ = AUGMENTATION_PRESETS[preset]
+    return A.Compose(transforms(A))
+
+
+def student_seed(folder):
+    """Stable per-student seed, independent of process and hash randomization."""
+    return zlib.crc32(folder.encode("utf-8"))
+
+
+def largest_face_embedding(app_model, img_rgb):
+    faces = app_model.get(img_rgb)
+    if not faces:
+        return None
+    face = max(faces, key=lambda f: (f.bbox[2] - f.bbox[0]) * (f.bbox[3] - f.bbox[1]))
+    return getattr(face, "normed_embedding", None)
+
+
+def embed_student(app_model, folder, person_path, image_files, augmenter=None, preset=None):
+    """
+    Embed one student's photos (plus augmented variants). Returns a dict with
+    embeddings ((k, d) float32), images (photos read) and errors.
+    """
+    per_image = augmented_copies(preset, len(image_files)) if augmenter is not None else 0
+    if hasattr(augmenter, "set_random_seed"):
+        # albumentations 2.x draws from the pipeline's own generators; 1.x has
+        # no such hook and its samples are not reproducible
+        augmenter.set_random_seed(student_seed(folder))
+
+    embeddings, errors, images = [], [], 0
+    for image_name in sorted(image_files):
+        img = cv2.imread(os.path.join(person_path, image_name))
+        if img is None:
+            errors.append(f"{folder}/{image_name}: unreadable image")
+            continue
+        images += 1
+        img_rgb = cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
+
+        emb = largest_face_embedding(app_model, img_rgb)
+        if emb is not None:
+            embeddings.append(emb)
+
+        for _ in range(per_image):
+            try:
+                # albumentations expects numpy array in RGB format
+                aug_img = augmenter(image=img_rgb)["image"]
+            except Exception:
+                aug_img = img_rgb
+            emb_aug = largest_face_embedding(app_model, aug_img)
+            if emb_aug is not None:
+                embeddings.append(emb_aug)
+
+    if not embeddings:
+        errors.append(f"{folder}: no face found in any photo")
+    matrix = np.asarray(embeddings, dtype=np.float32).reshape(len(embeddings), -1) if embeddings else np.empty((0, 0), np.float32)
+    return {"embeddings": matrix, "images": images, "errors": errors}
+
+
+def embed_students_serial(app_model, tasks, preset="light"):
+    """Same as TrainingPool.embed_students, one student after another in this process."""
+    augmenter = build_augmenter(preset)
+    for folder, person_path, image_files in tasks:
+        yield folder, embed_student(app_model, folder, person_path, image_files, augmenter, preset)
+
+
+def median_embedding(embeddings):
+    """Element-wise median of a student's samples, re-normalized."""
+    median = np.median(embeddings, axis=0)
+    norm = np.linalg.norm(median)
+    return median / norm if norm > 0 else median
+
+
+# --------------------
+# Training worker processes
+# --------------------
+_worker = {}
+
+def _init_training_worker(profile, preset, threads):
+    """Load the model once per worker, limited to `threads` ONNX/OpenCV threads."""
+    from face_models import load_face_app
+
+    cv2.setNumThreads(threads)
+    _worker["app"] = load_face_app(profile, intra_op_threads=threads)
+    _worker["preset"] = preset
+    _worker["augmenter"] = build_augmenter(preset)
+
+def _embed_student_task(task):
+    folder, person_path, image_files = task
+    result = embed_student(_worker["app"], folder, person_path, image_files, _worker["augmenter"], _worker["preset"])
+    return folder, result
+
+
+class TrainingPool:
+    """
+    Spawned worker processes, each with its own model session and an equal
+    share of the ONNX thread budget, embedding whole students in parallel. Use as a context manager;
+    leaving it terminates the workers.
+    """
+
+    def __init__(self, processes, profile="enroll", preset="light", threads_per_worker=None):
+        self.processes = processes
+        from face_models import threads_per_worker as budget_share
+
+        threads = threads_per_worker or budget_share(processes)
+        ctx = multiprocessing.get_context("spawn")
+        self._pool = ctx.Pool(processes, initializer=_init_training_worker, initargs=(profile, preset, threads))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+        return False
+
+    def close(self):
+        self._pool.terminate()
+
+    def embed_students(self, tasks):
+        """Yield (folder, result) for (folder, person_path, image_files) tasks as workers finish them."""
+        return self._pool.imap_unordered(_embed_student_task, tasks)
@@ -0,0 +1,99 @@
+# training_manifest.py
+"""
+Content-hash manifest for incremental training.
+
+Records the SHA-256 of every photo each student folder had when it was last
+embedded, plus the settings the embeddings depend on (see
+training.training_settings). Training then only re-embeds folders that are new
+or whose photos changed, drops folders that were deleted, and merges the result
+into the existing gallery. A different model pack or profile invalidates the
+whole manifest, since embeddings from another model can't be compared. The
+augmentation preset is recorded per student instead: the API (light) and
+scripts/train_faces.py (strong) share the manifest, and an embedding made with
+either preset stays valid, so alternating between them doesn't retrain
+everyone.
+"""
+import hashlib
+import json
+import os
+
+MANIFEST_VERSION = 2
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png")
+# Settings stored with each student rather than compared for the whole manifest
+ENTRY_SETTINGS = ("augmentation", "augmentedCopies")
+
+
+def hash_file(path, chunk_size=1 << 20):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def scan_dataset(dataset_path):
+    """{student folder: {image name: sha256}} for every student folder under dataset_path."""
+    scan = {}
+    for folder in sorted(os.listdir(dataset_path)):
+        person_path = os.path.join(dataset_path, folder)
+        if not os.path.isdir(person_path):
+            continue
+        scan[folder] = {
+            name: hash_file(os.path.join(person_path, name))
+            for name in sorted(os.listdir(person_path))
+            if name.lower().endswith(IMAGE_EXTENSIONS)
+        }
+    return scan
+
+
+class TrainingManifest:
+    """Per-student photo hashes from the last training run, stored as JSON next to the gallery."""
+
+    def __init__(self, path, settings):
+        self.path = path
+        self.settings = {key: value for key, value in settings.items() if key not in ENTRY_SETTINGS}
+        self.entry_settings = {key: settings[key] for key in ENTRY_SETTINGS if key in settings}
+        # folder -> {"images": {name: sha256}, "embedded": bool, plus ENTRY_SETTINGS}
+        self.students = {}
+
+    @classmethod
+    def load(cls, path, settings):
+        """Load the manifest; it starts empty if missing, unreadable or made with another model pack or profile."""
+        manifest = cls(path, settings)
+        try:
+            with open(path) as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return manifest
+        if data.get("version") == MANIFEST_VERSION and data.get("settings") == manifest.settings:
+            manifest.students = data.get("students", {})
+        return manifest
+
+    def plan(self, scan, gallery_ids):
+        """
+        Split scanned folders into (to_train, unchanged, removed). A folder is
+        unchanged when its photos hash the same as last time and it is still
+        in the gallery (or had no usable face last time either).
+        """
+        gallery_ids = {str(i).lower() for i in gallery_ids}
+        to_train, unchanged = [], []
+        for folder, images in scan.items():
+            entry = self.students.get(folder)
+            same_photos = entry is not None and entry.get("images") == images
+            in_gallery = folder.lower() in gallery_ids or (entry is not None and not entry.get("embedded"))
+            (unchanged if same_photos and in_gallery else to_train).append(folder)
+        removed = sorted(set(self.students) - set(scan))
+        return to_train, unchanged, removed
+
+    def record(self, folder, images, embedded):
+        self.students[folder] = {"images": images, "embedded": bool(embedded), **self.entry_settings}
+
+    def remove(self, folder):
+        self.students.pop(folder, None)
+
+    def save(self):
+        """Write atomically (temp file + rename), like the gallery itself."""
+        tmp_path = f"{self.path}.tmp.{os.getpid()}"
+        with open(tmp_path, "w") as f:
+            json.dump({"version": MANIFEST_VERSION, "settings": self.settings, "students": self.students}, f, indent=1)
+        os.replace(tmp_path, self.path)